@@ -0,0 +1,233 @@
+import asyncio
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import DateTime, String, bindparam, column, or_, select, update, values
+
+from .database import SessionLocal
+from .models import Device
+from .cache import device_cache
+from .detector import status_detector
+from .metrics import admission_counter, admission_in_flight, admission_flush_latency
+
+# Admission control settings
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "false").lower() in ("1", "true", "yes")
+ADMISSION_MIN_INTERVAL = float(os.getenv("ADMISSION_MIN_INTERVAL", "5.0"))       # seconds per token, per device
+ADMISSION_BURST = int(os.getenv("ADMISSION_BURST", "3"))                         # back-to-back beats admitted
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))      # writes in flight; 0 = no limit
+ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "1.0"))         # seconds, shortest retry hint
+ADMISSION_RETRY_JITTER = float(os.getenv("ADMISSION_RETRY_JITTER", "4.0"))       # hints spread up to base x (1 + this)
+ADMISSION_FLUSH_INTERVAL = float(os.getenv("ADMISSION_FLUSH_INTERVAL", "1.0"))   # seconds between last_seen bumps
+
+# Rows per UPDATE ... FROM (VALUES ...) statement (two bind parameters each)
+BUMP_CHUNK_SIZE = 10000
+
+class Overloaded(Exception):
+    """Raised when a worker already has its maximum of heartbeat writes in flight"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many heartbeats in flight, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Per-device token buckets and a per-worker write limit in front of ingestion
+
+    Each device holds up to ``burst`` tokens, refilled at one per
+    ``min_interval`` seconds. A heartbeat that finds a token takes the normal
+    write path. One that does not is redundant: it is collapsed into a
+    pending last_seen bump, and a background task writes all bumps with one
+    batched UPDATE per ``flush_interval``. So a device looping in its
+    firmware costs at most one row update per flush.
+
+    Beyond ``max_concurrent`` writes in flight, heartbeats are refused with
+    429 and a randomized Retry-After, so devices turned away by a reconnect
+    storm do not all come back in the same second.
+    """
+
+    def __init__(self, min_interval=ADMISSION_MIN_INTERVAL, burst=ADMISSION_BURST,
+                 max_concurrent=ADMISSION_MAX_CONCURRENT, retry_after=ADMISSION_RETRY_AFTER,
+                 retry_jitter=ADMISSION_RETRY_JITTER, flush_interval=ADMISSION_FLUSH_INTERVAL):
+        self.min_interval = min_interval
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.retry_base = retry_after
+        self.retry_jitter = retry_jitter
+        self.flush_interval = flush_interval
+        self.buckets = {}   # device_id -> [tokens, monotonic time of the last refill]
+        self.bumps = {}     # device_id -> latest coalesced last_seen
+        self.in_flight = 0
+        self._swept = time.monotonic()
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start writing coalesced bumps on the running event loop"""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Admission control started ({self.burst} beats per device, then one per {self.min_interval}s; "
+              f"{self.max_concurrent or 'unlimited'} writes in flight)")
+
+    def admit(self, device_id, now=None):
+        """Take a token for ``device_id``; False means the heartbeat should be coalesced"""
+        if not self.running:
+            return True
+        now = time.monotonic() if now is None else now
+        bucket = self.buckets.get(device_id)
+        if bucket is None:
+            self.buckets[device_id] = [self.burst - 1, now]
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) / self.min_interval)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return False
+            bucket[0] = tokens - 1
+        admission_counter.labels(result='admitted').inc()
+        return True
+
+    def coalesce(self, device_id, seen_at: datetime):
+        """Fold a redundant heartbeat into the device's pending last_seen bump"""
+        if device_id not in self.bumps or seen_at > self.bumps[device_id]:
+            self.bumps[device_id] = seen_at
+        admission_counter.labels(result='coalesced').inc()
+
+    def admit_batch(self, heartbeats, seen_at: datetime):
+        """Admitted heartbeats of a batch (one token per device); returns (heartbeats, beats coalesced)"""
+        if not self.running:
+            return heartbeats, 0
+        refused = {device_id for device_id in {h.device_id for h in heartbeats} if not self.admit(device_id)}
+        if not refused:
+            return heartbeats, 0
+        admitted = [heartbeat for heartbeat in heartbeats if heartbeat.device_id not in refused]
+        for heartbeat in heartbeats:
+            if heartbeat.device_id in refused:
+                self.coalesce(heartbeat.device_id, seen_at)
+        return admitted, len(heartbeats) - len(admitted)
+
+    def retry_after(self):
+        """Randomized retry hint, spread over [base, base x (1 + jitter)] seconds"""
+        return self.retry_base * (1 + random.random() * self.retry_jitter)
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the worker's write slots; raises Overloaded when none is free"""
+        if not self.running:
+            yield
+            return
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            admission_counter.labels(result='rejected').inc()
+            raise Overloaded(self.retry_after())
+        self.in_flight += 1
+        admission_in_flight.set(self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            admission_in_flight.set(self.in_flight)
+
+    def sweep(self, now=None):
+        """Forget buckets that have refilled completely; a full bucket behaves like a new device"""
+        now = time.monotonic() if now is None else now
+        refill = self.burst * self.min_interval
+        self.buckets = {device_id: bucket for device_id, bucket in self.buckets.items() if now - bucket[1] < refill}
+        self._swept = now
+
+    async def flush(self):
+        """Write every pending last_seen bump"""
+        if not self.bumps:
+            return 0
+        bumps, self.bumps = self.bumps, {}
+        start_time = time.time()
+        try:
+            bumped = await asyncio.to_thread(self._write, bumps)
+        except Exception as e:
+            print(f"❌ Writing {len(bumps)} coalesced heartbeats failed: {e}")
+            # Keep them for the next flush underneath anything newer
+            for device_id, seen_at in bumps.items():
+                if device_id not in self.bumps or seen_at > self.bumps[device_id]:
+                    self.bumps[device_id] = seen_at
+            raise
+        finally:
+            admission_flush_latency.observe(time.time() - start_time)
+        for device_id, seen_at in bumped:
+            status_detector.observe(device_id, seen_at)
+            device_cache.apply({"device_id": device_id, "last_seen": seen_at})
+        return len(bumped)
+
+    @staticmethod
+    def _write(bumps: dict):
+        """Apply the bumps; returns the (device_id, last_seen) rows actually moved
+
+        Deleted devices match no row, so they are not brought back into tracking.
+        """
+        devices = Device.__table__
+        items = list(bumps.items())
+        bumped = []
+        db = SessionLocal()
+        try:
+            if db.bind.dialect.name == "postgresql":
+                # One UPDATE ... FROM (VALUES ...) per chunk instead of a round trip per device
+                for start in range(0, len(items), BUMP_CHUNK_SIZE):
+                    bumped_values = values(
+                        column("device_id", String), column("last_seen", DateTime), name="bumped"
+                    ).data(items[start:start + BUMP_CHUNK_SIZE])
+                    # Never move last_seen backwards past a write that landed meanwhile
+                    bumped += db.execute(
+                        update(devices)
+                        .where(devices.c.device_id == bumped_values.c.device_id)
+                        .where(or_(devices.c.last_seen.is_(None), devices.c.last_seen < bumped_values.c.last_seen))
+                        .values(last_seen=bumped_values.c.last_seen)
+                        .returning(devices.c.device_id, devices.c.last_seen)
+                    ).all()
+            else:
+                db.execute(
+                    update(devices)
+                    .where(devices.c.device_id == bindparam("b_device_id"))
+                    .where(or_(devices.c.last_seen.is_(None), devices.c.last_seen < bindparam("b_last_seen")))
+                    .values(last_seen=bindparam("b_last_seen")),
+                    [{"b_device_id": device_id, "b_last_seen": seen_at} for device_id, seen_at in items]
+                )
+                # No RETURNING for executemany here; read back the rows now holding their bump
+                for start in range(0, len(items), BUMP_CHUNK_SIZE):
+                    device_ids = [device_id for device_id, _ in items[start:start + BUMP_CHUNK_SIZE]]
+                    rows = db.execute(
+                        select(devices.c.device_id, devices.c.last_seen).where(devices.c.device_id.in_(device_ids))
+                    )
+                    bumped += [row for row in rows if row.last_seen == bumps[row.device_id]]
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return [(device_id, last_seen) for device_id, last_seen in bumped]
+
+    async def _run(self):
+        while not self._stopping:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Already logged; the bumps are retried on the next flush
+            if time.monotonic() - self._swept >= self.burst * self.min_interval:
+                self.sweep()
+
+    async def stop(self):
+        """Stop the flush task and write the remaining bumps"""
+        if self._task is not None:
+            self._stopping = True
+            await asyncio.wait({self._task}, timeout=self.flush_interval + 5)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            print(f"⚠️  Admission control shut down with {len(self.bumps)} coalesced heartbeats unwritten")
+
+admission_controller = AdmissionController()
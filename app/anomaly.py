@@ -0,0 +1,287 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .metrics import anomalous_devices_gauge, anomaly_scoring_latency
+
+# Anomaly scoring settings
+ANOMALY_ENABLED = os.getenv("ANOMALY_ENABLED", "true").lower() in ("1", "true", "yes")
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.1"))                        # EWMA weight of the newest sample
+ANOMALY_MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "5"))                # samples before a device is scored
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "4.0"))                # score at which a device is anomalous
+ANOMALY_SCORE_INTERVAL = float(os.getenv("ANOMALY_SCORE_INTERVAL", "5.0"))      # seconds between fleet passes
+ANOMALY_DRAIN_WINDOW = float(os.getenv("ANOMALY_DRAIN_WINDOW", "300"))          # min seconds per drain sample
+
+# Floors on the deviation scales, so a perfectly regular device is not flagged for jitter
+GAP_SCALE_RATIO = 0.1       # of its mean interval
+GAP_SCALE_MIN = 1.0         # seconds
+DRAIN_SCALE_MIN = 1.0       # percent per hour
+
+EPOCH = datetime(1970, 1, 1)
+
+# One queued heartbeat: (slot, epoch seconds, battery or NaN)
+PENDING_DTYPE = np.dtype([('slot', np.int64), ('time', np.float64), ('battery', np.float32)])
+
+def timestamp(value: datetime) -> float:
+    """Seconds since the epoch for a naive UTC datetime"""
+    return (value - EPOCH).total_seconds()
+
+class AnomalyEngine:
+    """Per-device streaming statistics in NumPy arrays, scored fleet-wide in one pass
+
+    Each device owns a slot in a set of parallel arrays holding the EWMA mean
+    and variance of its heartbeat interval and of its battery drain rate.
+    Heartbeats only append to a pending list under a brief lock; ``score()``
+    swaps that list out, then folds it into the arrays and rescores every
+    device with array arithmetic, without a per-device Python loop and
+    without holding the lock heartbeats need. Only the scoring thread writes
+    the arrays: it also grows them for new slots and clears removed ones.
+
+    A device's score is the larger of two one-sided z-scores: how far its
+    current silence exceeds its usual interval, and how far its latest
+    drain rate exceeds its usual drain. A device that always beats every 90s
+    scores 0 at 80s of silence; one that beats every 10s scores high.
+    """
+
+    ARRAYS = (
+        'last_seen', 'gap_mean', 'gap_var', 'gap_count', 'battery', 'battery_at',
+        'drain_mean', 'drain_var', 'drain_count', 'drain_score', 'scores'
+    )
+
+    def __init__(self, capacity=1024, alpha=ANOMALY_ALPHA, min_samples=ANOMALY_MIN_SAMPLES,
+                 threshold=ANOMALY_THRESHOLD, interval=ANOMALY_SCORE_INTERVAL, drain_window=ANOMALY_DRAIN_WINDOW):
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.threshold = threshold
+        self.interval = interval
+        self.drain_window = drain_window
+        self.lock = threading.Lock()
+        # Serializes scoring passes, the only writers of the arrays
+        self.score_lock = threading.Lock()
+        self.slots = {}
+        self.free_slots = []
+        # Slots of removed devices, cleared by the next pass before they are reused
+        self.released = []
+        self.size = 0
+        self.pending = []
+        self.anomalous_count = 0
+        self.scored_at = None
+        self._allocate(capacity)
+        self._task = None
+        self._stopping = False
+
+    @staticmethod
+    def _arrays(capacity):
+        return {
+            'last_seen': np.full(capacity, np.nan),           # epoch seconds
+            'gap_mean': np.zeros(capacity, np.float32),        # seconds
+            'gap_var': np.zeros(capacity, np.float32),
+            'gap_count': np.zeros(capacity, np.int32),
+            'battery': np.full(capacity, np.nan, np.float32),  # reading at the start of the drain window
+            'battery_at': np.full(capacity, np.nan),
+            'drain_mean': np.zeros(capacity, np.float32),      # percent per hour
+            'drain_var': np.zeros(capacity, np.float32),
+            'drain_count': np.zeros(capacity, np.int32),
+            'drain_score': np.zeros(capacity, np.float32),
+            'scores': np.zeros(capacity, np.float32),
+        }
+
+    def _allocate(self, capacity, arrays=None):
+        # Readers check slots against capacity, so it only grows once every array has
+        for name, values in (arrays or self._arrays(capacity)).items():
+            setattr(self, name, values)
+        self.capacity = capacity
+
+    def _grow(self, size):
+        capacity = self.capacity
+        while capacity < size:
+            capacity *= 2
+        arrays = self._arrays(capacity)
+        for name, values in arrays.items():
+            old = getattr(self, name)
+            values[:len(old)] = old
+        self._allocate(capacity, arrays)
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start scoring the fleet on the running event loop"""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Anomaly scoring started (every {self.interval}s, threshold {self.threshold})")
+
+    def observe(self, device_id, last_seen: datetime, battery_level=None):
+        """Queue one heartbeat; applied on the next scoring pass"""
+        if not self.running:
+            return
+        with self.lock:
+            slot = self.slots.get(device_id)
+            if slot is None:
+                slot = self._assign(device_id)
+            self.pending.append((slot, timestamp(last_seen), np.nan if battery_level is None else battery_level))
+
+    def _assign(self, device_id):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            # The arrays grow on the next scoring pass
+            slot = self.size
+            self.size += 1
+        self.slots[device_id] = slot
+        return slot
+
+    def remove(self, device_id):
+        """Forget a deleted device and free its slot"""
+        with self.lock:
+            slot = self.slots.pop(device_id, None)
+            if slot is None:
+                return
+            self.pending = [entry for entry in self.pending if entry[0] != slot]
+            self.released.append(slot)
+
+    def _clear(self, slots):
+        for name in self.ARRAYS:
+            getattr(self, name)[slots] = np.nan if name in ('last_seen', 'battery', 'battery_at') else 0
+
+    def score_of(self, device_id):
+        """Score from the latest pass, or None until the device has enough history"""
+        slot = self.slots.get(device_id)
+        gap_count, drain_count, scores = self.gap_count, self.drain_count, self.scores
+        if slot is None or slot >= min(len(gap_count), len(drain_count), len(scores)):
+            return None
+        if max(gap_count[slot], drain_count[slot]) < self.min_samples:
+            return None
+        return round(float(scores[slot]), 3)
+
+    def observe_many(self, slots, times, batteries):
+        """Fold arrays of heartbeats (slot, epoch seconds, battery or NaN) into the statistics"""
+        if not len(slots):
+            return
+        if np.bincount(slots).max() == 1:
+            # At most one heartbeat per device (the common case): no ordering needed
+            self._update(slots, times, batteries)
+            return
+        # Apply each device's heartbeats in time order: round k takes every device's k-th heartbeat
+        order = np.lexsort((times, slots))
+        slots, times, batteries = slots[order], times[order], batteries[order]
+        index = np.arange(len(slots))
+        starts = np.r_[True, slots[1:] != slots[:-1]]
+        rank = index - np.maximum.accumulate(np.where(starts, index, 0))
+        for k in range(int(rank.max()) + 1):
+            selected = rank == k
+            self._update(slots[selected], times[selected], batteries[selected])
+
+    def _update(self, slots, times, batteries):
+        """One heartbeat per slot: EWMA updates of interval and drain statistics"""
+        previous = self.last_seen[slots]
+        newer = np.isnan(previous) | (times > previous)
+        slots, times, batteries, previous = slots[newer], times[newer], batteries[newer], previous[newer]
+
+        # Interval between heartbeats
+        has_gap = ~np.isnan(previous)
+        gap_slots = slots[has_gap]
+        gaps = (times[has_gap] - previous[has_gap]).astype(np.float32)
+        self._ewma(self.gap_mean, self.gap_var, self.gap_count, gap_slots, gaps)
+        self.last_seen[slots] = times
+
+        # Battery drain over windows of at least drain_window seconds
+        has_battery = ~np.isnan(batteries)
+        slots, times, batteries = slots[has_battery], times[has_battery], batteries[has_battery]
+        window = times - self.battery_at[slots]
+        start = np.isnan(window) | (self.battery[slots] < batteries)   # first reading, or recharged
+        due = ~start & (window >= self.drain_window)
+        drain_slots = slots[due]
+        rates = ((self.battery[drain_slots] - batteries[due]) * 3600 / window[due]).astype(np.float32)
+        # One-step-ahead residual against the statistics before this sample
+        scale = np.maximum(np.sqrt(self.drain_var[drain_slots]), DRAIN_SCALE_MIN)
+        self.drain_score[drain_slots] = np.where(
+            self.drain_count[drain_slots] > 0,
+            np.maximum((rates - self.drain_mean[drain_slots]) / scale, 0),
+            0
+        )
+        self._ewma(self.drain_mean, self.drain_var, self.drain_count, drain_slots, rates)
+        restart = start | due
+        self.battery[slots[restart]] = batteries[restart]
+        self.battery_at[slots[restart]] = times[restart]
+
+    def _ewma(self, means, variances, counts, slots, values):
+        mean = means[slots]
+        diff = values - mean
+        first = counts[slots] == 0
+        means[slots] = np.where(first, values, mean + self.alpha * diff)
+        variances[slots] = np.where(first, 0, (1 - self.alpha) * (variances[slots] + self.alpha * diff * diff))
+        counts[slots] += 1
+
+    def score(self, now: datetime = None):
+        """Apply pending heartbeats and rescore every device; returns the anomalous count"""
+        now = timestamp(now or datetime.utcnow())
+        # Heartbeats wait on this lock, so hold it only to take the queued work
+        with self.lock:
+            pending, self.pending = self.pending, []
+            released, self.released = self.released, []
+            size = self.size
+        with self.score_lock:
+            if size > self.capacity:
+                self._grow(size)
+            if released:
+                self._clear(released)
+            if pending:
+                self.observe_many(*self.pending_arrays(pending))
+            self.anomalous_count = self.score_all(now)
+            self.scored_at = now
+        if released:
+            with self.lock:
+                self.free_slots.extend(released)
+        return self.anomalous_count
+
+    @staticmethod
+    def pending_arrays(pending):
+        """(slots, times, batteries) arrays from queued (slot, epoch seconds, battery or NaN) tuples"""
+        queued = np.fromiter(pending, PENDING_DTYPE, len(pending))
+        return queued['slot'], queued['time'], queued['battery']
+
+    def score_all(self, now: float):
+        """Vectorized scoring pass over every slot as of ``now`` (epoch seconds)"""
+        # Slots assigned since the arrays last grew are scored from the next pass
+        n = min(self.size, self.capacity)
+        mean = self.gap_mean[:n]
+        scale = np.maximum(np.sqrt(self.gap_var[:n]), np.maximum(mean * GAP_SCALE_RATIO, GAP_SCALE_MIN))
+        silence = (now - self.last_seen[:n]).astype(np.float32)
+        gap_score = np.where(self.gap_count[:n] >= self.min_samples, (silence - mean) / scale, 0)
+        drain_score = np.where(self.drain_count[:n] >= self.min_samples, self.drain_score[:n], 0)
+        scores = np.maximum(np.maximum(gap_score, drain_score), 0)
+        # Free slots have NaN timestamps
+        np.nan_to_num(scores, copy=False, nan=0.0)
+        self.scores[:n] = scores
+        anomalous = int(np.count_nonzero(scores >= self.threshold))
+        anomalous_devices_gauge.labels(signal='any').set(anomalous)
+        anomalous_devices_gauge.labels(signal='interval').set(int(np.count_nonzero(gap_score >= self.threshold)))
+        anomalous_devices_gauge.labels(signal='battery_drain').set(
+            int(np.count_nonzero(drain_score >= self.threshold))
+        )
+        return anomalous
+
+    async def _run(self):
+        while not self._stopping:
+            await asyncio.sleep(self.interval)
+            start_time = time.time()
+            try:
+                await asyncio.to_thread(self.score)
+            except Exception as e:
+                print(f"❌ Anomaly scoring failed: {e}")
+            finally:
+                anomaly_scoring_latency.observe(time.time() - start_time)
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            await asyncio.wait({self._task}, timeout=self.interval + 5)
+            self._task = None
+
+anomaly_engine = AnomalyEngine()
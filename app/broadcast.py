@@ -0,0 +1,76 @@
+import asyncio
+import json
+from contextlib import contextmanager
+
+from .metrics import broadcast_subscribers, broadcast_dropped_counter
+
+# Seconds between keep-alive comments on idle event streams
+SSE_KEEPALIVE_SECONDS = 15.0
+
+class Broadcaster:
+    """Fans server events out to every connected stream subscriber
+
+    Each event is serialized once when published; subscribers get the
+    pre-encoded payload through their own bounded queue, and a subscriber
+    that falls behind loses events rather than slowing down publishers.
+    Publishing is safe from worker threads: the queues are only touched on
+    the subscribers' event loop.
+    """
+
+    def __init__(self, queue_size=1000):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self._next_id = 0
+        self._loop = None
+
+    def publish(self, event: str, data: dict):
+        """Send ``data`` as an ``event`` to every subscriber"""
+        if not self.subscribers:
+            return
+        payload = json.dumps(data, default=str)
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._deliver(event, payload)
+        elif self._loop is not None and not self._loop.is_closed():
+            # asyncio queues are not thread-safe; hand the event to the loop
+            self._loop.call_soon_threadsafe(self._deliver, event, payload)
+
+    def _deliver(self, event, payload):
+        self._next_id += 1
+        message = (self._next_id, event, payload)
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                broadcast_dropped_counter.inc()
+
+    @contextmanager
+    def subscribe(self):
+        """Register a subscriber queue for the duration of the ``with`` block"""
+        self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        broadcast_subscribers.set(len(self.subscribers))
+        try:
+            yield queue
+        finally:
+            self.subscribers.discard(queue)
+            broadcast_subscribers.set(len(self.subscribers))
+
+async def sse_stream(broadcaster: Broadcaster, events=None, keepalive=SSE_KEEPALIVE_SECONDS):
+    """Yield server-sent events from ``broadcaster``, optionally limited to ``events``"""
+    with broadcaster.subscribe() as queue:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event_id, event, payload = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if events is None or event in events:
+                yield f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+
+event_broadcaster = Broadcaster()
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from .database import SessionLocal, STORAGE_BACKEND
+from .ingestion import heartbeat_fields, upsert_heartbeats
+from .detector import status_detector
+from .metrics import (
+    ingest_queue_depth, ingest_flush_latency, ingest_flush_size,
+    ingest_coalesced_counter, ingest_rejected_counter, ingest_flush_failures
+)
+
+# Write-behind ingestion settings
+# On by default for a SQLite file: it has a single writer, so heartbeats are grouped into one transaction per flush
+INGEST_BUFFER_ENABLED = os.getenv(
+    "INGEST_BUFFER_ENABLED", "true" if STORAGE_BACKEND == "sqlite" else "false"
+).lower() in ("1", "true", "yes")
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))       # seconds
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "2000"))                # devices
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "50000"))                 # devices
+INGEST_BACKPRESSURE_TIMEOUT = float(os.getenv("INGEST_BACKPRESSURE_TIMEOUT", "2.0"))
+INGEST_DRAIN_TIMEOUT = float(os.getenv("INGEST_DRAIN_TIMEOUT", "10.0"))
+
+class BufferFull(Exception):
+    """Raised when the ingestion buffer cannot accept a new device in time"""
+
+class HeartbeatBuffer:
+    """In-process write-behind buffer that coalesces heartbeats per device_id
+
+    Heartbeats are merged into one pending record per device (latest
+    last_seen, battery and signal win) and written by a background task
+    with a single bulk upsert whenever the buffer reaches ``flush_size``
+    devices or ``flush_interval`` seconds have passed.
+    """
+
+    def __init__(self, flush_interval=INGEST_FLUSH_INTERVAL, flush_size=INGEST_FLUSH_SIZE,
+                 max_pending=INGEST_QUEUE_MAX, backpressure_timeout=INGEST_BACKPRESSURE_TIMEOUT):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.backpressure_timeout = backpressure_timeout
+        self.pending = {}
+        self._task = None
+        self._wake = None
+        self._flushed = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the background flush task on the running event loop"""
+        self._wake = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Ingestion buffer started (flush every {self.flush_interval}s or {self.flush_size} devices)")
+
+    async def submit(self, record: dict):
+        """Queue a heartbeat record, coalescing with any pending record for the same device"""
+        device_id = record["device_id"]
+        pending = self.pending.get(device_id)
+        if pending is not None:
+            ingest_coalesced_counter.inc()
+            self._merge(pending, record)
+            return pending
+
+        # Backpressure: only new devices grow the buffer
+        deadline = time.monotonic() + self.backpressure_timeout
+        while len(self.pending) >= self.max_pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                ingest_rejected_counter.inc()
+                raise BufferFull(f"Ingestion buffer full ({len(self.pending)} devices pending)")
+            self._flushed.clear()
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._flushed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        # A flush may have run while waiting; re-check for a pending record
+        pending = self.pending.get(device_id)
+        if pending is not None:
+            ingest_coalesced_counter.inc()
+            self._merge(pending, record)
+            return pending
+
+        self.pending[device_id] = dict(record)
+        ingest_queue_depth.set(len(self.pending))
+        if len(self.pending) >= self.flush_size:
+            self._wake.set()
+        return self.pending[device_id]
+
+    @staticmethod
+    def _merge(pending: dict, record: dict):
+        """Fold ``record`` into ``pending``, keeping the newest non-null values"""
+        if record["last_seen"] >= pending["last_seen"]:
+            pending.update({k: v for k, v in record.items() if v is not None})
+        else:
+            for key, value in record.items():
+                if pending.get(key) is None:
+                    pending[key] = value
+
+    async def flush(self):
+        """Write every pending record with one bulk upsert"""
+        if not self.pending:
+            return 0
+
+        batch, self.pending = self.pending, {}
+        ingest_queue_depth.set(0)
+        start_time = time.time()
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            ingest_flush_failures.inc()
+            print(f"❌ Ingestion buffer flush of {len(batch)} devices failed: {e}")
+            # Put the batch back underneath anything that arrived meanwhile
+            for device_id, record in batch.items():
+                if device_id in self.pending:
+                    self._merge(self.pending[device_id], record)
+                else:
+                    self.pending[device_id] = record
+            ingest_queue_depth.set(len(self.pending))
+            raise
+        finally:
+            ingest_flush_latency.observe(time.time() - start_time)
+
+        ingest_flush_size.observe(len(batch))
+        # Heartbeats were tracked when they arrived but are only readable now, so read snapshots must rebuild
+        with status_detector.lock:
+            status_detector.version += 1
+        self._flushed.set()
+        return len(batch)
+
+    @staticmethod
+    def _write(batch: dict):
+        db = SessionLocal()
+        try:
+            upsert_heartbeats(db, batch)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception:
+                # Already logged; back off for one interval before retrying
+                await asyncio.sleep(self.flush_interval)
+
+    async def stop(self, drain_timeout=INGEST_DRAIN_TIMEOUT):
+        """Stop the flush task and drain pending records within ``drain_timeout`` seconds"""
+        deadline = time.monotonic() + drain_timeout
+        if self._task is not None:
+            # Let the flush task finish its current iteration rather than cancelling it mid-write
+            self._stopping = True
+            self._wake.set()
+            await asyncio.wait({self._task}, timeout=drain_timeout)
+            self._task = None
+
+        while self.pending and time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(self.flush(), timeout=deadline - time.monotonic())
+            except Exception:
+                await asyncio.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+
+        if self.pending:
+            print(f"⚠️  Ingestion buffer shut down with {len(self.pending)} devices unflushed")
+        else:
+            print("✅ Ingestion buffer drained")
+
+ingest_buffer = HeartbeatBuffer()
+
+def heartbeat_record(heartbeat, seen_at: datetime = None) -> dict:
+    """Build a buffer record from a HeartbeatRequest"""
+    record = heartbeat_fields(heartbeat)
+    record["last_seen"] = seen_at or datetime.utcnow()
+    return record
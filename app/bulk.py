@@ -0,0 +1,347 @@
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from pydantic import ValidationError
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Integer, MetaData, String, Table, cast, func, literal, literal_column, null, select, true
+)
+from sqlalchemy.dialects import postgresql, sqlite
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports are refused without it
+    pa = pq = None
+
+from .database import AsyncSessionLocal
+from .models import Device
+from .schemas import DeviceProvision
+from .crud import device_columns, device_filters
+from .anomaly import anomaly_engine
+from .cache import device_cache
+from .detector import status_detector
+from .metrics import devices_exported_counter, devices_imported_counter
+
+# Bulk export/import settings
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))         # rows per server-side cursor fetch
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "50000"))        # rows per COPY into the staging table
+IMPORT_SPOOL_SIZE = int(os.getenv("IMPORT_SPOOL_SIZE", str(8 * 2**20)))  # upload bytes kept in memory before disk
+IMPORT_MAX_ERRORS = 20                                                  # rejected rows described in the summary
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+IMPORT_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+IMPORT_COLUMNS = ('device_id', 'name', 'location', 'expected_interval')
+
+def export_query(fields, status=None, location=None, battery_below=None, now=None):
+    """Unordered SELECT of every matching device, fetched EXPORT_BATCH_SIZE rows at a time"""
+    return (
+        select(*device_columns(fields, now), Device.device_id.label('_device_id'))
+        .where(*device_filters(status, location, battery_below, now))
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+def export_records(rows, fields):
+    """Rows from export_query() as tuples in ``fields`` order, anomaly scores filled in from memory"""
+    if 'anomaly_score' not in fields:
+        return [tuple(row[:-1]) for row in rows]
+    # Every other field is selected, in order, so the score goes back at its own position
+    position = fields.index('anomaly_score')
+    return [row[:position] + (anomaly_engine.score_of(row[-1]),) + row[position:-1] for row in rows]
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class CsvEncoder:
+    def __init__(self, fields):
+        self.fields = fields
+
+    def header(self):
+        return (",".join(self.fields) + "\r\n").encode()
+
+    def encode(self, records):
+        out = io.StringIO()
+        csv.writer(out).writerows([export_value(value) for value in record] for record in records)
+        return out.getvalue().encode()
+
+    def finish(self):
+        return b""
+
+class NdjsonEncoder:
+    def __init__(self, fields):
+        self.fields = fields
+
+    def header(self):
+        return b""
+
+    def encode(self, records):
+        return "".join(
+            json.dumps(dict(zip(self.fields, record)), default=export_value) + "\n" for record in records
+        ).encode()
+
+    def finish(self):
+        return b""
+
+class ChunkSink:
+    """Write-only file for ParquetWriter that hands over the bytes written so far
+
+    tell() keeps counting across take() calls, so the offsets the writer
+    records in the file footer stay correct.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+class ParquetEncoder:
+    """One Parquet row group per cursor batch; the footer is written by finish()"""
+
+    def __init__(self, fields):
+        types = {
+            'id': pa.int64(), 'device_id': pa.string(), 'name': pa.string(), 'status': pa.string(),
+            'last_seen': pa.timestamp('us'), 'battery_level': pa.float64(), 'signal_strength': pa.float64(),
+            'location': pa.string(), 'expected_interval': pa.int32(), 'created_at': pa.timestamp('us'),
+            'updated_at': pa.timestamp('us'), 'anomaly_score': pa.float64(),
+        }
+        self.schema = pa.schema([(field, types[field]) for field in fields])
+        self.sink = ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema)
+
+    def header(self):
+        return b""
+
+    def encode(self, records):
+        columns = [pa.array(values, type=field.type) for values, field in zip(zip(*records), self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        return self.sink.take()
+
+    def finish(self):
+        self.writer.close()
+        return self.sink.take()
+
+ENCODERS = {"csv": CsvEncoder, "ndjson": NdjsonEncoder, "parquet": ParquetEncoder}
+
+async def stream_export(format, fields, status=None, location=None, battery_below=None):
+    """Yield the matching devices encoded as ``format``, one server-side cursor batch at a time
+
+    Memory stays at one batch however large the fleet is. Encoding runs in a
+    worker thread so a large export does not stall other requests.
+    """
+    encoder = ENCODERS[format](fields)
+    yield encoder.header()
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(export_query(fields, status, location, battery_below))
+        async for rows in result.partitions():
+            yield await asyncio.to_thread(encoder.encode, export_records(rows, fields))
+            devices_exported_counter.labels(format=format).inc(len(rows))
+    yield await asyncio.to_thread(encoder.finish)
+
+# Per-transaction staging table the upload is COPYed (on SQLite, inserted) into before the merge
+device_import = Table(
+    "device_import", MetaData(),
+    Column("line", BigInteger, nullable=False),
+    Column("device_id", String, nullable=False),
+    Column("name", String),
+    Column("location", String),
+    Column("expected_interval", Integer),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+def device_merge(now: datetime, dialect="postgresql"):
+    """INSERT ... SELECT ... ON CONFLICT merging the staged rows into devices
+
+    The last line for a device wins within one upload. Provisioned devices
+    start offline with no last_seen; existing devices keep their heartbeat
+    state and only take the provisioning columns that were given. Returns
+    (device_id, created) rows.
+    """
+    staged = device_import.c
+    columns = (staged.device_id, staged.name, staged.location, staged.expected_interval)
+    if dialect == "postgresql":
+        latest = select(*columns).distinct(staged.device_id).order_by(staged.device_id, staged.line.desc()).subquery()
+        insert = postgresql.insert
+        # xmax is zero only for rows inserted (not updated) by this statement
+        created = literal_column("(xmax = 0)")
+    else:
+        ranked = select(
+            *columns, func.row_number().over(partition_by=staged.device_id, order_by=staged.line.desc()).label("rank")
+        ).subquery()
+        latest = select(*(ranked.c[column.name] for column in columns)).where(ranked.c.rank == 1).subquery()
+        insert = sqlite.insert
+        # Only rows inserted by this statement carry its created_at
+        created = Device.created_at == now
+    stmt = insert(Device).from_select(
+        ['device_id', 'name', 'location', 'expected_interval', 'status', 'last_seen', 'created_at', 'updated_at'],
+        select(
+            latest.c.device_id, latest.c.name, latest.c.location, latest.c.expected_interval,
+            literal("offline"), cast(null(), DateTime), literal(now, DateTime), literal(now, DateTime)
+        # SQLite needs a WHERE clause to parse INSERT ... SELECT ... ON CONFLICT
+        ).where(true())
+    )
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[Device.device_id],
+        set_={
+            "name": func.coalesce(excluded.name, Device.name),
+            "location": func.coalesce(excluded.location, Device.location),
+            "expected_interval": func.coalesce(excluded.expected_interval, Device.expected_interval),
+            "updated_at": excluded.updated_at,
+        },
+    ).returning(Device.device_id, created.label("created"))
+
+async def stage_records(conn, records):
+    """Load validated rows into the staging table: COPY on PostgreSQL, a multi-row INSERT elsewhere"""
+    if conn.dialect.name == "postgresql":
+        copier = (await conn.get_raw_connection()).driver_connection
+        await copier.copy_records_to_table(
+            device_import.name, records=records, columns=[column.name for column in device_import.c]
+        )
+    else:
+        names = [column.name for column in device_import.c]
+        await conn.execute(device_import.insert(), [dict(zip(names, record)) for record in records])
+
+async def spool_upload(chunks):
+    """Buffer a streamed request body, spilling to disk past IMPORT_SPOOL_SIZE bytes"""
+    upload = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+    async for chunk in chunks:
+        upload.write(chunk)
+    upload.seek(0)
+    return upload
+
+def upload_rows(upload, format):
+    """(line number, raw row) for every row of a spooled upload
+
+    Raises ValueError when a CSV upload has no device_id column.
+    """
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    if format == "ndjson":
+        return ((number, line) for number, line in enumerate(text, 1) if line.strip())
+    reader = csv.DictReader(text)
+    if "device_id" not in (reader.fieldnames or ()):
+        raise ValueError("CSV header must include a device_id column")
+    return (
+        (reader.line_num, {column: value or None for column, value in row.items() if column in IMPORT_COLUMNS})
+        for row in reader
+    )
+
+def validate_rows(rows, size, errors):
+    """Validate up to ``size`` rows into staging records; returns (records, rows read)"""
+    records, read = [], 0
+    for number, raw in itertools.islice(rows, size):
+        read += 1
+        try:
+            if isinstance(raw, str):
+                device = DeviceProvision.model_validate_json(raw)
+            else:
+                device = DeviceProvision.model_validate(raw)
+        except ValidationError as e:
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({
+                    "line": number,
+                    "detail": "; ".join(
+                        f"{'.'.join(map(str, error['loc'])) or 'row'}: {error['msg']}" for error in e.errors()
+                    )
+                })
+            continue
+        records.append((number, device.device_id, device.name, device.location, device.expected_interval))
+    return records, read
+
+def track_imported(results):
+    """Start tracking created devices (offline until their first heartbeat) and drop stale cache entries"""
+    status_detector.provision(device_id for device_id, created in results if created)
+    updated = [device_id for device_id, created in results if not created]
+    for device_id in updated:
+        device_cache.invalidate(device_id)
+    if updated:
+        # New names and locations must reach the snapshot-backed reads too
+        with status_detector.lock:
+            status_detector.version += 1
+
+def progress(stage, **values):
+    return (json.dumps({"stage": stage, **values}) + "\n").encode()
+
+async def stream_import(upload, rows):
+    """COPY validated rows into a staging table, merge them into devices and yield NDJSON progress lines
+
+    Lines: {"stage": "copy", ...} after each batch, {"stage": "merge", ...}
+    before the merge, and finally {"stage": "done", ...} with the totals or
+    {"stage": "failed", ...}, in which case nothing was imported.
+    """
+    started = time.perf_counter()
+    staged = rejected = 0
+    errors = []
+    try:
+        async with AsyncSessionLocal() as db:
+            conn = await db.connection()
+            if conn.dialect.name != "postgresql":
+                # SQLite keeps temporary tables until the pooled connection closes, not until commit
+                await conn.run_sync(device_import.drop, checkfirst=True)
+            await conn.run_sync(device_import.create)
+            while True:
+                records, read = await asyncio.to_thread(validate_rows, rows, IMPORT_BATCH_SIZE, errors)
+                if not read:
+                    break
+                if records:
+                    await stage_records(conn, records)
+                staged += len(records)
+                rejected += read - len(records)
+                yield progress(
+                    "copy", rows=staged + rejected, staged=staged, rejected=rejected,
+                    elapsed=round(time.perf_counter() - started, 3)
+                )
+
+            yield progress("merge", staged=staged, elapsed=round(time.perf_counter() - started, 3))
+            results = (await db.execute(device_merge(datetime.utcnow(), conn.dialect.name))).all() if staged else []
+            await db.commit()
+    except Exception as e:
+        yield progress("failed", detail=str(e), rows=staged + rejected, elapsed=round(time.perf_counter() - started, 3))
+        return
+    finally:
+        upload.close()
+
+    await asyncio.to_thread(track_imported, results)
+    created = sum(1 for _, was_created in results if was_created)
+    devices_imported_counter.labels(result='created').inc(created)
+    devices_imported_counter.labels(result='updated').inc(len(results) - created)
+    devices_imported_counter.labels(result='rejected').inc(rejected)
+    seconds = time.perf_counter() - started
+    print(f"📦 Imported {len(results)} devices ({created} new) in {seconds:.1f}s, {rejected} rows rejected")
+    yield progress(
+        "done", rows=staged + rejected, created=created, updated=len(results) - created,
+        rejected=rejected, errors=errors, elapsed=round(seconds, 3)
+    )
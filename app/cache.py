@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+
+from .models import classify_status
+from .metrics import device_cache_hits, device_cache_misses, device_cache_evictions, device_cache_size
+
+# Device state cache settings
+DEVICE_CACHE_SIZE = int(os.getenv("DEVICE_CACHE_SIZE", "100000"))   # devices; 0 disables the cache
+DEVICE_CACHE_TTL = float(os.getenv("DEVICE_CACHE_TTL", "60"))       # seconds before an entry is re-read
+
+DEVICE_COLUMNS = (
+    'id', 'device_id', 'name', 'status', 'last_seen', 'battery_level',
+    'signal_strength', 'location', 'expected_interval', 'created_at', 'updated_at'
+)
+
+class CachedDevice:
+    """Compact copy of one devices row"""
+    __slots__ = DEVICE_COLUMNS + ('cached_at',)
+
+    def __init__(self, **columns):
+        for column in DEVICE_COLUMNS:
+            setattr(self, column, columns.get(column))
+        self.cached_at = time.monotonic()
+
+    @classmethod
+    def from_row(cls, device):
+        """Copy the columns of a Device instance (or any object with the same attributes)"""
+        return cls(**{column: getattr(device, column) for column in DEVICE_COLUMNS})
+
+    def update_status(self, now=None):
+        self.status = classify_status(self.last_seen, self.battery_level, now)
+
+class DeviceCache:
+    """Bounded LRU cache of device rows keyed by device_id
+
+    Heartbeats write through to it after their commit and deletes
+    invalidate it, so in a single process it always matches the devices
+    table. Entries older than ``ttl`` seconds are treated as misses, which
+    bounds staleness when other processes write the same devices.
+    """
+
+    def __init__(self, max_size=DEVICE_CACHE_SIZE, ttl=DEVICE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, device_id):
+        """Cached device, or None on a miss"""
+        device = self.entries.get(device_id)
+        if device is not None and time.monotonic() - device.cached_at > self.ttl:
+            del self.entries[device_id]
+            device = None
+        if device is None:
+            device_cache_misses.inc()
+            return None
+        self.entries.move_to_end(device_id)
+        device_cache_hits.inc()
+        return device
+
+    def put(self, device):
+        """Cache a copy of a committed devices row"""
+        if self.max_size <= 0:
+            return None
+        cached = CachedDevice.from_row(device)
+        self.entries[cached.device_id] = cached
+        self.entries.move_to_end(cached.device_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            device_cache_evictions.inc()
+        device_cache_size.set(len(self.entries))
+        return cached
+
+    def apply(self, record: dict):
+        """Fold an accepted heartbeat record into a cached device, if present"""
+        device = self.entries.get(record["device_id"])
+        if device is None:
+            return
+        if device.last_seen is None or record["last_seen"] > device.last_seen:
+            device.last_seen = record["last_seen"]
+            device.updated_at = record["last_seen"]
+        for column in ('name', 'battery_level', 'signal_strength', 'location'):
+            value = record.get(column)
+            if value is not None:
+                setattr(device, column, value)
+        device.update_status()
+
+    def invalidate(self, device_id):
+        if self.entries.pop(device_id, None) is not None:
+            device_cache_size.set(len(self.entries))
+
+    def clear(self):
+        self.entries.clear()
+        device_cache_size.set(0)
+
+device_cache = DeviceCache()
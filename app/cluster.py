@@ -0,0 +1,260 @@
+import asyncio
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import select, text
+
+from .database import engine, wait_for_db, SessionLocal, STORAGE_BACKEND
+from .models import Device
+from .history import history_writer, maintain_partitions, HISTORY_ENABLED
+from .detector import status_detector
+from .dashboard import dashboard_feed
+from .cache import device_cache
+from .fleet import fleet_refresher
+from .anomaly import anomaly_engine
+
+# Multi-worker settings
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))      # app processes sharing the database
+SHARED_STATE = os.getenv("SHARED_STATE", "true" if WEB_CONCURRENCY > 1 else "false").lower() in ("1", "true", "yes")
+WORKER_SYNC_INTERVAL = float(os.getenv("WORKER_SYNC_INTERVAL", "1.0"))           # seconds
+WORKER_SYNC_OVERLAP = float(os.getenv("WORKER_SYNC_OVERLAP", "2.0"))             # seconds re-read each sync
+WORKER_RECONCILE_INTERVAL = float(os.getenv("WORKER_RECONCILE_INTERVAL", "300"))  # seconds
+# Set by the gunicorn master once it has prepared the database for its workers
+DB_PREPARED = os.getenv("DB_PREPARED", "false").lower() in ("1", "true", "yes")
+
+# Schema migrations (applied with `alembic upgrade head`, at startup only for in-memory databases)
+ALEMBIC_CONFIG = os.getenv(
+    "ALEMBIC_CONFIG", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+)
+
+# PostgreSQL advisory lock keys
+SCHEMA_LOCK_KEY = 724_301
+LEADER_LOCK_KEY = 724_302
+
+@contextmanager
+def advisory_lock(key):
+    """Hold a PostgreSQL advisory lock for the ``with`` block (no-op on other databases)"""
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+            conn.commit()
+
+def schema_revisions():
+    """(revision the database is at, latest revision in migrations/)"""
+    with engine.connect() as conn:
+        current = MigrationContext.configure(conn).get_current_revision()
+    head = ScriptDirectory.from_config(Config(ALEMBIC_CONFIG)).get_current_head()
+    return current, head
+
+def migrate_memory_database():
+    """Apply every migration to the in-memory database, which starts out empty in each process"""
+    config = Config(ALEMBIC_CONFIG)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_CONFIG), "migrations"))
+    command.upgrade(config, "head")
+
+def prepare_database():
+    """Wait for the database, check its schema is migrated and maintain partitions, one process at a time"""
+    print("⏳ Waiting for database connection...")
+    if not wait_for_db():
+        print("❌ Failed to connect to database - continuing anyway")
+        return False
+    print("✅ Database connection established")
+    try:
+        current, head = schema_revisions()
+    except Exception as e:
+        print(f"⚠️  Could not check the database schema revision: {e}")
+    else:
+        if current is None and STORAGE_BACKEND == "memory":
+            migrate_memory_database()
+            current = head
+        if current is None:
+            print("❌ Database schema is not migrated - run `alembic upgrade head`")
+            return False
+        if current != head:
+            print(f"⚠️  Database schema is at revision {current}, this build expects {head}")
+        else:
+            print(f"✅ Database schema at revision {current}")
+    with advisory_lock(SCHEMA_LOCK_KEY):
+        if HISTORY_ENABLED:
+            maintain_partitions()
+    return True
+
+def changed_devices_query(since: datetime):
+    return (
+        select(
+            Device.device_id, Device.name, Device.location, Device.last_seen,
+            Device.battery_level, Device.signal_strength
+        )
+        .where(Device.last_seen > since)
+        .order_by(Device.last_seen)
+    )
+
+class LeaderLease:
+    """Session-level advisory lock electing one process to run the singleton jobs
+
+    The lock lives as long as the holding connection, so if the leader dies
+    another worker picks it up on its next ``refresh()``. Without
+    PostgreSQL (or with a single worker) this process is always the leader.
+    """
+
+    def __init__(self, key=LEADER_LOCK_KEY):
+        self.key = key
+        self.connection = None
+        self.is_leader = False
+
+    def refresh(self):
+        """Acquire the lease if it is free, or confirm we still hold it"""
+        if engine.dialect.name != "postgresql" or not SHARED_STATE:
+            self.is_leader = True
+            return True
+        try:
+            if self.connection is None:
+                self.connection = engine.connect()
+            if self.is_leader:
+                self.connection.execute(text("SELECT 1"))
+            else:
+                self.is_leader = bool(self.connection.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}
+                ).scalar())
+            self.connection.commit()
+        except Exception as e:
+            print(f"⚠️  Lost leader lease connection: {e}")
+            self.release()
+        return self.is_leader
+
+    def release(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+        self.is_leader = False
+
+class WorkerSync:
+    """Keeps this worker's in-memory device state in step with the other workers
+
+    Every worker writes heartbeats to the shared devices table, so each one
+    polls it for rows whose last_seen moved since its last poll (using the
+    (last_seen, id) index) and feeds them to its status detector, anomaly
+    engine, device cache and dashboard feed. Each poll re-reads a short overlap window so
+    transactions that commit out of order are not missed. Deletions are
+    picked up by a periodic reconcile of device ids.
+
+    Only the leader persists detected transitions, runs partition
+    maintenance and rebuilds the fleet summary; every worker detects them, so metrics and /events agree
+    whichever worker serves the request.
+    """
+
+    def __init__(self, interval=WORKER_SYNC_INTERVAL, overlap=WORKER_SYNC_OVERLAP,
+                 reconcile_interval=WORKER_RECONCILE_INTERVAL):
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self.reconcile_interval = reconcile_interval
+        self.lease = LeaderLease()
+        self.watermark = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, watermark: datetime = None):
+        """Start polling on the running event loop from ``watermark`` (default now)"""
+        self.watermark = watermark or datetime.utcnow()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Worker sync started (pid {os.getpid()}, every {self.interval}s)")
+        if engine.dialect.name != "postgresql":
+            print("⚠️  Leader election needs PostgreSQL; every worker will persist status transitions")
+
+    def poll(self):
+        """Read devices changed since the watermark; returns (device_id, name, location, last_seen, battery, signal) rows"""
+        db = SessionLocal()
+        try:
+            return db.execute(changed_devices_query(self.watermark - self.overlap)).all()
+        finally:
+            db.close()
+
+    def apply(self, rows):
+        """Feed rows newer than this worker's view into local state"""
+        for device_id, name, location, last_seen, battery_level, signal_strength in rows:
+            if last_seen > self.watermark:
+                self.watermark = last_seen
+            state = status_detector.devices.get(device_id)
+            if state is not None and state.last_seen is not None and last_seen <= state.last_seen:
+                continue
+            status_detector.observe(device_id, last_seen, battery_level, signal_strength)
+            anomaly_engine.observe(device_id, last_seen, battery_level)
+            record = {
+                "device_id": device_id,
+                "name": name,
+                "location": location,
+                "last_seen": last_seen,
+                "battery_level": battery_level,
+                "signal_strength": signal_strength,
+            }
+            device_cache.apply(record)
+            dashboard_feed.device_changed(**record)
+
+    def device_ids(self):
+        """(read_at, every device_id in the table)"""
+        db = SessionLocal()
+        try:
+            read_at = datetime.utcnow()
+            return read_at, set(db.execute(select(Device.device_id)).scalars())
+        finally:
+            db.close()
+
+    def reconcile(self, read_at, device_ids):
+        """Forget devices another worker deleted"""
+        for device_id in set(status_detector.devices) - device_ids:
+            state = status_detector.devices.get(device_id)
+            if state is not None and state.last_seen is not None and state.last_seen > read_at - self.overlap:
+                # Possibly created after the read; check again next time
+                continue
+            status_detector.remove(device_id)
+            anomaly_engine.remove(device_id)
+            device_cache.invalidate(device_id)
+            dashboard_feed.device_removed(device_id)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_reconcile = loop.time() + self.reconcile_interval
+        while not self._stopping:
+            await asyncio.sleep(self.interval)
+            try:
+                was_leader = self.lease.is_leader
+                leader = await asyncio.to_thread(self.lease.refresh)
+                status_detector.writes_enabled = history_writer.maintenance_enabled = leader
+                fleet_refresher.enabled = leader
+                if leader and not was_leader:
+                    print(f"👑 Worker {os.getpid()} is now the leader")
+
+                self.apply(await asyncio.to_thread(self.poll))
+                if loop.time() >= next_reconcile:
+                    self.reconcile(*await asyncio.to_thread(self.device_ids))
+                    next_reconcile = loop.time() + self.reconcile_interval
+            except Exception as e:
+                print(f"❌ Worker sync failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            await asyncio.wait({self._task}, timeout=self.interval + 5)
+            self._task = None
+        await asyncio.to_thread(self.lease.release)
+
+worker_sync = WorkerSync()
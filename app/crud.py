@@ -0,0 +1,146 @@
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+import base64
+import binascii
+import json
+
+from .models import Device
+from .anomaly import anomaly_engine
+
+STATUSES = ('online', 'offline', 'at-risk')
+
+async def count_by_status(db: AsyncSession, now: datetime = None):
+    """Per-status device counts from a single GROUP BY query"""
+    statuses = select(Device.status_expression(now).label("status")).subquery()
+    result = await db.execute(
+        select(statuses.c.status, func.count()).group_by(statuses.c.status)
+    )
+    counts = dict.fromkeys(STATUSES, 0)
+    for status, count in result:
+        counts[status] = count
+    return counts
+
+def recent_activity_query(now: datetime = None):
+    """Count of devices that checked in within the last hour"""
+    now = now or datetime.utcnow()
+    return select(func.count(Device.id)).where(Device.last_seen >= now - timedelta(hours=1))
+
+# Columns a listing can project, in DeviceResponse order
+DEVICE_FIELDS = (
+    'id', 'device_id', 'name', 'status', 'last_seen', 'battery_level',
+    'signal_strength', 'location', 'expected_interval', 'created_at', 'updated_at', 'anomaly_score'
+)
+# Fields filled in from memory after the query rather than selected
+COMPUTED_FIELDS = ('anomaly_score',)
+
+# Keyset orderings: name -> (sort column, descending)
+DEVICE_ORDERINGS = {
+    'device_id': ('device_id', False),
+    'last_seen': ('last_seen', False),
+    '-last_seen': ('last_seen', True),
+}
+
+def encode_cursor(value, row_id):
+    """Opaque cursor for the row after which the next page starts"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_key: str):
+    """Inverse of encode_cursor(); raises ValueError on a malformed cursor or one from another order"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, row_id = json.loads(payload)
+        # Both sort keys are encoded as strings: a device_id, or an ISO timestamp for last_seen
+        if not isinstance(value, str) or not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise TypeError(f"cursor holds {value!r}, {row_id!r}")
+        if sort_key == 'last_seen':
+            value = datetime.fromisoformat(value)
+        return value, row_id
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def device_columns(fields, now: datetime = None):
+    """Selectable columns for the requested fields, with status computed as of ``now``"""
+    return [
+        Device.status_expression(now).label('status') if field == 'status' else getattr(Device, field)
+        for field in fields if field not in COMPUTED_FIELDS
+    ]
+
+def device_filters(status: str = None, location: str = None, battery_below: float = None, now: datetime = None):
+    """WHERE clauses shared by listings and exports"""
+    filters = []
+    if status is not None:
+        filters.append(Device.status_filter(status, now))
+    if location is not None:
+        filters.append(Device.location == location)
+    if battery_below is not None:
+        filters.append(Device.battery_level < battery_below)
+    return filters
+
+def device_page_query(limit: int = 100, cursor: str = None, order: str = 'device_id', status: str = None,
+                      location: str = None, battery_below: float = None, fields=None, now: datetime = None):
+    """SELECT for one keyset page (plus one row to detect a next page)"""
+    now = now or datetime.utcnow()
+    fields = list(fields or DEVICE_FIELDS)
+    sort_key, descending = DEVICE_ORDERINGS[order]
+    sort_column = getattr(Device, sort_key)
+
+    # Sort keys are always selected so the next cursor can be built
+    columns = device_columns(fields, now) + [
+        sort_column.label('_sort'), Device.id.label('_id'), Device.device_id.label('_device_id')
+    ]
+    query = select(*columns).where(*device_filters(status, location, None, now))
+    if battery_below is not None:
+        # Look the matches up through ix_devices_battery_level and sort them, instead of walking the
+        # sort index and filtering every device; MATERIALIZED stops the planner flattening it back
+        matches = (
+            select(Device.id).where(Device.battery_level < battery_below)
+            .cte("battery_matches").prefix_with("MATERIALIZED")
+        )
+        query = query.where(Device.id.in_(select(matches.c.id)))
+    if sort_key == 'last_seen':
+        # Provisioned devices that never sent a heartbeat have no place in a last_seen order
+        query = query.where(sort_column.is_not(None))
+
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort_key)
+        position = tuple_(sort_column, Device.id)
+        query = query.where(position < tuple_(value, row_id) if descending else position > tuple_(value, row_id))
+
+    if descending:
+        query = query.order_by(sort_column.desc(), Device.id.desc())
+    else:
+        query = query.order_by(sort_column, Device.id)
+    return query.limit(limit + 1)
+
+async def fetch_device_page(db: AsyncSession, limit: int = 100, cursor: str = None,
+                            order: str = 'device_id', status: str = None, location: str = None,
+                            battery_below: float = None, fields=None, now: datetime = None):
+    """One keyset-paginated page of devices as plain dicts
+
+    Only the requested ``fields`` are selected, status is computed in SQL
+    and anomaly scores come from the in-memory anomaly engine. Returns
+    (devices, next_cursor), where next_cursor is None on the last page.
+    """
+    fields = list(fields or DEVICE_FIELDS)
+    query = device_page_query(limit, cursor, order, status, location, battery_below, fields, now)
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]._sort, rows[-1]._id)
+
+    return device_dicts(rows, fields), next_cursor
+
+def device_dicts(rows, fields):
+    """Rows selected with device_columns() (plus _device_id) as dicts of ``fields``"""
+    return [
+        {
+            field: anomaly_engine.score_of(row._device_id) if field == 'anomaly_score' else getattr(row, field)
+            for field in fields
+        }
+        for row in rows
+    ]
@@ -0,0 +1,81 @@
+import asyncio
+import os
+
+from .broadcast import event_broadcaster
+from .detector import status_detector
+
+# Seconds between batched dashboard updates
+DASHBOARD_PUSH_INTERVAL = float(os.getenv("DASHBOARD_PUSH_INTERVAL", "1.0"))
+
+class DashboardFeed:
+    """Batches device changes into periodic deltas for open dashboards
+
+    Changes are merged per device between pushes, and each push is
+    serialized once and shared by every subscribed tab, so the cost of
+    live dashboards follows the rate of changes rather than tabs x devices.
+    """
+
+    def __init__(self, push_interval=DASHBOARD_PUSH_INTERVAL):
+        self.push_interval = push_interval
+        self.changed = {}
+        self.removed = set()
+        self._last_counts = None
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def device_changed(self, device_id, **fields):
+        """Queue the non-null ``fields`` of a device for the next push"""
+        if not event_broadcaster.subscribers:
+            return
+        device = self.changed.setdefault(device_id, {"device_id": device_id})
+        device.update((key, value) for key, value in fields.items() if value is not None)
+        self.removed.discard(device_id)
+
+    def device_removed(self, device_id):
+        """Queue the removal of a deleted device"""
+        self.changed.pop(device_id, None)
+        if event_broadcaster.subscribers:
+            self.removed.add(device_id)
+
+    def push(self):
+        """Publish pending device deltas and any change in status counts"""
+        changed, self.changed = self.changed, {}
+        removed, self.removed = self.removed, set()
+        if not event_broadcaster.subscribers:
+            return
+
+        if changed:
+            for device_id, device in changed.items():
+                state = status_detector.devices.get(device_id)
+                if state is not None:
+                    device["status"] = state.status
+            event_broadcaster.publish("devices", {"devices": list(changed.values())})
+        if removed:
+            event_broadcaster.publish("devices_removed", {"device_ids": sorted(removed)})
+
+        counts = dict(status_detector.status_counts)
+        if counts != self._last_counts:
+            self._last_counts = counts
+            event_broadcaster.publish("counts", {**counts, "total": sum(counts.values())})
+
+    def start(self):
+        """Start pushing on the running event loop"""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            await asyncio.sleep(self.push_interval)
+            self.push()
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            await asyncio.wait({self._task}, timeout=self.push_interval + 1)
+            self._task = None
+
+dashboard_feed = DashboardFeed()
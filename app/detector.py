@@ -0,0 +1,257 @@
+import asyncio
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+
+from .broadcast import event_broadcaster
+from .database import SessionLocal
+from .models import (
+    Device, StatusTransition, classify_status, AT_RISK_TIMEOUT_MINUTES, ONLINE_TIMEOUT_MINUTES
+)
+from .metrics import (
+    device_count_gauge, status_transitions_counter,
+    record_device_readings, record_status_change, forget_device_metrics
+)
+
+# Seconds between detector ticks (transition latency is at most one tick)
+DETECTOR_TICK_SECONDS = float(os.getenv("DETECTOR_TICK_SECONDS", "1.0"))
+
+class TrackedDevice:
+    """Last known state of one device, as seen by the detector"""
+    __slots__ = ('status', 'last_seen', 'battery_level', 'signal_strength', 'scheduled')
+
+    def __init__(self):
+        self.status = None
+        self.last_seen = None
+        self.battery_level = None
+        self.signal_strength = None
+        self.scheduled = False
+
+class StatusDetector:
+    """Tracks every device's status and fires online/at-risk/offline transitions
+
+    Each device has at most one entry in a deadline heap: the next instant
+    at which classify_status() could change for it. A heartbeat only
+    pushes an entry when the device has none, so repeated heartbeats cost
+    O(1); when a stale entry comes due the device is simply rescheduled
+    from its latest last_seen. A background task pops due deadlines once
+    per tick, so the devices table is never scanned.
+
+    Transitions update the status metrics, are written to
+    status_transitions (and devices.status) in batches, and are published
+    to the event broadcaster.
+    """
+
+    def __init__(self, tick_seconds=DETECTOR_TICK_SECONDS):
+        self.tick_seconds = tick_seconds
+        self.lock = threading.RLock()
+        self.devices = {}
+        self.status_counts = {'online': 0, 'offline': 0, 'at-risk': 0}
+        self._deadlines = []
+        self._pending_transitions = []
+        self._pending_status = []
+        # Bumped on every change to the tracked fleet; read views compare it to decide whether to rebuild
+        self.version = 0
+        # Cleared on workers that are not the leader, which then detect but do not persist
+        self.writes_enabled = True
+        self._task = None
+        self._stopping = False
+        for status in self.status_counts:
+            device_count_gauge.labels(status=status).set(0)
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def observe(self, device_id, last_seen, battery_level=None, signal_strength=None, now=None):
+        """Record a heartbeat for a device"""
+        record_device_readings(device_id, battery_level, signal_strength)
+        with self.lock:
+            self.version += 1
+            state = self.devices.get(device_id)
+            if state is None:
+                state = self.devices[device_id] = TrackedDevice()
+            if state.last_seen is None or last_seen > state.last_seen:
+                state.last_seen = last_seen
+            if battery_level is not None:
+                state.battery_level = battery_level
+            if signal_strength is not None:
+                state.signal_strength = signal_strength
+
+            now = now or datetime.utcnow()
+            self._set_status(device_id, state, classify_status(state.last_seen, state.battery_level, now), now)
+            if not state.scheduled:
+                self._schedule(device_id, state, now)
+
+    def provision(self, device_ids):
+        """Track devices that were provisioned but have not sent a heartbeat yet (offline)"""
+        with self.lock:
+            added = 0
+            for device_id in device_ids:
+                if device_id not in self.devices:
+                    self.devices[device_id] = TrackedDevice()
+                    self.devices[device_id].status = 'offline'
+                    added += 1
+            if not added:
+                return
+            self.status_counts['offline'] += added
+            self.version += 1
+            device_count_gauge.labels(status='offline').set(self.status_counts['offline'])
+
+    def remove(self, device_id):
+        """Forget a deleted device"""
+        with self.lock:
+            state = self.devices.pop(device_id, None)
+            if state is None:
+                return
+            self.version += 1
+            if state.status is not None:
+                self.status_counts[state.status] -= 1
+            forget_device_metrics(device_id, state.status, self.status_counts)
+
+    def expire(self, now=None):
+        """Apply every time-based status transition that is now due"""
+        now = now or datetime.utcnow()
+        with self.lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                when, device_id = heapq.heappop(self._deadlines)
+                state = self.devices.get(device_id)
+                if state is None:
+                    continue
+                state.scheduled = False
+                status = classify_status(state.last_seen, state.battery_level, when)
+                if self._set_status(device_id, state, status, when):
+                    self.version += 1
+                    # Time-based transitions are the only ones not already written by ingestion
+                    self._pending_status.append({
+                        "b_device_id": device_id, "b_status": status, "b_last_seen": state.last_seen
+                    })
+                # Schedule from the deadline itself so a late tick still walks through every stage
+                self._schedule(device_id, state, when)
+
+    def seed(self, db: Session):
+        """Load the current fleet once so status tracking starts complete
+        
+        Runs in a worker thread while heartbeats are already arriving, so the
+        lock is taken per chunk of rows rather than for the whole table.
+        """
+        result = db.execute(
+            select(Device.device_id, Device.status, Device.last_seen, Device.battery_level, Device.signal_strength)
+            .execution_options(yield_per=5000)
+        )
+        now = datetime.utcnow()
+        for rows in result.partitions():
+            with self.lock:
+                for device_id, stored_status, last_seen, battery_level, signal_strength in rows:
+                    state = self.devices.get(device_id)
+                    if state is not None and state.last_seen is not None and (
+                        last_seen is None or last_seen <= state.last_seen
+                    ):
+                        # A heartbeat since startup is newer than the stored row
+                        continue
+                    self.observe(device_id, last_seen, battery_level, signal_strength, now=now)
+                    # Correct statuses that went stale while nobody was watching
+                    status = self.devices[device_id].status
+                    if status != stored_status:
+                        self._pending_status.append({
+                            "b_device_id": device_id, "b_status": status, "b_last_seen": last_seen
+                        })
+
+    def _set_status(self, device_id, state, status, at):
+        if status == state.status:
+            return False
+        old_status, state.status = state.status, status
+        if old_status is not None:
+            self.status_counts[old_status] -= 1
+        self.status_counts[status] += 1
+        record_status_change(device_id, old_status, status, self.status_counts)
+
+        if old_status is None:
+            # First sighting of the device, not a transition
+            return False
+        if self.writes_enabled:
+            # Every worker sees every transition in shared-state mode; only the leader counts it
+            status_transitions_counter.labels(from_status=old_status, to_status=status).inc()
+        transition = {
+            "device_id": device_id,
+            "from_status": old_status,
+            "to_status": status,
+            "occurred_at": at,
+        }
+        self._pending_transitions.append(transition)
+        event_broadcaster.publish("transition", {**transition, "last_seen": state.last_seen})
+        return True
+
+    def _schedule(self, device_id, state, now):
+        if state.last_seen is None:
+            return
+        # Next instant at which classify_status() can return something different
+        for when in (
+            state.last_seen + timedelta(minutes=AT_RISK_TIMEOUT_MINUTES, microseconds=1),
+            state.last_seen + timedelta(minutes=ONLINE_TIMEOUT_MINUTES),
+        ):
+            if when > now:
+                heapq.heappush(self._deadlines, (when, device_id))
+                state.scheduled = True
+                return
+
+    def start(self):
+        """Start the background tick task on the running event loop"""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Status detector started (tick every {self.tick_seconds}s, {len(self.devices)} devices)")
+
+    async def _run(self):
+        while not self._stopping:
+            await asyncio.sleep(self.tick_seconds)
+            self.expire()
+            await self.persist()
+
+    async def persist(self):
+        """Write queued transitions and status corrections to the database"""
+        with self.lock:
+            transitions, self._pending_transitions = self._pending_transitions, []
+            statuses, self._pending_status = self._pending_status, []
+        if not self.writes_enabled or (not transitions and not statuses):
+            return
+        try:
+            await asyncio.to_thread(self._write, transitions, statuses)
+        except Exception as e:
+            print(f"❌ Failed to persist {len(transitions)} status transitions: {e}")
+
+    @staticmethod
+    def _write(transitions, statuses):
+        db = SessionLocal()
+        try:
+            if transitions:
+                db.execute(insert(StatusTransition), transitions)
+            if statuses:
+                # Skip rows a newer heartbeat has already rewritten
+                devices = Device.__table__
+                db.execute(
+                    update(devices)
+                    .where(devices.c.device_id == bindparam("b_device_id"))
+                    .where(devices.c.last_seen <= bindparam("b_last_seen"))
+                    .values(status=bindparam("b_status")),
+                    statuses
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def stop(self):
+        """Stop ticking and persist anything still queued"""
+        if self._task is not None:
+            self._stopping = True
+            await asyncio.wait({self._task}, timeout=self.tick_seconds + 5)
+            self._task = None
+        await self.persist()
+
+status_detector = StatusDetector()
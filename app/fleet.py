@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, insert, literal, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .models import Device, FleetLocationSummary, LOW_BATTERY_THRESHOLD
+from .metrics import fleet_summary_refresh_latency
+
+# Seconds between rebuilds of fleet_location_summary
+FLEET_SUMMARY_INTERVAL = float(os.getenv("FLEET_SUMMARY_INTERVAL", "30"))
+
+# Battery histogram edges (%): the low band is the at-risk band, below LOW_BATTERY_THRESHOLD
+BATTERY_EDGES = (LOW_BATTERY_THRESHOLD, 50.0, 80.0)
+if not 0 < BATTERY_EDGES[0] < BATTERY_EDGES[1] < BATTERY_EDGES[2] <= 100:
+    raise ValueError(f"Battery histogram edges must increase within 0..100, got {BATTERY_EDGES}")
+LOW_EDGE, MID_EDGE, HIGH_EDGE = BATTERY_EDGES
+
+# Battery histogram: label -> summary column
+BATTERY_HISTOGRAM = {
+    f"<{LOW_EDGE:g}": "battery_low",
+    f"{LOW_EDGE:g}..{MID_EDGE:g}": "battery_mid",
+    f"{MID_EDGE:g}..{HIGH_EDGE:g}": "battery_high",
+    f">={HIGH_EDGE:g}": "battery_full",
+    "unknown": "battery_unknown",
+}
+
+def refresh_fleet_summary(db: Session, now: datetime = None):
+    """Rebuild fleet_location_summary with one grouped scan of devices"""
+    now = now or datetime.utcnow()
+    status = Device.status_expression(now)
+    battery = Device.battery_level
+
+    def count_where(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    # Inline '' so the SELECT and GROUP BY expressions stay identical under server-side binding
+    location = func.coalesce(Device.location, literal_column("''"))
+    rollup = (
+        select(
+            location,
+            func.count(),
+            count_where(status == "online"),
+            count_where(status == "at-risk"),
+            count_where(status == "offline"),
+            count_where(battery < LOW_EDGE),
+            count_where((battery >= LOW_EDGE) & (battery < MID_EDGE)),
+            count_where((battery >= MID_EDGE) & (battery < HIGH_EDGE)),
+            count_where(battery >= HIGH_EDGE),
+            count_where(battery.is_(None)),
+            func.avg(battery),
+            func.min(battery),
+            func.avg(Device.signal_strength),
+            func.min(Device.signal_strength),
+            literal(now),
+        )
+        .group_by(location)
+    )
+    db.execute(delete(FleetLocationSummary))
+    db.execute(insert(FleetLocationSummary).from_select(
+        [
+            "location", "total", "online", "at_risk", "offline",
+            "battery_low", "battery_mid", "battery_high", "battery_full", "battery_unknown",
+            "battery_avg", "battery_min", "signal_avg", "signal_min", "refreshed_at",
+        ],
+        rollup
+    ))
+    db.commit()
+
+def top_devices_query(order_by, k: int, where=None):
+    query = select(
+        Device.device_id, Device.location, Device.last_seen, Device.battery_level, Device.signal_strength
+    )
+    if where is not None:
+        query = query.where(where)
+    return query.order_by(order_by, Device.id).limit(k)
+
+# The top-K lists in the summary: (sort column, filter)
+TOP_DEVICE_LISTS = {
+    "lowest_battery": (Device.battery_level, Device.battery_level.isnot(None)),
+    "longest_silent": (Device.last_seen, Device.last_seen.isnot(None)),
+    "weakest_signal": (Device.signal_strength, Device.signal_strength.isnot(None)),
+}
+
+async def top_devices(db: AsyncSession, order_by, k: int, where=None):
+    """First ``k`` devices by an indexed column"""
+    result = await db.execute(top_devices_query(order_by, k, where))
+    return [row._asdict() for row in result]
+
+async def fleet_summary(db: AsyncSession, k: int = 10, max_locations: int = 100):
+    """Fleet totals and per-location rollups from the summary table, plus live top-K lists"""
+    rows = (await db.execute(
+        select(FleetLocationSummary).order_by(FleetLocationSummary.total.desc(), FleetLocationSummary.location)
+    )).scalars().all()
+
+    status_counts = {"online": 0, "at-risk": 0, "offline": 0}
+    battery_histogram = dict.fromkeys(BATTERY_HISTOGRAM, 0)
+    for row in rows:
+        status_counts["online"] += row.online
+        status_counts["at-risk"] += row.at_risk
+        status_counts["offline"] += row.offline
+        for label, column in BATTERY_HISTOGRAM.items():
+            battery_histogram[label] += getattr(row, column)
+
+    summary = {
+        "refreshed_at": rows[0].refreshed_at if rows else None,
+        "total_count": sum(row.total for row in rows),
+        "status_counts": status_counts,
+        "battery_histogram": battery_histogram,
+        "locations": [
+            {
+                "location": row.location or None,
+                "total": row.total,
+                "online": row.online,
+                "at_risk": row.at_risk,
+                "offline": row.offline,
+                "battery_avg": row.battery_avg,
+                "battery_min": row.battery_min,
+                "signal_avg": row.signal_avg,
+                "signal_min": row.signal_min,
+            }
+            for row in rows[:max_locations]
+        ],
+    }
+    # Each list is an index-ordered LIMIT, so its cost does not grow with the fleet
+    for name, (order_by, where) in TOP_DEVICE_LISTS.items():
+        summary[name] = await top_devices(db, order_by, k, where)
+    return summary
+
+class FleetSummaryRefresher:
+    """Rebuilds the fleet summary table every ``interval`` seconds"""
+
+    def __init__(self, interval=FLEET_SUMMARY_INTERVAL):
+        self.interval = interval
+        # Cleared on workers that are not the leader
+        self.enabled = True
+        self._task = None
+        self._wake = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start refreshing on the running event loop"""
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def refresh(self):
+        start_time = time.time()
+        try:
+            await asyncio.to_thread(self._write)
+        except Exception as e:
+            print(f"❌ Fleet summary refresh failed: {e}")
+        finally:
+            fleet_summary_refresh_latency.observe(time.time() - start_time)
+
+    @staticmethod
+    def _write():
+        db = SessionLocal()
+        try:
+            refresh_fleet_summary(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _run(self):
+        if self.enabled:
+            await self.refresh()
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self.enabled and not self._stopping:
+                await self.refresh()
+
+    async def stop(self):
+        if self._task is not None:
+            # Wake the task instead of waiting out a full interval
+            self._stopping = True
+            self._wake.set()
+            await asyncio.wait({self._task}, timeout=30)
+            self._task = None
+
+fleet_refresher = FleetSummaryRefresher()
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from .database import AsyncSessionLocal
+
+# Readiness probe settings
+READINESS_CACHE_TTL = float(os.getenv("READINESS_CACHE_TTL", "2.0"))        # seconds a result is reused
+READINESS_DB_TIMEOUT = float(os.getenv("READINESS_DB_TIMEOUT", "1.0"))      # seconds before the DB counts as down
+
+class ReadinessProbe:
+    """Cached answer to "can this worker serve traffic?"
+
+    Ready means startup has finished (database reachable and migrated,
+    in-memory state seeded) and a ``SELECT 1`` succeeded within the last
+    ``ttl`` seconds. However often load balancers poll, the database sees at
+    most one check per ``ttl`` per worker, and concurrent probes share the
+    check that is already in flight.
+    """
+
+    def __init__(self, ttl=READINESS_CACHE_TTL, timeout=READINESS_DB_TIMEOUT):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.started = False
+        self.database = False
+        self.checked_at = None
+        self._checked = 0.0
+        self._inflight = None
+
+    @property
+    def ready(self):
+        return self.started and self.database
+
+    async def check(self):
+        """Refresh the database check if the cached one has expired; returns readiness"""
+        if self.checked_at is not None and time.monotonic() - self._checked < self.ttl:
+            return self.ready
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._check_database())
+        try:
+            await asyncio.shield(self._inflight)
+        finally:
+            if self._inflight is not None and self._inflight.done():
+                self._inflight = None
+        return self.ready
+
+    async def _check_database(self):
+        try:
+            async with AsyncSessionLocal() as db:
+                await asyncio.wait_for(db.execute(text("SELECT 1")), timeout=self.timeout)
+            self.database = True
+        except Exception:
+            self.database = False
+        self._checked = time.monotonic()
+        self.checked_at = datetime.utcnow()
+
+readiness = ReadinessProbe()
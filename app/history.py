@@ -0,0 +1,248 @@
+import asyncio
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import extract, func, literal_column, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, engine
+from .models import HeartbeatEvent
+from .metrics import history_write_latency, history_dropped_counter
+
+# Heartbeat history settings
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() in ("1", "true", "yes")
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+HISTORY_PARTITIONS_AHEAD = int(os.getenv("HISTORY_PARTITIONS_AHEAD", "3"))        # days
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "1.0"))        # seconds
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "200000"))                 # events
+HISTORY_MAINTENANCE_INTERVAL = float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", "3600"))
+
+PARTITION_NAME = re.compile(r"^heartbeat_events_(\d{8})$")
+
+def partitioned():
+    """Whether heartbeat_events is a partitioned table (PostgreSQL only)"""
+    return engine.dialect.name == "postgresql"
+
+def create_partitions(db, now: datetime = None, days_ahead: int = HISTORY_PARTITIONS_AHEAD):
+    """Create missing daily partitions from today through ``days_ahead`` days out, without committing"""
+    if not partitioned():
+        return
+    today = (now or datetime.utcnow()).date()
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS heartbeat_events_{day:%Y%m%d} "
+            f"PARTITION OF heartbeat_events "
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+        ))
+
+def ensure_partitions(db: Session, now: datetime = None, days_ahead: int = HISTORY_PARTITIONS_AHEAD):
+    """Create daily heartbeat_events partitions from today through ``days_ahead`` days out"""
+    if not partitioned():
+        return
+    create_partitions(db, now, days_ahead)
+    db.commit()
+
+def drop_expired_partitions(db: Session, now: datetime = None, retention_days: int = HISTORY_RETENTION_DAYS):
+    """Drop whole daily partitions older than the retention window; returns their names"""
+    if not partitioned():
+        # Without partitions, fall back to a plain DELETE
+        cutoff = (now or datetime.utcnow()) - timedelta(days=retention_days)
+        db.query(HeartbeatEvent).filter(HeartbeatEvent.recorded_at < cutoff).delete()
+        db.commit()
+        return []
+
+    oldest_kept = (now or datetime.utcnow()).date() - timedelta(days=retention_days)
+    partitions = db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'heartbeat_events'"
+    )).scalars().all()
+
+    dropped = []
+    for name in partitions:
+        match = PARTITION_NAME.match(name)
+        if match and datetime.strptime(match.group(1), "%Y%m%d").date() < oldest_kept:
+            db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    db.commit()
+    return dropped
+
+def missing_partition(error: Exception) -> bool:
+    """Whether an insert failed because no heartbeat_events partition covers a row's day"""
+    # PostgreSQL reports it as a check violation (23514): no partition of relation "..." found for row
+    return (
+        isinstance(error, IntegrityError)
+        and getattr(error.orig, "pgcode", "23514") == "23514"
+        and "no partition of relation" in str(error.orig)
+    )
+
+def history_insert():
+    """INSERT of heartbeat events that skips events already recorded (same device and time)"""
+    if engine.dialect.name == "postgresql":
+        stmt = postgresql.insert(HeartbeatEvent)
+    else:
+        stmt = sqlite.insert(HeartbeatEvent)
+    return stmt.on_conflict_do_nothing(index_elements=["device_id", "recorded_at"])
+
+def maintain_partitions():
+    """Create upcoming partitions and drop expired ones"""
+    db = SessionLocal()
+    try:
+        ensure_partitions(db)
+        dropped = drop_expired_partitions(db)
+        if dropped:
+            print(f"🧹 Dropped expired heartbeat history partitions: {', '.join(dropped)}")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Heartbeat history partition maintenance failed: {e}")
+    finally:
+        db.close()
+
+def history_query(device_id: str, start: datetime, end: datetime, bucket_seconds: int):
+    epoch = extract("epoch", HeartbeatEvent.recorded_at)
+    # Inline the width so SELECT and GROUP BY share one expression under server-side binding
+    bucket = func.floor(epoch / literal_column(str(int(bucket_seconds)))).label("bucket")
+    return (
+        select(
+            bucket,
+            func.count().label("count"),
+            func.min(HeartbeatEvent.battery_level).label("battery_min"),
+            func.avg(HeartbeatEvent.battery_level).label("battery_avg"),
+            func.max(HeartbeatEvent.battery_level).label("battery_max"),
+            func.min(HeartbeatEvent.signal_strength).label("signal_min"),
+            func.avg(HeartbeatEvent.signal_strength).label("signal_avg"),
+            func.max(HeartbeatEvent.signal_strength).label("signal_max"),
+        )
+        .where(
+            HeartbeatEvent.device_id == device_id,
+            HeartbeatEvent.recorded_at >= start,
+            HeartbeatEvent.recorded_at < end,
+        )
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+
+async def bucketed_history(db: AsyncSession, device_id: str, start: datetime, end: datetime,
+                           bucket_seconds: int):
+    """Min/avg/max battery and signal per time bucket, aggregated in the database"""
+    result = await db.execute(history_query(device_id, start, end, bucket_seconds))
+    rows = result.all()
+    return [
+        {
+            "bucket_start": datetime.utcfromtimestamp(int(row.bucket) * bucket_seconds),
+            "count": row.count,
+            "battery_min": row.battery_min,
+            "battery_avg": float(row.battery_avg) if row.battery_avg is not None else None,
+            "battery_max": row.battery_max,
+            "signal_min": row.signal_min,
+            "signal_avg": float(row.signal_avg) if row.signal_avg is not None else None,
+            "signal_max": row.signal_max,
+        }
+        for row in rows
+    ]
+
+class HistoryWriter:
+    """Collects heartbeat events in memory and appends them in multi-row batches
+
+    Requests only append to a list; a background task writes the list every
+    ``flush_interval`` seconds so history never adds a round trip to
+    ingestion. The same task runs partition maintenance periodically.
+    """
+
+    def __init__(self, flush_interval=HISTORY_FLUSH_INTERVAL, max_pending=HISTORY_QUEUE_MAX):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.maintenance_enabled = True
+        self._task = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the background writer on the running event loop"""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Heartbeat history writer started (retention {HISTORY_RETENTION_DAYS} days)")
+
+    def add(self, device_id, recorded_at, battery_level=None, signal_strength=None):
+        """Queue one heartbeat event; dropped (and counted) if the queue is full"""
+        if not self.running:
+            return
+        if len(self.pending) >= self.max_pending:
+            history_dropped_counter.inc()
+            return
+        self.pending.append({
+            "device_id": device_id,
+            "recorded_at": recorded_at,
+            "battery_level": battery_level,
+            "signal_strength": signal_strength,
+        })
+
+    async def flush(self):
+        """Write every queued event"""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        start_time = time.time()
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except Exception as e:
+            history_dropped_counter.inc(len(batch))
+            print(f"❌ Failed to write {len(batch)} heartbeat history events: {e}")
+            return 0
+        finally:
+            history_write_latency.observe(time.time() - start_time)
+        return len(batch)
+
+    @staticmethod
+    def _write(batch):
+        db = SessionLocal()
+        try:
+            try:
+                db.execute(history_insert(), batch)
+            except IntegrityError as e:
+                if not missing_partition(e):
+                    raise
+                # The day has no partition yet (e.g. just after midnight); create it and retry once
+                db.rollback()
+                ensure_partitions(db)
+                db.execute(history_insert(), batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _run(self):
+        next_maintenance = time.monotonic() + HISTORY_MAINTENANCE_INTERVAL
+        while not self._stopping:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() >= next_maintenance:
+                if self.maintenance_enabled:
+                    await asyncio.to_thread(maintain_partitions)
+                next_maintenance = time.monotonic() + HISTORY_MAINTENANCE_INTERVAL
+
+    async def stop(self, drain_timeout=10.0):
+        """Stop the writer and flush whatever is still queued"""
+        if self._task is not None:
+            self._stopping = True
+            await asyncio.wait({self._task}, timeout=self.flush_interval + drain_timeout)
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️  Heartbeat history writer shut down with {len(self.pending)} events unwritten")
+
+history_writer = HistoryWriter()
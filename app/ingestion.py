@@ -0,0 +1,148 @@
+from sqlalchemy import case, func, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from pydantic import TypeAdapter
+from datetime import datetime
+from typing import Dict, List
+
+from .database import engine
+from .models import Device, LOW_BATTERY_THRESHOLD
+from .schemas import HeartbeatRequest
+from .metrics import heartbeats_received_counter
+from .cache import device_cache
+from .detector import status_detector
+from .history import history_writer
+from .anomaly import anomaly_engine
+from .dashboard import dashboard_feed
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+heartbeat_list_adapter = TypeAdapter(List[HeartbeatRequest])
+
+def parse_heartbeat_batch(body: bytes, content_type: str) -> List[HeartbeatRequest]:
+    """Parse a JSON array or NDJSON body into validated heartbeats"""
+    if content_type.split(";")[0].strip().lower() in NDJSON_CONTENT_TYPES:
+        # Validate NDJSON as one array so pydantic reports per-line indices
+        lines = [line.strip() for line in body.splitlines() if line.strip()]
+        body = b"[" + b",".join(lines) + b"]"
+    return heartbeat_list_adapter.validate_json(body)
+
+def fresh_status(battery_level):
+    """Status of a device that has just checked in"""
+    if battery_level is not None and battery_level < LOW_BATTERY_THRESHOLD:
+        return "at-risk"
+    return "online"
+
+def heartbeat_fields(heartbeat: HeartbeatRequest) -> dict:
+    """A heartbeat's fields, with empty strings read as "not sent" like the single /heartbeat path"""
+    return {column: None if value == "" else value for column, value in heartbeat.model_dump().items()}
+
+def coalesce_heartbeats(heartbeats: List[HeartbeatRequest], seen_at: datetime = None) -> Dict[str, dict]:
+    """Merge heartbeats by device_id, later non-null values winning"""
+    seen_at = seen_at or datetime.utcnow()
+    merged = {}
+    for heartbeat in heartbeats:
+        record = merged.get(heartbeat.device_id)
+        if record is None:
+            record = merged[heartbeat.device_id] = heartbeat_fields(heartbeat)
+        else:
+            record.update({column: value for column, value in heartbeat_fields(heartbeat).items() if value is not None})
+        record["last_seen"] = seen_at
+    return merged
+
+def heartbeat_rows(records: Dict[str, dict], now: datetime):
+    """One parameter set per device for heartbeat_upsert()"""
+    return [
+        {
+            "device_id": device_id,
+            "name": record.get("name"),
+            "battery_level": record.get("battery_level"),
+            "signal_strength": record.get("signal_strength"),
+            "location": record.get("location"),
+            "last_seen": record["last_seen"],
+            "status": fresh_status(record.get("battery_level")),
+            # The application clock, like last_seen, rather than the database's now()
+            "created_at": now,
+            "updated_at": now,
+        }
+        for device_id, record in records.items()
+    ]
+
+def heartbeat_upsert(now: datetime):
+    """INSERT ... ON CONFLICT applying coalesced heartbeat records, executed with heartbeat_rows()
+
+    The statement has no inline values, so it is compiled once and cached;
+    SQLAlchemy sends the rows as multi-row VALUES batches. Returns
+    (device_id, status, created) rows, one per device.
+    """
+    devices = Device.__table__
+    if engine.dialect.name == "postgresql":
+        stmt = postgresql.insert(devices)
+        last_seen = func.greatest(stmt.excluded.last_seen, devices.c.last_seen)
+        # xmax is zero only for rows inserted (not updated) by this statement
+        created = literal_column("(xmax = 0)")
+    else:
+        # SQLite has no xmax, and its max() is NULL when either side is
+        stmt = sqlite.insert(devices)
+        last_seen = case(
+            (devices.c.last_seen > stmt.excluded.last_seen, devices.c.last_seen), else_=stmt.excluded.last_seen
+        )
+        # Only rows inserted by this statement carry its created_at
+        created = devices.c.created_at == now
+
+    excluded = stmt.excluded
+    battery_level = func.coalesce(excluded.battery_level, devices.c.battery_level)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[devices.c.device_id],
+        set_={
+            "last_seen": last_seen,
+            "name": func.coalesce(excluded.name, devices.c.name),
+            "battery_level": battery_level,
+            "signal_strength": func.coalesce(excluded.signal_strength, devices.c.signal_strength),
+            "location": func.coalesce(excluded.location, devices.c.location),
+            "status": case((battery_level < LOW_BATTERY_THRESHOLD, "at-risk"), else_="online"),
+            "updated_at": excluded.updated_at,
+        },
+    ).returning(
+        devices.c.device_id,
+        devices.c.status,
+        created.label("created"),
+    )
+    return stmt
+
+def upsert_heartbeats(db: Session, records: Dict[str, dict]):
+    """Apply coalesced heartbeat records with one bulk upsert (sync session)"""
+    if not records:
+        return []
+    now = datetime.utcnow()
+    result = db.execute(heartbeat_upsert(now), heartbeat_rows(records, now)).all()
+    db.commit()
+    return result
+
+async def upsert_heartbeats_async(db: AsyncSession, records: Dict[str, dict]):
+    """Apply coalesced heartbeat records with one bulk upsert (async session)"""
+    if not records:
+        return []
+    now = datetime.utcnow()
+    result = (await db.execute(heartbeat_upsert(now), heartbeat_rows(records, now))).all()
+    await db.commit()
+    return result
+
+def track_heartbeat(record: dict, protocol: str = "http"):
+    """Feed an accepted heartbeat to status tracking, anomaly scoring, history and live dashboards"""
+    device_id, last_seen = record["device_id"], record["last_seen"]
+    battery_level, signal_strength = record.get("battery_level"), record.get("signal_strength")
+    heartbeats_received_counter.labels(protocol=protocol).inc()
+    device_cache.apply(record)
+    status_detector.observe(device_id, last_seen, battery_level, signal_strength)
+    history_writer.add(device_id, last_seen, battery_level, signal_strength)
+    anomaly_engine.observe(device_id, last_seen, battery_level)
+    dashboard_feed.device_changed(
+        device_id,
+        name=record.get("name"),
+        location=record.get("location"),
+        last_seen=last_seen,
+        battery_level=battery_level,
+        signal_strength=signal_strength
+    )
\ No newline at end of file
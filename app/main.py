@@ -1,19 +1,60 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Depends, HTTPException, Request, Query, Header
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from sqlalchemy import func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, select, update
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+import asyncio
+import hmac
+import json
+import math
+import os
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 
-from .database import get_db, engine, wait_for_db, Base
-from .models import Device, Base
-from .schemas import HeartbeatRequest, DeviceResponse, DeviceListResponse, HealthResponse
-from .metrics import heartbeat_counter, heartbeat_latency, update_device_metrics, get_metrics
+from .database import get_async_db, SessionLocal, AsyncSessionLocal, async_engine
+from .models import Device, classify_status
+from .schemas import (
+    HeartbeatRequest, DeviceResponse, DevicePage, DeviceCountsResponse, HealthResponse, HeartbeatBatchResponse,
+    HeartbeatAck, HeartbeatBatchAck, DeviceHistoryResponse, FleetSummaryResponse, ReadinessResponse
+)
+from .metrics import (
+    heartbeat_batch_size, heartbeat_batch_latency, METRICS_MAX_DEVICE_SERIES,
+    record_heartbeat, get_metrics, get_device_metrics
+)
+from .ingestion import parse_heartbeat_batch, coalesce_heartbeats, upsert_heartbeats_async, fresh_status, track_heartbeat
+from .crud import (
+    STATUSES, DEVICE_FIELDS, DEVICE_ORDERINGS, count_by_status, device_columns, fetch_device_page, recent_activity_query
+)
+from .history import history_writer, bucketed_history, HISTORY_ENABLED
+from .detector import status_detector
+from .broadcast import event_broadcaster, sse_stream
+from .dashboard import dashboard_feed
+from .cache import device_cache
+from .fleet import fleet_refresher, fleet_summary
+from .cluster import worker_sync, prepare_database, DB_PREPARED, SHARED_STATE
+from .buffer import ingest_buffer, heartbeat_record, BufferFull, INGEST_BUFFER_ENABLED
+from .udp import udp_listener, UDP_ENABLED
+from .anomaly import anomaly_engine, ANOMALY_ENABLED
+from .health import readiness
+from .snapshot import fleet_snapshot, encode_json
+from .admission import admission_controller, Overloaded, ADMISSION_ENABLED
+from .bulk import (
+    stream_export, stream_import, spool_upload, upload_rows, EXPORT_FORMATS, IMPORT_FORMATS, pq
+)
+from .profiling import (
+    InstrumentationMiddleware, stage, request_elapsed, profiler, collapsed, ProfilerBusy,
+    DEBUG_PROFILE_TOKEN, PROFILE_MAX_SECONDS
+)
+
+# Columns the dashboard's device table shows
+DASHBOARD_FIELDS = ('device_id', 'name', 'status', 'last_seen', 'battery_level', 'signal_strength', 'location')
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Upper bound on heartbeats per batch request (keeps the upsert within Postgres' bind-parameter limit)
+HEARTBEAT_BATCH_MAX = int(os.getenv("HEARTBEAT_BATCH_MAX", "5000"))
 
 app = FastAPI(
     title="IoT Heartbeat Monitor",
@@ -21,195 +62,675 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Per-stage request timing, statement counts and pool wait (see app/profiling.py)
+app.add_middleware(InstrumentationMiddleware)
+
 # Templates for HTML dashboard
 templates = Jinja2Templates(directory="app/templates")
 
+# Seconds between attempts to prepare the database when it is down or not migrated
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "5"))
+
+# Prepares the database and seeds in-memory state after the server is already accepting requests
+startup_task = None
+
+def seed_status():
+    db = SessionLocal()
+    try:
+        status_detector.seed(db)
+    finally:
+        db.close()
+
+async def prepare_state():
+    """Wait for the database and seed status tracking in worker threads, then mark this worker ready"""
+    started_at = time.monotonic()
+    # Under gunicorn the master has already prepared the database once for all workers
+    while not (DB_PREPARED or await asyncio.to_thread(prepare_database)):
+        await asyncio.sleep(STARTUP_RETRY_INTERVAL)
+    
+    # Seed status tracking once; heartbeats and the detector keep it current from here on
+    seeded_at = datetime.utcnow()
+    await asyncio.to_thread(seed_status)
+    if SHARED_STATE:
+        worker_sync.start(seeded_at)
+    await start_services()
+    readiness.started = True
+    print(f"✅ Ready in {time.monotonic() - started_at:.2f}s (tracking {len(status_detector.devices)} devices)")
+
+async def start_services():
+    """Start the background services, all of which need the schema in place"""
+    if INGEST_BUFFER_ENABLED:
+        ingest_buffer.start()
+    if ADMISSION_ENABLED:
+        admission_controller.start()
+    if HISTORY_ENABLED:
+        history_writer.start()
+    status_detector.start()
+    if ANOMALY_ENABLED:
+        anomaly_engine.start()
+    dashboard_feed.start()
+    fleet_refresher.start()
+    if UDP_ENABLED:
+        await udp_listener.start()
+
 @app.on_event("startup")
 async def startup_event():
-    """Wait for database to be ready on startup"""
+    """Prepare the database and start background services without blocking startup"""
+    global startup_task
     print("🚀 Starting IoT Heartbeat Monitor...")
-    print("⏳ Waiting for database connection...")
-    
-    if wait_for_db():
-        print("✅ Database connection established")
-        # Create tables if they don't exist
-        Base.metadata.create_all(bind=engine)
-        print("✅ Database tables created/verified")
-    else:
-        print("❌ Failed to connect to database - continuing anyway")
+    if SHARED_STATE:
+        # Other workers' heartbeats arrive through the devices table; only the leader persists
+        status_detector.writes_enabled = history_writer.maintenance_enabled = False
+        fleet_refresher.enabled = False
+    # Nothing here blocks the event loop: /livez answers at once and /readyz once prepare_state() finishes
+    startup_task = asyncio.create_task(prepare_state())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Drain buffered heartbeats before exiting"""
+    readiness.started = False
+    if startup_task is not None and not startup_task.done():
+        startup_task.cancel()
+        await asyncio.wait({startup_task}, timeout=5)
+    if udp_listener.running:
+        await udp_listener.stop()
+    if ingest_buffer.running:
+        await ingest_buffer.stop()
+    if admission_controller.running:
+        await admission_controller.stop()
+    if history_writer.running:
+        await history_writer.stop()
+    if dashboard_feed.running:
+        await dashboard_feed.stop()
+    if fleet_refresher.running:
+        await fleet_refresher.stop()
+    if status_detector.running:
+        await status_detector.stop()
+    if anomaly_engine.running:
+        await anomaly_engine.stop()
+    if worker_sync.running:
+        await worker_sync.stop()
+    # Close pooled connections (aiosqlite keeps a non-daemon thread per connection)
+    await async_engine.dispose()
+
+def buffer_full_response(error: BufferFull):
+    """503 telling the device to retry once the buffer has flushed"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(max(1, int(ingest_buffer.flush_interval)))}
+    )
+
+def overloaded_response(error: Overloaded):
+    """429 with a jittered Retry-After so refused devices spread their retries out"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(error), "retry_after": round(error.retry_after, 3)},
+        headers={"Retry-After": str(math.ceil(error.retry_after))}
+    )
+
+def device_response(device):
+    """DeviceResponse for a devices row or cached device, scored by the in-memory anomaly engine"""
+    response = DeviceResponse.model_validate(device)
+    response.anomaly_score = anomaly_engine.score_of(device.device_id)
+    return response
+
+def coalesced_response(heartbeat: HeartbeatRequest):
+    """202 for a heartbeat folded into its device's pending last_seen bump"""
+    state = status_detector.devices.get(heartbeat.device_id)
+    status = state.status if state is not None else fresh_status(heartbeat.battery_level)
+    return Response(
+        HeartbeatAck(device_id=heartbeat.device_id, status=status, coalesced=True).model_dump_json(),
+        status_code=202, media_type="application/json"
+    )
 
 @app.get("/", response_class=HTMLResponse)
-async def dashboard(request: Request, db: Session = Depends(get_db)):
+async def dashboard(request: Request):
     """Main dashboard showing device status"""
-    # Update metrics
-    update_device_metrics(db)
-    
-    # Get all devices with updated status
-    devices = db.query(Device).all()
-    for device in devices:
-        device.update_status()
-    
-    # Count devices by status
-    status_counts = {'online': 0, 'offline': 0, 'at-risk': 0}
-    for device in devices:
-        status_counts[device.status] += 1
-    
-    # Get recent activity (devices that checked in within last hour)
-    recent_activity = db.query(Device).filter(
-        Device.last_seen >= datetime.utcnow() - timedelta(hours=1)
-    ).count()
-    
-    return templates.TemplateResponse(
-        "dashboard.html",
-        {
-            "request": request,
-            "devices": devices,
-            "status_counts": status_counts,
-            "total_devices": len(devices),
-            "recent_activity": recent_activity
-        }
-    )
+    async def render():
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            # Only the columns the table shows, with status computed in SQL rather than per ORM object
+            devices = (await db.execute(select(*device_columns(DASHBOARD_FIELDS, now)))).all()
+            
+            # Count devices by status from the same rows
+            status_counts = dict.fromkeys(STATUSES, 0)
+            for device in devices:
+                status_counts[device.status] += 1
+            
+            # Get recent activity (devices that checked in within last hour)
+            recent_activity = await db.scalar(recent_activity_query(now))
+        
+        return templates.TemplateResponse(
+            "dashboard.html",
+            {
+                "request": request,
+                "devices": devices,
+                "status_counts": status_counts,
+                "total_devices": len(devices),
+                "recent_activity": recent_activity
+            }
+        ).body
+    
+    # Rendered once per snapshot generation and shared by every open tab
+    return await fleet_snapshot.respond(request, ("dashboard",), render, media_type="text/html")
 
-@app.post("/heartbeat", response_model=DeviceResponse)
-async def receive_heartbeat(
-    heartbeat: HeartbeatRequest,
-    db: Session = Depends(get_db)
-):
+def parse_json_body(body: bytes):
+    """Decode a JSON request body, failing with the same 422s FastAPI gives for a missing or bad body"""
+    if not body:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise RequestValidationError([{
+            "type": "json_invalid",
+            "loc": ("body", getattr(e, "pos", 0)),
+            "msg": "JSON decode error",
+            "input": {},
+            "ctx": {"error": getattr(e, "msg", str(e))},
+        }])
+
+def validate_body(model, payload):
+    """Validate a decoded body, failing with the same 422 FastAPI gives for invalid fields"""
+    try:
+        # from_attributes matches how FastAPI validates body parameters
+        return model.model_validate(payload, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+
+# The heartbeat body is parsed by hand so parsing and validation can be timed separately
+HEARTBEAT_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": HeartbeatRequest.model_json_schema()}},
+    }
+}
+
+@app.post(
+    "/heartbeat", response_model=DeviceResponse, responses={202: {"model": HeartbeatAck}},
+    openapi_extra=HEARTBEAT_BODY
+)
+async def receive_heartbeat(request: Request, db: AsyncSession = Depends(get_async_db)):
     """Receive heartbeat from IoT device"""
-    start_time = time.time()
+    with stage("parse"):
+        payload = parse_json_body(await request.body())
+    with stage("validate"):
+        heartbeat = validate_body(HeartbeatRequest, payload)
     
-    try:
-        # Check if device exists
-        device = db.query(Device).filter(Device.device_id == heartbeat.device_id).first()
+    with stage("admission"):
+        # Beyond its token bucket a device's heartbeat only moves last_seen, in a batched UPDATE
+        if not admission_controller.admit(heartbeat.device_id):
+            admission_controller.coalesce(heartbeat.device_id, datetime.utcnow())
+            return coalesced_response(heartbeat)
+    
+    if ingest_buffer.running:
+        # Write-behind mode: acknowledge now, persist on the next buffer flush
+        with stage("buffer"):
+            try:
+                pending = await ingest_buffer.submit(heartbeat_record(heartbeat))
+            except BufferFull as e:
+                return buffer_full_response(e)
         
+        with stage("metrics"):
+            status = fresh_status(pending.get("battery_level"))
+            track_heartbeat(heartbeat_record(heartbeat, pending["last_seen"]))
+            record_heartbeat(
+                heartbeat.device_id, status, pending.get("location"), pending.get("battery_level"),
+                pending.get("signal_strength"), latency=request_elapsed()
+            )
+        with stage("serialize"):
+            return Response(
+                HeartbeatAck(device_id=heartbeat.device_id, status=status).model_dump_json(),
+                status_code=202, media_type="application/json"
+            )
+    
+    try:
+        with admission_controller.slot():
+            now = datetime.utcnow()
+            device = device_cache.get(heartbeat.device_id)
+            if device is not None and await update_cached_device(db, device, heartbeat, now):
+                with stage("db_write"):
+                    await db.commit()
+            else:
+                device = await write_device(db, heartbeat, now)
+                device = device_cache.put(device) or device
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error processing heartbeat: {str(e)}")
+    
+    with stage("metrics"):
+        track_heartbeat(heartbeat_record(heartbeat, now))
+        record_heartbeat(
+            device.device_id, device.status, device.location, device.battery_level,
+            device.signal_strength, latency=request_elapsed()
+        )
+    
+    with stage("serialize"):
+        return Response(device_response(device).model_dump_json(), media_type="application/json")
+
+def heartbeat_changes(heartbeat: HeartbeatRequest):
+    """Columns a heartbeat overwrites (null fields keep their stored value)"""
+    return {
+        column: value
+        for column, value in heartbeat.model_dump(exclude={"device_id"}).items()
+        if value is not None and value != ""
+    }
+
+async def update_cached_device(db: AsyncSession, device, heartbeat: HeartbeatRequest, now: datetime):
+    """Apply a heartbeat to a cached device with a single UPDATE; False if the row is gone"""
+    with stage("status"):
+        changes = heartbeat_changes(heartbeat)
+        battery_level = changes.get("battery_level", device.battery_level)
+        changes.update(last_seen=now, updated_at=now, status=classify_status(now, battery_level, now))
+    with stage("db_write"):
+        result = await db.execute(
+            update(Device).where(Device.device_id == device.device_id).values(**changes)
+        )
+    if result.rowcount == 0:
+        # Deleted elsewhere; fall back to the read path
+        device_cache.invalidate(device.device_id)
+        return False
+    for column, value in changes.items():
+        setattr(device, column, value)
+    return True
+
+async def write_device(db: AsyncSession, heartbeat: HeartbeatRequest, now: datetime):
+    """Apply a heartbeat to an uncached device, creating it if needed"""
+    # Check if device exists
+    with stage("db_read"):
+        device = await db.scalar(select(Device).where(Device.device_id == heartbeat.device_id))
+    
+    with stage("status"):
         if device:
             # Update existing device
-            device.last_seen = datetime.utcnow()
-            if heartbeat.name:
-                device.name = heartbeat.name
-            if heartbeat.battery_level is not None:
-                device.battery_level = heartbeat.battery_level
-            if heartbeat.signal_strength is not None:
-                device.signal_strength = heartbeat.signal_strength
-            if heartbeat.location:
-                device.location = heartbeat.location
+            for column, value in heartbeat_changes(heartbeat).items():
+                setattr(device, column, value)
         else:
             # Create new device
-            device = Device(
-                device_id=heartbeat.device_id,
-                name=heartbeat.name,
-                battery_level=heartbeat.battery_level,
-                signal_strength=heartbeat.signal_strength,
-                location=heartbeat.location,
-                last_seen=datetime.utcnow()
-            )
+            device = Device(device_id=heartbeat.device_id, created_at=now, **heartbeat_changes(heartbeat))
             db.add(device)
         
-        # Update device status
-        device.update_status()
-        db.commit()
-        db.refresh(device)
-        
-        # Update metrics
-        heartbeat_counter.labels(
-            device_id=device.device_id,
-            status=device.status
-        ).inc()
-        
-        heartbeat_latency.labels(device_id=device.device_id).observe(
-            time.time() - start_time
+        # Timestamps are set here rather than by the database so no refresh is needed after commit
+        device.last_seen = now
+        device.updated_at = now
+        device.update_status(now)
+    with stage("db_write"):
+        await db.commit()
+    return device
+
+@app.post("/heartbeats", response_model=HeartbeatBatchResponse, responses={202: {"model": HeartbeatBatchAck}})
+async def receive_heartbeats(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Receive a batch of heartbeats as a JSON array or NDJSON (application/x-ndjson)"""
+    start_time = time.time()
+    
+    with stage("parse"):
+        body = await request.body()
+    try:
+        with stage("validate"):
+            heartbeats = parse_heartbeat_batch(body, request.headers.get("content-type", ""))
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    
+    if len(heartbeats) > HEARTBEAT_BATCH_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(heartbeats)} heartbeats (max {HEARTBEAT_BATCH_MAX})"
         )
-        
-        return device
-        
+    received = len(heartbeats)
+    with stage("admission"):
+        heartbeats, coalesced = admission_controller.admit_batch(heartbeats, datetime.utcnow())
+    
+    if ingest_buffer.running:
+        # Write-behind mode: fold the batch into the buffer and acknowledge
+        queued = 0
+        try:
+            for record in coalesce_heartbeats(heartbeats).values():
+                pending = await ingest_buffer.submit(record)
+                track_heartbeat(record, protocol="http_batch")
+                record_heartbeat(
+                    record["device_id"], fresh_status(pending.get("battery_level")), pending.get("location"),
+                    pending.get("battery_level"), pending.get("signal_strength")
+                )
+                queued += 1
+        except BufferFull as e:
+            if not queued:
+                return buffer_full_response(e)
+        heartbeat_batch_size.observe(received)
+        heartbeat_batch_latency.observe(time.time() - start_time)
+        return JSONResponse(
+            status_code=202,
+            content=HeartbeatBatchAck(received=received, queued=queued, coalesced=coalesced).model_dump()
+        )
+    
+    try:
+        # One row per device, then a single INSERT ... ON CONFLICT for the whole batch
+        records = coalesce_heartbeats(heartbeats)
+        with admission_controller.slot(), stage("db_write"):
+            rows = await upsert_heartbeats_async(db, records)
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error processing heartbeat: {str(e)}")
-
-@app.get("/devices", response_model=DeviceListResponse)
-async def list_devices(db: Session = Depends(get_db)):
-    """List all devices with their current status"""
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error processing heartbeats: {str(e)}")
+    
     # Update metrics
-    update_device_metrics(db)
+    with stage("metrics"):
+        for row in rows:
+            record = records[row.device_id]
+            track_heartbeat(record, protocol="http_batch")
+            record_heartbeat(
+                row.device_id, row.status, record.get("location"), record.get("battery_level"),
+                record.get("signal_strength")
+            )
+    heartbeat_batch_size.observe(received)
+    heartbeat_batch_latency.observe(time.time() - start_time)
     
-    devices = db.query(Device).all()
+    return HeartbeatBatchResponse(
+        received=received,
+        accepted=len(rows),
+        coalesced=coalesced,
+        results=[
+            {"device_id": row.device_id, "status": row.status, "created": row.created}
+            for row in rows
+        ]
+    )
+
+def parse_fields(fields: Optional[str]):
+    """Validate a comma-separated ``fields=`` projection"""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in DEVICE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+async def device_page(request: Request, limit, cursor, order, status, location, battery_below, fields):
+    """Serve one listing page from the read snapshot, mapping bad input to 400s"""
+    with stage("validate"):
+        if order not in DEVICE_ORDERINGS:
+            raise HTTPException(status_code=400, detail=f"Invalid order, expected one of: {', '.join(DEVICE_ORDERINGS)}")
+        if status is not None and status not in STATUSES:
+            raise HTTPException(status_code=400, detail="Invalid status")
+        fields = parse_fields(fields)
     
-    # Update status for all devices
-    for device in devices:
-        device.update_status()
+    async def build():
+        async with AsyncSessionLocal() as db:
+            with stage("db_read"):
+                devices, next_cursor = await fetch_device_page(
+                    db, limit=limit, cursor=cursor, order=order, status=status,
+                    location=location, battery_below=battery_below, fields=fields
+                )
+        with stage("serialize"):
+            return encode_json({"devices": devices, "count": len(devices), "next_cursor": next_cursor})
     
-    # Count devices by status
-    status_counts = {'online': 0, 'offline': 0, 'at-risk': 0}
-    for device in devices:
-        status_counts[device.status] += 1
+    key = ("devices", limit, cursor, order, status, location, battery_below, tuple(fields or ()))
+    try:
+        return await fleet_snapshot.respond(request, key, build)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/devices", response_model=DevicePage)
+async def list_devices(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    order: str = Query("device_id", description="device_id, last_seen or -last_seen"),
+    status: Optional[str] = Query(None, description="online, offline or at-risk"),
+    location: Optional[str] = None,
+    battery_below: Optional[float] = Query(None, ge=0.0, le=100.0),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+):
+    """List devices one keyset-paginated page at a time"""
+    return await device_page(request, limit, cursor, order, status, location, battery_below, fields)
+
+@app.get("/devices/counts", response_model=DeviceCountsResponse)
+async def device_counts(request: Request):
+    """Device counts by status"""
+    async def build():
+        async with AsyncSessionLocal() as db:
+            status_counts = await count_by_status(db)
+        return encode_json(DeviceCountsResponse(
+            total_count=sum(status_counts.values()),
+            online_count=status_counts['online'],
+            offline_count=status_counts['offline'],
+            at_risk_count=status_counts['at-risk'],
+            anomalous_count=anomaly_engine.anomalous_count
+        ).model_dump())
     
-    return DeviceListResponse(
-        devices=devices,
-        total_count=len(devices),
-        online_count=status_counts['online'],
-        offline_count=status_counts['offline'],
-        at_risk_count=status_counts['at-risk']
+    return await fleet_snapshot.respond(request, ("counts",), build)
+
+@app.get("/devices/export")
+async def export_devices(
+    format: str = Query("csv", description="csv, ndjson or parquet"),
+    status: Optional[str] = Query(None, description="online, offline or at-risk"),
+    location: Optional[str] = None,
+    battery_below: Optional[float] = Query(None, ge=0.0, le=100.0),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to export")
+):
+    """Stream every matching device as CSV, NDJSON or Parquet"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format, expected one of: {', '.join(EXPORT_FORMATS)}")
+    if format == "parquet" and pq is None:
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    fields = parse_fields(fields) or list(DEVICE_FIELDS)
+    return StreamingResponse(
+        stream_export(format, fields, status, location, battery_below),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="devices.{format}"'}
     )
 
+@app.post("/devices/import")
+async def import_devices(request: Request):
+    """Provision devices from a CSV or NDJSON file, streaming NDJSON progress lines back"""
+    format = IMPORT_FORMATS.get(request.headers.get("content-type", "").split(";")[0].strip().lower())
+    if format is None:
+        raise HTTPException(
+            status_code=415, detail=f"Unsupported content type, expected one of: {', '.join(IMPORT_FORMATS)}"
+        )
+    # The whole upload is received before the response starts, so the body and the progress stream never interleave
+    upload = await spool_upload(request.stream())
+    try:
+        rows = upload_rows(upload, format)
+    except ValueError as e:
+        upload.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(stream_import(upload, rows), media_type="application/x-ndjson")
+
 @app.get("/devices/{device_id}", response_model=DeviceResponse)
-async def get_device(device_id: str, db: Session = Depends(get_db)):
+async def get_device(device_id: str, db: AsyncSession = Depends(get_async_db)):
     """Get specific device details"""
-    device = db.query(Device).filter(Device.device_id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    device = device_cache.get(device_id)
+    if device is None:
+        device = await db.scalar(select(Device).where(Device.device_id == device_id))
+        if not device:
+            raise HTTPException(status_code=404, detail="Device not found")
+        device = device_cache.put(device) or device
     
     device.update_status()
-    return device
+    return device_response(device)
+
+@app.get("/fleet/summary", response_model=FleetSummaryResponse)
+async def get_fleet_summary(
+    k: int = Query(10, ge=1, le=100, description="Devices in each top-K list"),
+    max_locations: int = Query(100, ge=1, le=10000, description="Largest locations to return"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Fleet counts by status and location, battery histogram and top-K problem devices"""
+    return await fleet_summary(db, k, max_locations)
 
-@app.get("/devices/status/{status}")
-async def get_devices_by_status(status: str, db: Session = Depends(get_db)):
+# Upper bound on buckets returned by one history request
+HISTORY_MAX_BUCKETS = 10000
+
+@app.get("/devices/{device_id}/history", response_model=DeviceHistoryResponse)
+async def get_device_history(
+    device_id: str,
+    start: Optional[datetime] = Query(None, description="Window start (UTC), default end - 24h"),
+    end: Optional[datetime] = Query(None, description="Window end (UTC), default now"),
+    bucket_seconds: int = Query(300, ge=1, description="Downsampling bucket width"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Battery and signal history downsampled to min/avg/max per time bucket"""
+    # Stored timestamps are naive UTC
+    start, end = (
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+        for value in (start, end)
+    )
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start).total_seconds() / bucket_seconds > HISTORY_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Window too large for bucket_seconds={bucket_seconds} (max {HISTORY_MAX_BUCKETS} buckets)"
+        )
+    
+    return DeviceHistoryResponse(
+        device_id=device_id,
+        start=start,
+        end=end,
+        bucket_seconds=bucket_seconds,
+        buckets=await bucketed_history(db, device_id, start, end, bucket_seconds)
+    )
+
+@app.get("/devices/status/{status}", response_model=DevicePage)
+async def get_devices_by_status(
+    request: Request,
+    status: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    order: str = "device_id",
+    fields: Optional[str] = None
+):
     """Get devices filtered by status"""
-    if status not in ['online', 'offline', 'at-risk']:
+    if status not in STATUSES:
         raise HTTPException(status_code=400, detail="Invalid status")
     
-    devices = db.query(Device).all()
-    filtered_devices = []
-    
-    for device in devices:
-        device.update_status()
-        if device.status == status:
-            filtered_devices.append(device)
-    
-    return {"devices": filtered_devices, "count": len(filtered_devices)}
+    return await device_page(request, limit, cursor, order, status, None, None, fields)
+
+@app.get("/livez")
+async def livez():
+    """Liveness probe: the worker's event loop is answering (no I/O)"""
+    return {"status": "alive"}
+
+@app.get("/readyz", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+async def readyz():
+    """Readiness probe: startup finished and the database answered within the cache TTL"""
+    ready = await readiness.check()
+    body = ReadinessResponse(
+        status="ready" if ready else "not ready",
+        started=readiness.started,
+        database_connected=readiness.database,
+        checked_at=readiness.checked_at
+    )
+    return Response(body.model_dump_json(), status_code=200 if ready else 503, media_type="application/json")
 
 @app.get("/health", response_model=HealthResponse)
-async def health_check(db: Session = Depends(get_db)):
+async def health_check():
     """Health check endpoint"""
-    try:
-        # Test database connection using proper SQLAlchemy syntax
-        db.execute(text("SELECT 1"))
-        database_connected = True
-        total_devices = db.query(func.count(Device.id)).scalar()
-    except Exception as e:
-        database_connected = False
-        total_devices = 0
-    
+    # Both values are cached or maintained in memory, so polling this never scans devices
+    await readiness.check()
     return HealthResponse(
-        status="healthy" if database_connected else "unhealthy",
+        status="healthy" if readiness.database else "unhealthy",
         timestamp=datetime.utcnow(),
-        database_connected=database_connected,
-        total_devices=total_devices
+        database_connected=readiness.database,
+        total_devices=len(status_detector.devices)
     )
 
 @app.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
-    return get_metrics()
+    # Apply due transitions so the status gauges are current, then release the lock before rendering
+    with status_detector.lock:
+        status_detector.expire()
+    # Rendering is O(series), which in device mode means O(devices); keep it off the event loop
+    return await asyncio.to_thread(get_metrics)
+
+@app.get("/metrics/devices")
+async def device_metrics(
+    device_id: Optional[str] = Query(None, description="Comma-separated device ids"),
+    status: Optional[str] = Query(None, description="online, offline or at-risk"),
+    limit: int = Query(1000, ge=1, le=METRICS_MAX_DEVICE_SERIES, description="Max devices to render")
+):
+    """Per-device metrics rendered on demand from the detector's in-memory state"""
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    with status_detector.lock:
+        status_detector.expire()
+        if device_id:
+            wanted = [value.strip() for value in device_id.split(",") if value.strip()]
+            states = ((value, status_detector.devices.get(value)) for value in wanted)
+        else:
+            states = status_detector.devices.items()
+        rows = []
+        for tracked_id, state in states:
+            if state is None or (status is not None and state.status != status):
+                continue
+            rows.append((tracked_id, state.status, state.last_seen, state.battery_level, state.signal_strength))
+            if len(rows) >= limit:
+                break
+    return await asyncio.to_thread(get_device_metrics, rows)
+
+@app.get("/debug/profile", response_class=PlainTextResponse, include_in_schema=False)
+async def debug_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS, description="How long to sample"),
+    threads: str = Query("loop", description="loop (the event loop thread) or all"),
+    x_debug_token: Optional[str] = Header(None)
+):
+    """Sampling profile of this worker in collapsed-stack format (flamegraph.pl, speedscope)"""
+    # Disabled unless DEBUG_PROFILE_TOKEN is set, and then only with the matching X-Debug-Token header
+    if not DEBUG_PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_debug_token or not hmac.compare_digest(x_debug_token, DEBUG_PROFILE_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+    if threads not in ("loop", "all"):
+        raise HTTPException(status_code=400, detail="threads must be loop or all")
+    
+    thread_ids = {threading.get_ident()} if threads == "loop" else None
+    try:
+        samples, stacks = await asyncio.to_thread(profiler.run, seconds, thread_ids)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        collapsed(stacks),
+        headers={"X-Profile-Samples": str(samples), "X-Profile-Pid": str(os.getpid())}
+    )
+
+# Event types available on /events
+EVENT_TYPES = ("transition", "devices", "devices_removed", "counts")
+
+@app.get("/events")
+async def events(
+    types: str = Query("transition", description=f"Comma-separated event types: {', '.join(EVENT_TYPES)}")
+):
+    """Server-sent stream of device status transitions and dashboard deltas"""
+    requested = {event.strip() for event in types.split(",") if event.strip()}
+    unknown = requested - set(EVENT_TYPES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown event types: {', '.join(sorted(unknown))}")
+    return StreamingResponse(
+        sse_stream(event_broadcaster, events=requested),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.delete("/devices/{device_id}")
-async def delete_device(device_id: str, db: Session = Depends(get_db)):
+async def delete_device(device_id: str, db: AsyncSession = Depends(get_async_db)):
     """Delete a device"""
-    device = db.query(Device).filter(Device.device_id == device_id).first()
-    if not device:
+    result = await db.execute(delete(Device).where(Device.device_id == device_id))
+    await db.commit()
+    device_cache.invalidate(device_id)
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    db.delete(device)
-    db.commit()
+    status_detector.remove(device_id)
+    anomaly_engine.remove(device_id)
+    dashboard_feed.device_removed(device_id)
     return {"message": "Device deleted successfully"}
 
 if __name__ == "__main__":
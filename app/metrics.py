@@ -1,83 +1,438 @@
-from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
 from fastapi import Response
-from sqlalchemy.orm import Session
-from .models import Device
-from datetime import datetime, timedelta
+from datetime import timezone
+import os
+
+# Cardinality mode: "device" labels heartbeat metrics per device_id, "aggregate" replaces
+# device_id with status, location and battery/signal buckets so series stay bounded
+METRICS_CARDINALITY = os.getenv("METRICS_CARDINALITY", "device").lower()
+PER_DEVICE_METRICS = METRICS_CARDINALITY != "aggregate"
+# Hard limits on distinct devices (device mode) and locations (aggregate mode) with series
+METRICS_MAX_DEVICE_SERIES = int(os.getenv("METRICS_MAX_DEVICE_SERIES", "10000"))
+METRICS_MAX_LOCATIONS = int(os.getenv("METRICS_MAX_LOCATIONS", "100"))
+
+# Set by multi-worker deployments: each worker writes its samples to files in this
+# directory and /metrics aggregates them (see gunicorn.conf.py)
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Bucket edges for aggregate battery (%) and signal (dBm) labels
+BATTERY_BUCKETS = (20, 50, 80)
+SIGNAL_BUCKETS = (-90, -70, -50)
 
 # Metrics definitions
-heartbeat_counter = Counter(
-    'iot_heartbeat_total',
-    'Total number of heartbeat requests received',
-    ['device_id', 'status']
-)
+if PER_DEVICE_METRICS:
+    heartbeat_counter = Counter(
+        'iot_heartbeat_total',
+        'Total number of heartbeat requests received',
+        ['device_id', 'status']
+    )
+    heartbeat_latency = Histogram(
+        'iot_heartbeat_latency_seconds',
+        'Time taken to process heartbeat requests',
+        ['device_id']
+    )
+else:
+    heartbeat_counter = Counter(
+        'iot_heartbeat_total',
+        'Total number of heartbeat requests received',
+        ['status', 'location', 'battery', 'signal']
+    )
+    heartbeat_latency = Histogram(
+        'iot_heartbeat_latency_seconds',
+        'Time taken to process heartbeat requests'
+    )
 
 device_status_gauge = Gauge(
     'iot_device_status',
     'Current status of IoT devices',
-    ['device_id', 'status']
+    ['device_id', 'status'],
+    multiprocess_mode='livemostrecent'
 )
 
 battery_level_gauge = Gauge(
     'iot_device_battery_level',
     'Battery level of IoT devices',
-    ['device_id']
+    ['device_id'],
+    multiprocess_mode='livemostrecent'
 )
 
 signal_strength_gauge = Gauge(
     'iot_device_signal_strength',
     'Signal strength of IoT devices',
-    ['device_id']
+    ['device_id'],
+    multiprocess_mode='livemostrecent'
 )
 
 device_count_gauge = Gauge(
     'iot_device_count',
     'Total number of devices by status',
-    ['status']
-)
-
-heartbeat_latency = Histogram(
-    'iot_heartbeat_latency_seconds',
-    'Time taken to process heartbeat requests',
-    ['device_id']
-)
-
-def update_device_metrics(db: Session):
-    """Update Prometheus metrics based on current device states"""
-    devices = db.query(Device).all()
-    
-    # Reset all gauges
-    device_status_gauge.clear()
-    battery_level_gauge.clear()
-    signal_strength_gauge.clear()
-    device_count_gauge.clear()
-    
-    status_counts = {'online': 0, 'offline': 0, 'at-risk': 0}
-    
-    for device in devices:
-        # Update device status
-        device.update_status()
-        
-        # Set status gauge
-        device_status_gauge.labels(device_id=device.device_id, status=device.status).set(1)
-        
-        # Set battery level gauge
-        if device.battery_level is not None:
-            battery_level_gauge.labels(device_id=device.device_id).set(device.battery_level)
-        
-        # Set signal strength gauge
-        if device.signal_strength is not None:
-            signal_strength_gauge.labels(device_id=device.device_id).set(device.signal_strength)
-        
-        # Count devices by status
-        status_counts[device.status] += 1
-    
-    # Set count gauges
-    for status, count in status_counts.items():
-        device_count_gauge.labels(status=status).set(count)
+    ['status'],
+    # Every worker tracks the whole fleet, so any live worker's value is the answer
+    multiprocess_mode='livemax'
+)
+
+metrics_dropped_series = Counter(
+    'iot_metrics_dropped_series_total',
+    'Metric updates dropped because a series limit was reached',
+    ['metric']
+)
+
+heartbeats_received_counter = Counter(
+    'iot_heartbeats_received_total',
+    'Heartbeats accepted, by ingestion protocol',
+    ['protocol']
+)
+
+heartbeat_batch_size = Histogram(
+    'iot_heartbeat_batch_size',
+    'Number of heartbeats received per batch request',
+    buckets=(1, 10, 50, 100, 500, 1000, 2500, 5000, 10000)
+)
+
+heartbeat_batch_latency = Histogram(
+    'iot_heartbeat_batch_latency_seconds',
+    'Time taken to process batch heartbeat requests'
+)
+
+# Write-behind ingestion buffer metrics
+ingest_queue_depth = Gauge(
+    'iot_ingest_queue_depth',
+    'Number of devices with heartbeats waiting in the ingestion buffer',
+    multiprocess_mode='livesum'
+)
+
+ingest_flush_latency = Histogram(
+    'iot_ingest_flush_latency_seconds',
+    'Time taken to flush the ingestion buffer to the database'
+)
+
+ingest_flush_size = Histogram(
+    'iot_ingest_flush_size',
+    'Number of devices written per ingestion buffer flush',
+    buckets=(1, 10, 50, 100, 500, 1000, 2500, 5000, 10000, 50000)
+)
+
+ingest_coalesced_counter = Counter(
+    'iot_ingest_coalesced_total',
+    'Heartbeats merged into an already pending record for the same device'
+)
+
+ingest_rejected_counter = Counter(
+    'iot_ingest_rejected_total',
+    'Heartbeats rejected because the ingestion buffer was full'
+)
+
+ingest_flush_failures = Counter(
+    'iot_ingest_flush_failures_total',
+    'Ingestion buffer flushes that failed and were retried'
+)
+
+# Heartbeat history metrics
+history_write_latency = Histogram(
+    'iot_history_write_latency_seconds',
+    'Time taken to append a batch of heartbeat history events'
+)
+
+history_dropped_counter = Counter(
+    'iot_history_dropped_total',
+    'Heartbeat history events dropped because the queue was full or the write failed'
+)
+
+# Status transition and event stream metrics
+status_transitions_counter = Counter(
+    'iot_status_transitions_total',
+    'Device status transitions detected',
+    ['from_status', 'to_status']
+)
+
+broadcast_subscribers = Gauge(
+    'iot_event_subscribers',
+    'Clients currently subscribed to the server event stream',
+    multiprocess_mode='livesum'
+)
+
+broadcast_dropped_counter = Counter(
+    'iot_event_dropped_total',
+    'Server events dropped because a subscriber was too slow'
+)
+
+# UDP ingestion metrics
+udp_datagrams_counter = Counter(
+    'iot_udp_datagrams_total',
+    'UDP heartbeat datagrams by outcome',
+    ['result']
+)
+
+udp_flush_latency = Histogram(
+    'iot_udp_flush_latency_seconds',
+    'Time taken to ingest a batch of UDP heartbeats'
+)
+
+# Fleet summary metrics
+fleet_summary_refresh_latency = Histogram(
+    'iot_fleet_summary_refresh_seconds',
+    'Time taken to rebuild the fleet summary table'
+)
+
+# Anomaly scoring metrics
+anomalous_devices_gauge = Gauge(
+    'iot_anomalous_devices',
+    'Devices whose anomaly score is at or above ANOMALY_THRESHOLD, by signal',
+    ['signal'],
+    # Every worker scores the whole fleet, like iot_device_count
+    multiprocess_mode='livemax'
+)
+
+anomaly_scoring_latency = Histogram(
+    'iot_anomaly_scoring_seconds',
+    'Time taken to score the whole fleet for anomalies',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+# Bulk export/import metrics
+devices_exported_counter = Counter(
+    'iot_devices_exported_total',
+    'Device rows streamed by GET /devices/export, by format',
+    ['format']
+)
+
+devices_imported_counter = Counter(
+    'iot_devices_imported_total',
+    'Provisioning rows handled by POST /devices/import, by outcome (created, updated, rejected)',
+    ['result']
+)
+
+# Read snapshot metrics
+snapshot_responses_counter = Counter(
+    'iot_snapshot_responses_total',
+    'Snapshot reads served from cache (hit) or built (miss); not_modified counts the 304s among them',
+    ['result']
+)
+
+# Admission control metrics
+admission_counter = Counter(
+    'iot_admission_total',
+    'Heartbeats written (admitted), folded into a last_seen bump (coalesced) or refused with 429 (rejected)',
+    ['result']
+)
+
+admission_in_flight = Gauge(
+    'iot_admission_in_flight',
+    'Heartbeat writes currently holding an admission slot',
+    multiprocess_mode='livesum'
+)
+
+admission_flush_latency = Histogram(
+    'iot_admission_flush_latency_seconds',
+    'Time taken to write a batch of coalesced last_seen bumps'
+)
+
+# Per-request instrumentation (labelled by endpoint function, so bounded by the number of routes)
+request_latency = Histogram(
+    'iot_request_latency_seconds',
+    'Time from request arrival to response start',
+    ['endpoint']
+)
+
+request_stage_latency = Histogram(
+    'iot_request_stage_seconds',
+    'Time spent in each stage of a request (parse, validate, db_read, db_write, status, metrics, serialize)',
+    ['endpoint', 'stage'],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
+request_db_queries = Histogram(
+    'iot_request_db_queries',
+    'SQL statements executed per request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+)
+
+request_db_pool_wait = Histogram(
+    'iot_request_db_pool_wait_seconds',
+    'Time a request spent waiting for a pooled database connection',
+    ['endpoint'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+
+# Device state cache metrics
+device_cache_hits = Counter(
+    'iot_device_cache_hits_total',
+    'Device lookups served from the in-process device cache'
+)
+
+device_cache_misses = Counter(
+    'iot_device_cache_misses_total',
+    'Device lookups that had to read the devices table'
+)
+
+device_cache_evictions = Counter(
+    'iot_device_cache_evictions_total',
+    'Least recently used devices evicted from the device cache'
+)
+
+device_cache_size = Gauge(
+    'iot_device_cache_size',
+    'Devices currently held in the device cache',
+    multiprocess_mode='livesum'
+)
+
+class SeriesLimiter:
+    """Admits up to ``limit`` distinct label values and counts everything refused"""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.admitted = set()
+
+    def admit(self, value):
+        if value in self.admitted:
+            return True
+        if len(self.admitted) >= self.limit:
+            metrics_dropped_series.labels(metric=self.name).inc()
+            return False
+        self.admitted.add(value)
+        return True
+
+    def forget(self, value):
+        self.admitted.discard(value)
+
+device_series = SeriesLimiter('device_id', METRICS_MAX_DEVICE_SERIES)
+location_series = SeriesLimiter('location', METRICS_MAX_LOCATIONS)
+
+def bucket_label(value, edges):
+    """Range label such as "20..50" for ``value`` within ``edges``"""
+    if value is None:
+        return "unknown"
+    lower = None
+    for edge in edges:
+        if value < edge:
+            return f"{lower}..{edge}" if lower is not None else f"<{edge}"
+        lower = edge
+    return f">={lower}"
+
+def remove_series(metric, *labels):
+    """Remove a labelled series that may never have been set
+
+    In multiprocess mode the last sample stays in this worker's file until
+    the worker exits; removing only stops this process updating it.
+    """
+    try:
+        metric.remove(*labels)
+    except KeyError:
+        pass
+
+def clear_status_series(device_id, status):
+    """Take a device's status series off ``status``"""
+    if MULTIPROCESS:
+        # Samples cannot be deleted from the workers' files, and another worker may have set this
+        # one to 1; the most recent 0 wins the merge (multiprocess_mode='livemostrecent')
+        device_status_gauge.labels(device_id=device_id, status=status).set(0)
+    else:
+        remove_series(device_status_gauge, device_id, status)
+
+def record_heartbeat(device_id, status, location=None, battery_level=None, signal_strength=None, latency=None):
+    """Count one accepted heartbeat (and its latency) under the configured cardinality mode"""
+    if PER_DEVICE_METRICS:
+        if not device_series.admit(device_id):
+            return
+        heartbeat_counter.labels(device_id=device_id, status=status).inc()
+        if latency is not None:
+            heartbeat_latency.labels(device_id=device_id).observe(latency)
+        return
+
+    if location is None:
+        location = "unknown"
+    elif not location_series.admit(location):
+        location = "other"
+    heartbeat_counter.labels(
+        status=status,
+        location=location,
+        battery=bucket_label(battery_level, BATTERY_BUCKETS),
+        signal=bucket_label(signal_strength, SIGNAL_BUCKETS)
+    ).inc()
+    if latency is not None:
+        heartbeat_latency.observe(latency)
+
+def record_device_readings(device_id, battery_level=None, signal_strength=None):
+    """Set the per-device battery and signal gauges"""
+    if not PER_DEVICE_METRICS or not device_series.admit(device_id):
+        return
+    if battery_level is not None:
+        battery_level_gauge.labels(device_id=device_id).set(battery_level)
+    if signal_strength is not None:
+        signal_strength_gauge.labels(device_id=device_id).set(signal_strength)
+
+def record_status_change(device_id, old_status, new_status, status_counts):
+    """Move a device's status series and refresh the affected count gauges"""
+    if old_status is not None:
+        device_count_gauge.labels(status=old_status).set(status_counts[old_status])
+    device_count_gauge.labels(status=new_status).set(status_counts[new_status])
+    if not PER_DEVICE_METRICS or device_id not in device_series.admitted:
+        return
+    if old_status is not None:
+        clear_status_series(device_id, old_status)
+    device_status_gauge.labels(device_id=device_id, status=new_status).set(1)
+
+def forget_device_metrics(device_id, status, status_counts):
+    """Drop every labelled series of a deleted device"""
+    if status is not None:
+        device_count_gauge.labels(status=status).set(status_counts[status])
+    if device_id not in device_series.admitted:
+        return
+    device_series.forget(device_id)
+    if status is not None:
+        clear_status_series(device_id, status)
+    for gauge in (battery_level_gauge, signal_strength_gauge):
+        remove_series(gauge, device_id)
+    if PER_DEVICE_METRICS:
+        remove_series(heartbeat_latency, device_id)
+        for old_status in ('online', 'offline', 'at-risk'):
+            remove_series(heartbeat_counter, device_id, old_status)
+
+class DeviceSnapshotCollector:
+    """Per-device gauges for a snapshot of (device_id, status, last_seen, battery, signal) rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def collect(self):
+        status = GaugeMetricFamily('iot_device_status', 'Current status of IoT devices', labels=['device_id', 'status'])
+        last_seen = GaugeMetricFamily(
+            'iot_device_last_seen_timestamp_seconds', 'Last heartbeat time of IoT devices', labels=['device_id']
+        )
+        battery = GaugeMetricFamily('iot_device_battery_level', 'Battery level of IoT devices', labels=['device_id'])
+        signal = GaugeMetricFamily('iot_device_signal_strength', 'Signal strength of IoT devices', labels=['device_id'])
+        for device_id, device_status, seen_at, battery_level, signal_strength in self.rows:
+            status.add_metric([device_id, device_status], 1)
+            if seen_at is not None:
+                last_seen.add_metric([device_id], seen_at.replace(tzinfo=timezone.utc).timestamp())
+            if battery_level is not None:
+                battery.add_metric([device_id], battery_level)
+            if signal_strength is not None:
+                signal.add_metric([device_id], signal_strength)
+        return [status, last_seen, battery, signal]
+
+def get_device_metrics(rows):
+    """Render per-device metrics on demand, outside the main registry"""
+    registry = CollectorRegistry()
+    registry.register(DeviceSnapshotCollector(rows))
+    return Response(
+        content=generate_latest(registry),
+        media_type=CONTENT_TYPE_LATEST
+    )
 
 def get_metrics():
     """Return Prometheus metrics"""
+    if MULTIPROCESS:
+        # Merge the samples written by every worker process
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        content = generate_latest(registry)
+    else:
+        content = generate_latest()
     return Response(
-        content=generate_latest(),
+        content=content,
         media_type=CONTENT_TYPE_LATEST
-    ) 
\ No newline at end of file
+    )
\ No newline at end of file
@@ -1,29 +1,71 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, Text, Index, case, and_, or_, literal_column, text
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql import func
 from .database import Base
 from datetime import datetime, timedelta
 
+# Status thresholds
+ONLINE_TIMEOUT_MINUTES = 5      # Offline once silent for this long
+AT_RISK_TIMEOUT_MINUTES = 2     # At-risk once silent for longer than this
+LOW_BATTERY_THRESHOLD = 20.0    # At-risk below this battery percentage
+
+def classify_status(last_seen, battery_level, now=None):
+    """Status for a device with the given last_seen and battery level"""
+    if not last_seen:
+        return "offline"
+    silence = (now or datetime.utcnow()) - last_seen
+    if silence >= timedelta(minutes=ONLINE_TIMEOUT_MINUTES):
+        return "offline"
+    if silence > timedelta(minutes=AT_RISK_TIMEOUT_MINUTES):
+        return "at-risk"
+    if battery_level is not None and battery_level < LOW_BATTERY_THRESHOLD:
+        return "at-risk"
+    return "online"
+
+def status_cutoffs(now=None):
+    """(offline_before, at_risk_before) last_seen cutoffs as of ``now``"""
+    now = now or datetime.utcnow()
+    return (
+        now - timedelta(minutes=ONLINE_TIMEOUT_MINUTES),
+        now - timedelta(minutes=AT_RISK_TIMEOUT_MINUTES),
+    )
+
 class Device(Base):
     __tablename__ = "devices"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     device_id = Column(String, unique=True, index=True, nullable=False)
     name = Column(String, nullable=True)
     status = Column(String, default="offline")  # online, offline, at-risk
     last_seen = Column(DateTime, default=func.now())
-    battery_level = Column(Float, nullable=True)  # 0.0 to 100.0
-    signal_strength = Column(Float, nullable=True)  # dBm values
+    battery_level = Column(Float, nullable=True, index=True)  # 0.0 to 100.0
+    signal_strength = Column(Float, nullable=True, index=True)  # dBm values
     location = Column(String, nullable=True)
+    expected_interval = Column(Integer, nullable=True)  # seconds between heartbeats, from provisioning
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
-    def is_online(self, timeout_minutes=5):
+    # Kept in step with the migrations under migrations/versions
+    __table_args__ = (
+        # Serves both last_seen range filters and (last_seen, id) keyset pagination
+        Index("ix_devices_last_seen_id", "last_seen", "id"),
+        # Location-filtered listings in their default device_id order
+        Index("ix_devices_location_device_id", "location", "device_id"),
+        # The low-battery branch of the at-risk filter: a small index over just those devices
+        Index(
+            "ix_devices_low_battery_last_seen", "last_seen",
+            postgresql_where=text(f"battery_level < {LOW_BATTERY_THRESHOLD:g}"),
+            sqlite_where=text(f"battery_level < {LOW_BATTERY_THRESHOLD:g}"),
+        ),
+    )
+    
+    def is_online(self, timeout_minutes=ONLINE_TIMEOUT_MINUTES):
         """Check if device is online based on last seen timestamp"""
         if not self.last_seen:
             return False
         return datetime.utcnow() - self.last_seen < timedelta(minutes=timeout_minutes)
     
-    def is_at_risk(self, timeout_minutes=2, battery_threshold=20.0):
+    def is_at_risk(self, timeout_minutes=AT_RISK_TIMEOUT_MINUTES, battery_threshold=LOW_BATTERY_THRESHOLD):
         """Check if device is at risk based on timeout and battery level"""
         if not self.last_seen:
             return True
@@ -39,12 +81,102 @@ class Device(Base):
             
         return False
     
-    def update_status(self):
+    def update_status(self, now=None):
         """Update device status based on current conditions"""
-        if self.is_online():
-            if self.is_at_risk():
-                self.status = "at-risk"
-            else:
-                self.status = "online"
-        else:
-            self.status = "offline" 
\ No newline at end of file
+        self.status = classify_status(self.last_seen, self.battery_level, now)
+    
+    @hybrid_property
+    def current_status(self):
+        """Status as of now; usable in queries as a SQL CASE expression"""
+        return classify_status(self.last_seen, self.battery_level)
+    
+    @current_status.expression
+    def current_status(cls):
+        return cls.status_expression()
+    
+    @classmethod
+    def status_expression(cls, now=None):
+        """SQL CASE equivalent of classify_status()"""
+        offline_before, at_risk_before = status_cutoffs(now)
+        return case(
+            (or_(cls.last_seen.is_(None), cls.last_seen <= offline_before), "offline"),
+            (cls.last_seen < at_risk_before, "at-risk"),
+            (cls.battery_level < LOW_BATTERY_THRESHOLD, "at-risk"),
+            else_="online"
+        )
+    
+    @classmethod
+    def status_filter(cls, status, now=None):
+        """Range predicate on last_seen/battery_level matching devices in ``status``
+        
+        Unlike comparing status_expression() to a value, this form can use the
+        last_seen and battery_level indexes.
+        """
+        offline_before, at_risk_before = status_cutoffs(now)
+        if status == "offline":
+            return or_(cls.last_seen.is_(None), cls.last_seen <= offline_before)
+        if status == "at-risk":
+            # Inline the threshold so even a generic prepared plan can use ix_devices_low_battery_last_seen
+            low_battery = cls.battery_level < literal_column(f"{LOW_BATTERY_THRESHOLD:g}")
+            return and_(
+                cls.last_seen > offline_before,
+                or_(cls.last_seen < at_risk_before, low_battery)
+            )
+        return and_(
+            cls.last_seen >= at_risk_before,
+            or_(cls.battery_level.is_(None), cls.battery_level >= LOW_BATTERY_THRESHOLD)
+        ) 
+
+class HeartbeatEvent(Base):
+    """Append-only heartbeat history, range-partitioned by day on recorded_at in PostgreSQL"""
+    __tablename__ = "heartbeat_events"
+    
+    device_id = Column(String, primary_key=True)
+    recorded_at = Column(DateTime, primary_key=True)
+    battery_level = Column(Float, nullable=True)
+    signal_strength = Column(Float, nullable=True)
+    
+    # The (device_id, recorded_at) primary key doubles as the history lookup index;
+    # rows arrive in time order, so a BRIN index covers fleet-wide time ranges for a few pages
+    __table_args__ = (
+        Index("ix_heartbeat_events_recorded_at_brin", "recorded_at", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (recorded_at)"},
+    )
+
+
+class StatusTransition(Base):
+    """A detected change in a device's status"""
+    __tablename__ = "status_transitions"
+    
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    from_status = Column(String, nullable=False)
+    to_status = Column(String, nullable=False)
+    occurred_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_status_transitions_device_occurred", "device_id", "occurred_at"),
+        Index("ix_status_transitions_occurred_at_brin", "occurred_at", postgresql_using="brin"),
+    )
+
+
+class FleetLocationSummary(Base):
+    """Per-location fleet rollup, rebuilt periodically from devices"""
+    __tablename__ = "fleet_location_summary"
+    
+    location = Column(String, primary_key=True)  # "" for devices without a location
+    total = Column(Integer, nullable=False)
+    online = Column(Integer, nullable=False)
+    at_risk = Column(Integer, nullable=False)
+    offline = Column(Integer, nullable=False)
+    # Battery histogram; the band edges are BATTERY_EDGES in app/fleet.py
+    battery_low = Column(Integer, nullable=False)
+    battery_mid = Column(Integer, nullable=False)
+    battery_high = Column(Integer, nullable=False)
+    battery_full = Column(Integer, nullable=False)
+    battery_unknown = Column(Integer, nullable=False)
+    battery_avg = Column(Float, nullable=True)
+    battery_min = Column(Float, nullable=True)
+    signal_avg = Column(Float, nullable=True)
+    signal_min = Column(Float, nullable=True)
+    refreshed_at = Column(DateTime, nullable=False)
\ No newline at end of file
@@ -0,0 +1,145 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .metrics import request_latency, request_stage_latency, request_db_queries, request_db_pool_wait
+
+# On-demand profiling: /debug/profile is disabled unless a token is configured
+DEBUG_PROFILE_TOKEN = os.getenv("DEBUG_PROFILE_TOKEN", "")
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))   # seconds
+
+class RequestTimings:
+    """Time spent per stage, queries run and pool wait for one request"""
+    __slots__ = ('started', 'stages', 'queries', 'pool_wait')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.queries = 0
+        self.pool_wait = 0.0
+
+current_timings = ContextVar("current_timings", default=None)
+
+@contextmanager
+def stage(name):
+    """Attribute the time spent in the ``with`` block to a stage of the current request"""
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.stages[name] = timings.stages.get(name, 0.0) + time.perf_counter() - start
+
+def request_elapsed():
+    """Seconds since the current request arrived, or None outside a request"""
+    timings = current_timings.get()
+    return time.perf_counter() - timings.started if timings is not None else None
+
+def count_query(*args):
+    """before_cursor_execute listener counting statements per request"""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.queries += 1
+
+def record_pool_wait(seconds):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.pool_wait += seconds
+
+class InstrumentationMiddleware:
+    """ASGI middleware timing each request from arrival to response start
+
+    Handlers mark stages with ``stage()``; once the response starts, the
+    stages, total time, statement count and connection pool wait are
+    observed under the endpoint's function name, which keeps label
+    cardinality at the number of routes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        observed = False
+
+        def observe():
+            nonlocal observed
+            observed = True
+            endpoint = getattr(scope.get("endpoint"), "__name__", None)
+            if endpoint is None:
+                return
+            request_latency.labels(endpoint=endpoint).observe(time.perf_counter() - timings.started)
+            for name, seconds in timings.stages.items():
+                request_stage_latency.labels(endpoint=endpoint, stage=name).observe(seconds)
+            request_db_queries.labels(endpoint=endpoint).observe(timings.queries)
+            request_db_pool_wait.labels(endpoint=endpoint).observe(timings.pool_wait)
+
+        async def instrumented_send(message):
+            if message["type"] == "http.response.start" and not observed:
+                observe()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, instrumented_send)
+        finally:
+            current_timings.reset(token)
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another is running"""
+
+class SamplingProfiler:
+    """Samples Python stacks of the running process from a background thread
+
+    Every ``interval`` seconds the sampler records the current stack of the
+    target threads, so the cost is independent of how much code runs. The
+    result is in collapsed-stack format ("frame;frame;frame count" per
+    line), which flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    def run(self, seconds, thread_ids=None):
+        """Sample for ``seconds``; returns (samples taken, Counter of collapsed stacks)"""
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running in this worker")
+        try:
+            sampler = threading.get_ident()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = Counter()
+            samples = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == sampler or (thread_ids is not None and ident not in thread_ids):
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    frames.append(names.get(ident, f"thread-{ident}"))
+                    stacks[";".join(reversed(frames))] += 1
+                samples += 1
+                time.sleep(self.interval)
+            return samples, stacks
+        finally:
+            self.lock.release()
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+profiler = SamplingProfiler()
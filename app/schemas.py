@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 class HeartbeatRequest(BaseModel):
@@ -9,30 +9,119 @@ class HeartbeatRequest(BaseModel):
     signal_strength: Optional[float] = Field(None, description="Signal strength in dBm")
     location: Optional[str] = Field(None, description="Device location")
 
+class DeviceProvision(BaseModel):
+    device_id: str = Field(..., min_length=1, description="Unique device identifier")
+    name: Optional[str] = Field(None, description="Human-readable device name")
+    location: Optional[str] = Field(None, description="Device location")
+    expected_interval: Optional[int] = Field(None, ge=1, description="Seconds between heartbeats")
+
 class DeviceResponse(BaseModel):
     id: int
     device_id: str
     name: Optional[str]
     status: str
-    last_seen: datetime
+    last_seen: Optional[datetime]
     battery_level: Optional[float]
     signal_strength: Optional[float]
     location: Optional[str]
+    expected_interval: Optional[int] = Field(None, description="Provisioned seconds between heartbeats")
     created_at: datetime
     updated_at: datetime
+    anomaly_score: Optional[float] = Field(None, description="Interval/battery drain anomaly score")
     
     class Config:
         from_attributes = True
 
-class DeviceListResponse(BaseModel):
-    devices: List[DeviceResponse]
+class DevicePage(BaseModel):
+    devices: List[Dict[str, Any]]
+    count: int
+    next_cursor: Optional[str] = None
+
+class DeviceCountsResponse(BaseModel):
     total_count: int
     online_count: int
     offline_count: int
     at_risk_count: int
+    anomalous_count: int = 0
 
 class HealthResponse(BaseModel):
     status: str
     timestamp: datetime
     database_connected: bool
-    total_devices: int 
\ No newline at end of file
+    total_devices: int 
+
+class ReadinessResponse(BaseModel):
+    status: str
+    started: bool
+    database_connected: bool
+    checked_at: Optional[datetime] = None
+
+class HeartbeatBatchResult(BaseModel):
+    device_id: str
+    status: str
+    created: bool
+
+class HeartbeatBatchResponse(BaseModel):
+    received: int
+    accepted: int
+    results: List[HeartbeatBatchResult]
+    coalesced: int = 0
+
+
+class HeartbeatAck(BaseModel):
+    device_id: str
+    status: str
+    queued: bool = True
+    coalesced: bool = False
+
+class HeartbeatBatchAck(BaseModel):
+    received: int
+    queued: int
+    coalesced: int = 0
+
+
+class HistoryBucket(BaseModel):
+    bucket_start: datetime
+    count: int
+    battery_min: Optional[float]
+    battery_avg: Optional[float]
+    battery_max: Optional[float]
+    signal_min: Optional[float]
+    signal_avg: Optional[float]
+    signal_max: Optional[float]
+
+class DeviceHistoryResponse(BaseModel):
+    device_id: str
+    start: datetime
+    end: datetime
+    bucket_seconds: int
+    buckets: List[HistoryBucket]
+
+
+class LocationSummary(BaseModel):
+    location: Optional[str]
+    total: int
+    online: int
+    at_risk: int
+    offline: int
+    battery_avg: Optional[float]
+    battery_min: Optional[float]
+    signal_avg: Optional[float]
+    signal_min: Optional[float]
+
+class FleetDevice(BaseModel):
+    device_id: str
+    location: Optional[str]
+    last_seen: Optional[datetime]
+    battery_level: Optional[float]
+    signal_strength: Optional[float]
+
+class FleetSummaryResponse(BaseModel):
+    refreshed_at: Optional[datetime]
+    total_count: int
+    status_counts: Dict[str, int]
+    battery_histogram: Dict[str, int]
+    locations: List[LocationSummary]
+    lowest_battery: List[FleetDevice]
+    longest_silent: List[FleetDevice]
+    weakest_signal: List[FleetDevice]
\ No newline at end of file
@@ -0,0 +1,177 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Only gzip is offered without it
+    brotli = None
+
+from .detector import status_detector
+from .metrics import snapshot_responses_counter
+
+# Read snapshot settings
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "2.0"))        # min seconds between generations
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", "30"))           # seconds before a quiet generation expires
+SNAPSHOT_MAX_RESPONSES = int(os.getenv("SNAPSHOT_MAX_RESPONSES", "512"))  # cached responses per generation
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))       # smaller bodies are sent uncompressed
+
+def encode_json(value) -> bytes:
+    """Compact JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(
+        value, separators=(",", ":"),
+        default=lambda item: item.isoformat() if isinstance(item, datetime) else str(item)
+    ).encode()
+
+# Content codings in order of preference
+COMPRESSORS = {"gzip": lambda body: gzip.compress(body, compresslevel=6)}
+if brotli is not None:
+    COMPRESSORS = {"br": lambda body: brotli.compress(body, quality=5), **COMPRESSORS}
+
+def negotiate_encoding(accept_encoding: str):
+    """Preferred coding the client accepts (q > 0), or None for identity"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    for coding in COMPRESSORS:
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+def etag_matches(if_none_match: str, digest: str) -> bool:
+    """Whether an If-None-Match header names any representation of ``digest``"""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag.removeprefix("W/").strip('"')
+        if tag == digest or tag.rsplit("-", 1)[0] == digest:
+            return True
+    return False
+
+class CachedResponse:
+    """Serialized body of one read, with its strong ETag and compressed variants"""
+    __slots__ = ('body', 'media_type', 'digest', 'encoded')
+
+    def __init__(self, body: bytes, media_type: str):
+        self.body = body
+        self.media_type = media_type
+        self.digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.encoded = {}
+
+    async def respond(self, request: Request):
+        """200 with the negotiated coding, or 304 when the client already has this body"""
+        coding = None
+        if len(self.body) >= COMPRESS_MIN_BYTES:
+            coding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        # Strong ETags are per representation, so each coding gets its own tag
+        headers = {
+            "ETag": f'"{self.digest}-{coding}"' if coding else f'"{self.digest}"',
+            "Vary": "Accept-Encoding",
+            "Cache-Control": "no-cache",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, self.digest):
+            snapshot_responses_counter.labels(result='not_modified').inc()
+            return Response(status_code=304, headers=headers)
+        body = self.body
+        if coding:
+            body = self.encoded.get(coding)
+            if body is None:
+                body = self.encoded[coding] = await asyncio.to_thread(COMPRESSORS[coding], self.body)
+            headers["Content-Encoding"] = coding
+        return Response(body, media_type=self.media_type, headers=headers)
+
+class Snapshot:
+    """One immutable generation of the fleet's read views
+
+    Each distinct read (endpoint and parameters) is built at most once per
+    generation and then served from its serialized bytes.
+    """
+
+    def __init__(self, generation, version, max_responses=SNAPSHOT_MAX_RESPONSES):
+        self.generation = generation
+        self.version = version
+        self.created = time.monotonic()
+        self.max_responses = max_responses
+        self.responses = OrderedDict()
+        self.building = {}
+
+class SnapshotStore:
+    """Hands out the current snapshot, starting a new generation when the fleet has changed
+
+    A new generation starts at most once per ``interval`` seconds and only if
+    the status detector saw a change since the current one began (heartbeats,
+    transitions, deletes, imports). ``max_age`` also retires a quiet
+    generation, bounding staleness for changes this worker cannot see.
+    """
+
+    def __init__(self, interval=SNAPSHOT_INTERVAL, max_age=SNAPSHOT_MAX_AGE):
+        self.interval = interval
+        self.max_age = max_age
+        self.current = None
+
+    def snapshot(self):
+        current = self.current
+        if current is not None:
+            age = time.monotonic() - current.created
+            if age < self.interval or (age < self.max_age and status_detector.version == current.version):
+                return current
+        generation = current.generation + 1 if current is not None else 1
+        self.current = Snapshot(generation, status_detector.version)
+        return self.current
+
+    async def respond(self, request: Request, key, build, media_type="application/json"):
+        """Serve ``key`` from the current snapshot; ``build()`` returns its body on a miss
+
+        Concurrent misses on the same key share one build. Exceptions raised by
+        ``build()`` reach every waiting request and nothing is cached.
+        """
+        snapshot = self.snapshot()
+        cached = snapshot.responses.get(key)
+        if cached is not None:
+            snapshot.responses.move_to_end(key)
+            snapshot_responses_counter.labels(result='hit').inc()
+            return await cached.respond(request)
+
+        building = snapshot.building.get(key)
+        if building is None:
+            snapshot_responses_counter.labels(result='miss').inc()
+            building = snapshot.building[key] = asyncio.ensure_future(self._build(snapshot, key, build, media_type))
+        cached = await asyncio.shield(building)
+        return await cached.respond(request)
+
+    async def _build(self, snapshot, key, build, media_type):
+        try:
+            # Hashing a large body (the dashboard) would stall the event loop
+            cached = await asyncio.to_thread(CachedResponse, await build(), media_type)
+        finally:
+            snapshot.building.pop(key, None)
+        snapshot.responses[key] = cached
+        while len(snapshot.responses) > snapshot.max_responses:
+            snapshot.responses.popitem(last=False)
+        return cached
+
+fleet_snapshot = SnapshotStore()
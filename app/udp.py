@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import socket
+import struct
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pydantic import ValidationError
+
+try:
+    import msgpack
+except ImportError:  # MessagePack datagrams are rejected without it
+    msgpack = None
+
+from .database import AsyncSessionLocal
+from .schemas import HeartbeatRequest
+from .ingestion import coalesce_heartbeats, upsert_heartbeats_async, fresh_status, track_heartbeat
+from .buffer import ingest_buffer, BufferFull
+from .metrics import record_heartbeat, udp_datagrams_counter, udp_flush_latency
+
+# UDP listener settings
+UDP_ENABLED = os.getenv("UDP_ENABLED", "false").lower() in ("1", "true", "yes")
+UDP_HOST = os.getenv("UDP_HOST", "0.0.0.0")
+UDP_PORT = int(os.getenv("UDP_PORT", "9000"))
+UDP_HMAC_KEY = os.getenv("UDP_HMAC_KEY", "")                                # required on every datagram when set
+UDP_FLUSH_INTERVAL = float(os.getenv("UDP_FLUSH_INTERVAL", "0.2"))          # seconds
+UDP_FLUSH_SIZE = int(os.getenv("UDP_FLUSH_SIZE", "5000"))                   # heartbeats
+UDP_QUEUE_MAX = int(os.getenv("UDP_QUEUE_MAX", "100000"))                   # heartbeats
+UDP_DEDUP_SIZE = int(os.getenv("UDP_DEDUP_SIZE", "100000"))                 # devices
+UDP_SEQ_WINDOW = int(os.getenv("UDP_SEQ_WINDOW", str(2**31 - 1)))           # max seq advance accepted with HMAC
+
+# Fixed binary layouts, network byte order:
+#   version u8 (1) | flags u8 | seq u32 | device_id 32s (UTF-8, NUL padded)
+#   | battery u16 (hundredths of a percent) | signal i16 (tenths of a dBm)
+#   version u8 (2) | flags u8 | boot u32 | seq u32 | device_id 32s | battery u16 | signal i16
+# followed by a 16-byte truncated HMAC-SHA256 of the preceding bytes when UDP_HMAC_KEY is set.
+# boot counts the device's restarts (kept in its flash), so seq can start again from 0 after one.
+# A datagram whose first byte is a MessagePack map is decoded as
+#   {"device_id": str, "boot": int, "seq": int, "battery_level": float, "signal_strength": float, ...}
+# with the same optional HMAC trailer; boot is optional and 0 when left out.
+BINARY_VERSION = 1
+BINARY_HEARTBEAT = struct.Struct("!BBI32sHh")
+BOOT_VERSION = 2
+BOOT_HEARTBEAT = struct.Struct("!BBII32sHh")
+FLAG_BATTERY = 0x01
+FLAG_SIGNAL = 0x02
+HMAC_SIZE = 16
+SEQ_MODULUS = 2**32
+
+class InvalidDatagram(Exception):
+    """Raised for datagrams that cannot be decoded into a heartbeat"""
+
+def sign(payload: bytes, key: bytes) -> bytes:
+    return hmac.new(key, payload, hashlib.sha256).digest()[:HMAC_SIZE]
+
+def encode_heartbeat(device_id: str, seq: int, battery_level: float = None, signal_strength: float = None,
+                     key: bytes = None, boot: int = None) -> bytes:
+    """Build a binary heartbeat datagram (for device firmware and load tests); version 2 when ``boot`` is given"""
+    raw_id = device_id.encode("utf-8")
+    if not raw_id or len(raw_id) > 32:
+        raise ValueError("device_id must be 1-32 bytes of UTF-8")
+    flags = (FLAG_BATTERY if battery_level is not None else 0) | (FLAG_SIGNAL if signal_strength is not None else 0)
+    readings = (int(round((battery_level or 0) * 100)), int(round((signal_strength or 0) * 10)))
+    if boot is None:
+        payload = BINARY_HEARTBEAT.pack(BINARY_VERSION, flags, seq & 0xFFFFFFFF, raw_id, *readings)
+    else:
+        payload = BOOT_HEARTBEAT.pack(BOOT_VERSION, flags, boot & 0xFFFFFFFF, seq & 0xFFFFFFFF, raw_id, *readings)
+    return payload + sign(payload, key) if key else payload
+
+def is_msgpack_map(first_byte: int) -> bool:
+    return 0x80 <= first_byte <= 0x8F or first_byte in (0xDE, 0xDF)
+
+def decode_datagram(data: bytes, key: bytes = None):
+    """(protocol, boot, seq, HeartbeatRequest) for one datagram"""
+    if key:
+        if len(data) <= HMAC_SIZE:
+            raise InvalidDatagram("unauthenticated")
+        data, tag = data[:-HMAC_SIZE], data[-HMAC_SIZE:]
+        if not hmac.compare_digest(tag, sign(data, key)):
+            raise InvalidDatagram("unauthenticated")
+    if not data:
+        raise InvalidDatagram("invalid")
+
+    if data[0] in (BINARY_VERSION, BOOT_VERSION):
+        if data[0] == BINARY_VERSION and len(data) == BINARY_HEARTBEAT.size:
+            boot = 0
+            _, flags, seq, raw_id, battery, signal = BINARY_HEARTBEAT.unpack(data)
+        elif data[0] == BOOT_VERSION and len(data) == BOOT_HEARTBEAT.size:
+            _, flags, boot, seq, raw_id, battery, signal = BOOT_HEARTBEAT.unpack(data)
+        else:
+            raise InvalidDatagram("invalid")
+        try:
+            device_id = raw_id.rstrip(b"\0").decode("utf-8")
+        except UnicodeDecodeError:
+            raise InvalidDatagram("invalid")
+        battery_level = battery / 100 if flags & FLAG_BATTERY else None
+        if not device_id or (battery_level is not None and battery_level > 100):
+            raise InvalidDatagram("invalid")
+        # The fixed layout is already validated; skip pydantic on the hot path
+        return "udp_binary", boot, seq, HeartbeatRequest.model_construct(
+            device_id=device_id,
+            name=None,
+            battery_level=battery_level,
+            signal_strength=signal / 10 if flags & FLAG_SIGNAL else None,
+            location=None
+        )
+
+    if is_msgpack_map(data[0]) and msgpack is not None:
+        try:
+            fields = msgpack.unpackb(data)
+            seq, boot = fields.pop("seq", None), fields.pop("boot", 0)
+            for value in (seq, boot):
+                if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                    raise InvalidDatagram("invalid")
+            return "udp_msgpack", boot or 0, seq, HeartbeatRequest.model_validate(fields)
+        except (ValueError, TypeError, AttributeError, ValidationError):
+            raise InvalidDatagram("invalid")
+    raise InvalidDatagram("invalid")
+
+class HeartbeatDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, listener):
+        self.listener = listener
+
+    def datagram_received(self, data, addr):
+        self.listener.receive(data)
+
+class UdpHeartbeatListener:
+    """Receives heartbeats as UDP datagrams and ingests them in batches
+
+    Datagrams are decoded, authenticated and de-duplicated on arrival
+    (a retransmit repeats the device's last boot and sequence number; with
+    HMAC, anything that does not advance them is a replay), then applied
+    every ``flush_interval`` seconds through the same path as
+    POST /heartbeats: the write-behind buffer when it is running,
+    otherwise one bulk upsert.
+    """
+
+    def __init__(self, host=UDP_HOST, port=UDP_PORT, key=UDP_HMAC_KEY, flush_interval=UDP_FLUSH_INTERVAL,
+                 flush_size=UDP_FLUSH_SIZE, max_pending=UDP_QUEUE_MAX, dedup_size=UDP_DEDUP_SIZE,
+                 seq_window=UDP_SEQ_WINDOW):
+        self.host = host
+        self.port = port
+        self.key = key.encode("utf-8") if key else None
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.dedup_size = dedup_size
+        self.seq_window = seq_window
+        self.pending = []
+        self.last_seq = OrderedDict()
+        self.transport = None
+        self._task = None
+        self._wake = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Bind the socket and start the flush task on the running event loop"""
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        # SO_REUSEPORT lets every worker bind the port; the kernel spreads datagrams across them
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: HeartbeatDatagramProtocol(self),
+            local_addr=(self.host, self.port),
+            reuse_port=hasattr(socket, "SO_REUSEPORT")
+        )
+        self._task = asyncio.create_task(self._run())
+        auth = "HMAC required" if self.key else "no authentication"
+        print(f"✅ UDP heartbeat listener on {self.host}:{self.port} ({auth})")
+
+    def receive(self, data: bytes):
+        try:
+            protocol, boot, seq, heartbeat = decode_datagram(data, self.key)
+        except InvalidDatagram as e:
+            udp_datagrams_counter.labels(result=str(e)).inc()
+            return
+        if seq is None and self.key:
+            # Without a sequence number a signed datagram could be replayed at will
+            udp_datagrams_counter.labels(result="invalid").inc()
+            return
+        if seq is not None and self.is_duplicate(heartbeat.device_id, seq, boot):
+            udp_datagrams_counter.labels(result="duplicate").inc()
+            return
+        if len(self.pending) >= self.max_pending:
+            udp_datagrams_counter.labels(result="dropped").inc()
+            return
+        udp_datagrams_counter.labels(result="accepted").inc()
+        self.pending.append((protocol, heartbeat))
+        if len(self.pending) >= self.flush_size:
+            self._wake.set()
+
+    def is_duplicate(self, device_id: str, seq: int, boot: int = 0) -> bool:
+        """Whether ``seq`` is a retransmit or replay; records it otherwise
+
+        Unauthenticated devices only lose a repeat of their last boot and
+        sequence number, so a rebooted device that restarts from 0 keeps
+        working. With HMAC, a higher boot counter starts a new sequence;
+        within a boot the sequence number must advance (mod 2^32) by at most
+        ``seq_window``, so an older captured datagram cannot be replayed.
+        The state is this worker's, for its ``dedup_size`` most recent devices.
+        """
+        last = self.last_seq.get(device_id)
+        if last is not None:
+            last_boot, last_seq = last
+            if self.key:
+                if boot < last_boot:
+                    return True
+                if boot == last_boot and not 0 < (seq - last_seq) % SEQ_MODULUS <= self.seq_window:
+                    return True
+            elif last == (boot, seq):
+                return True
+        self.last_seq[device_id] = (boot, seq)
+        self.last_seq.move_to_end(device_id)
+        if len(self.last_seq) > self.dedup_size:
+            self.last_seq.popitem(last=False)
+        return False
+
+    async def flush(self):
+        """Ingest every pending heartbeat"""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending[:self.flush_size], self.pending[self.flush_size:]
+        if len(self.pending) >= self.flush_size and self._wake is not None:
+            self._wake.set()
+        start_time = time.time()
+        seen_at = datetime.utcnow()
+        protocols = {heartbeat.device_id: protocol for protocol, heartbeat in batch}
+        records = coalesce_heartbeats([heartbeat for _, heartbeat in batch], seen_at)
+        try:
+            if ingest_buffer.running:
+                for record in records.values():
+                    try:
+                        pending = await ingest_buffer.submit(record)
+                    except BufferFull:
+                        udp_datagrams_counter.labels(result="dropped").inc()
+                        continue
+                    self.accept(record, fresh_status(pending.get("battery_level")), protocols)
+            else:
+                async with AsyncSessionLocal() as db:
+                    rows = await upsert_heartbeats_async(db, records)
+                for row in rows:
+                    self.accept(records[row.device_id], row.status, protocols)
+        except Exception as e:
+            udp_datagrams_counter.labels(result="failed").inc(len(batch))
+            print(f"❌ Failed to ingest {len(batch)} UDP heartbeats: {e}")
+        finally:
+            udp_flush_latency.observe(time.time() - start_time)
+        return len(batch)
+
+    @staticmethod
+    def accept(record, status, protocols):
+        track_heartbeat(record, protocol=protocols[record["device_id"]])
+        record_heartbeat(
+            record["device_id"], status, record.get("location"), record.get("battery_level"),
+            record.get("signal_strength")
+        )
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def stop(self):
+        """Close the socket and ingest whatever is still pending"""
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await asyncio.wait({self._task}, timeout=self.flush_interval + 10)
+            self._task = None
+        while self.pending:
+            await self.flush()
+
+udp_listener = UdpHeartbeatListener()
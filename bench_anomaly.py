@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Anomaly Scoring Benchmark
+Builds heartbeat statistics for a simulated fleet in the anomaly engine's arrays,
+then times full scoring passes. Each heartbeat round goes through the queue that
+observe() fills, so turning queued heartbeats into arrays is timed along with the
+fold. Exits non-zero if converting, folding and scoring one round exceeds --budget
+seconds.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from app.anomaly import AnomalyEngine
+
+def simulate(engine, devices, heartbeats, rng, anomalous_fraction):
+    """Feed ``heartbeats`` rounds of regular heartbeats, then make some devices misbehave
+
+    Returns (conversion times, fold times, "now", indexes of silent devices, indexes of fast-draining devices).
+    """
+    slots = np.array([engine._assign(f"sensor-{i:07d}") for i in range(devices)], np.int64)
+    periods = rng.lognormal(np.log(30), 0.8, devices).clip(5, 600)          # seconds between heartbeats
+    drains = rng.uniform(0.5, 3.0, devices)                                 # percent per hour
+    start = 1_700_000_000.0
+    # Roughly one drain sample every ANOMALY_DRAIN_WINDOW for every device
+    engine.drain_window = float(np.median(periods))
+
+    convert_times, fold_times = [], []
+    for beat in range(heartbeats):
+        times = start + beat * periods + rng.normal(0, 0.05, devices) * periods
+        batteries = (100 - drains * (times - start) / 3600).astype(np.float32)
+        # The (slot, time, battery) tuples observe() queues for the next pass
+        queued = list(zip(slots.tolist(), times.tolist(), batteries.tolist()))
+        began = time.perf_counter()
+        arrays = engine.pending_arrays(queued)
+        convert_times.append(time.perf_counter() - began)
+        began = time.perf_counter()
+        engine.observe_many(*arrays)
+        fold_times.append(time.perf_counter() - began)
+
+    last = start + (heartbeats - 1) * periods
+    count = int(devices * anomalous_fraction)
+    silent = rng.choice(devices, count, replace=False)
+    draining = rng.choice(np.setdiff1d(np.arange(devices), silent), count, replace=False)
+    # Fast drain: one more heartbeat a full window later with ten times the usual drop
+    later = last[draining] + engine.drain_window * 1.5
+    spiked = 100 - drains[draining] * (later - start) / 3600 - drains[draining] * 10 * (later - last[draining]) / 3600
+    engine.observe_many(slots[draining], later, spiked.astype(np.float32))
+    # "Now" is shortly after every device's next expected heartbeat, except the silent ones
+    now = float(np.max(last) + 1)
+    engine.last_seen[slots] = np.maximum(engine.last_seen[slots], now - periods * 0.5)
+    engine.last_seen[slots[silent]] = now - periods[silent] * 10
+    return convert_times, fold_times, now, silent, draining
+
+def main():
+    parser = argparse.ArgumentParser(description="Time vectorized anomaly scoring over a simulated fleet")
+    parser.add_argument("--devices", type=int, default=1_000_000, help="Simulated devices")
+    parser.add_argument("--heartbeats", type=int, default=20, help="Heartbeats of history per device")
+    parser.add_argument("--passes", type=int, default=10, help="Timed scoring passes")
+    parser.add_argument("--anomalous", type=float, default=0.01, help="Fraction of devices made anomalous per signal")
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="Fail if converting, folding and scoring a round takes longer (seconds, medians)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    engine = AnomalyEngine(capacity=args.devices)
+    print(f"🧮 Building statistics for {args.devices:,} devices ({args.heartbeats} heartbeats each)...")
+    convert_times, fold_times, now, silent, draining = simulate(
+        engine, args.devices, args.heartbeats, rng, args.anomalous
+    )
+    convert, fold = statistics.median(convert_times), statistics.median(fold_times)
+    print(f"   Converting {args.devices:,} queued heartbeats to arrays: median {convert * 1000:.1f} ms")
+    print(f"   Folding {args.devices:,} heartbeats: median {fold * 1000:.1f} ms")
+
+    pass_times = []
+    for _ in range(args.passes):
+        began = time.perf_counter()
+        anomalous = engine.score_all(now)
+        pass_times.append(time.perf_counter() - began)
+    median = statistics.median(pass_times)
+    total = convert + fold + median
+
+    flagged = set(np.flatnonzero(engine.scores[:engine.size] >= engine.threshold).tolist())
+    injected = set(silent.tolist()) | set(draining.tolist())
+    found = len(flagged & injected)
+    print(f"⏱️  Scoring pass over {args.devices:,} devices: "
+          f"median {median * 1000:.1f} ms, min {min(pass_times) * 1000:.1f} ms, max {max(pass_times) * 1000:.1f} ms")
+    print(f"🔎 Flagged {anomalous:,} devices: {found:,} of {len(injected):,} injected anomalies, "
+          f"{len(flagged - injected):,} others")
+    print(f"⏱️  Round of {args.devices:,} heartbeats (convert + fold + score): {total * 1000:.1f} ms")
+    print(f"💾 Statistics arrays: {sum(getattr(engine, name).nbytes for name in engine.ARRAYS) / 2**20:.0f} MiB")
+
+    if total > args.budget:
+        print(f"❌ A round takes {total:.3f}s, over the {args.budget}s budget")
+        return 1
+    print(f"✅ Within the {args.budget}s budget")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
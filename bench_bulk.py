@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Bulk Provisioning Benchmark
+Uploads a generated provisioning file to POST /devices/import, printing the
+progress lines as they arrive, then streams GET /devices/export in each
+format. Exits non-zero if the import takes longer than --budget seconds.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import aiohttp
+
+def provisioning_csv(devices, prefix):
+    lines = ["device_id,name,location,expected_interval"]
+    lines += [f"{prefix}-{i:07d},Provisioned Sensor {i},Site {i % 200},{30 * (1 + i % 10)}" for i in range(devices)]
+    return ("\n".join(lines) + "\n").encode()
+
+async def run_import(session, url, body):
+    """Upload and echo progress; returns (seconds, final progress line)"""
+    started = time.perf_counter()
+    final = None
+    async with session.post(f"{url}/devices/import", data=body, headers={"Content-Type": "text/csv"}) as response:
+        if response.status != 200:
+            raise RuntimeError(f"Import failed with {response.status}: {await response.text()}")
+        async for line in response.content:
+            final = json.loads(line)
+            print(f"   {final}")
+    return time.perf_counter() - started, final
+
+async def run_export(session, url, format):
+    """Stream an export to nowhere; returns (seconds, bytes)"""
+    started = time.perf_counter()
+    size = 0
+    async with session.get(f"{url}/devices/export", params={"format": format}) as response:
+        if response.status != 200:
+            raise RuntimeError(f"{format} export failed with {response.status}: {await response.text()}")
+        async for chunk in response.content.iter_chunked(1 << 16):
+            size += len(chunk)
+    return time.perf_counter() - started, size
+
+async def main():
+    parser = argparse.ArgumentParser(description="Time bulk device import and export")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the service")
+    parser.add_argument("--devices", type=int, default=500_000, help="Devices in the provisioning file")
+    parser.add_argument("--prefix", default="provisioned", help="device_id prefix of the generated devices")
+    parser.add_argument("--formats", default="csv,ndjson,parquet", help="Export formats to time")
+    parser.add_argument("--budget", type=float, default=60.0, help="Fail if the import takes longer (seconds)")
+    args = parser.parse_args()
+
+    body = provisioning_csv(args.devices, args.prefix)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=600)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        print(f"📦 Importing {args.devices:,} devices ({len(body) / 2**20:.1f} MiB of CSV)...")
+        seconds, final = await run_import(session, args.url, body)
+        if final is None or final.get("stage") != "done":
+            print(f"❌ Import did not finish: {final}")
+            return 1
+        print(f"⏱️  Import: {seconds:.2f}s ({final['rows'] / seconds:,.0f} rows/s), "
+              f"{final['created']:,} created, {final['updated']:,} updated, {final['rejected']:,} rejected")
+
+        for format in filter(None, args.formats.split(",")):
+            export_seconds, size = await run_export(session, args.url, format)
+            print(f"⏱️  Export {format}: {export_seconds:.2f}s, {size / 2**20:.1f} MiB")
+
+    if seconds > args.budget:
+        print(f"❌ Import took {seconds:.2f}s, over the {args.budget}s budget")
+        return 1
+    print(f"✅ Import within the {args.budget}s budget")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
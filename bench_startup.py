@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Cold Start Benchmark
+Starts the app with Uvicorn against DATABASE_URL (after `alembic upgrade head`)
+and measures how long until /livez and /readyz answer. Optionally fills the
+devices table first so the seeding cost at startup is included. Exits non-zero
+if the service is not ready within --budget seconds.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.models import Device
+
+def fill_devices(count, bind=engine):
+    """Insert simulated devices until the table holds at least ``count``"""
+    db = Session(bind)
+    try:
+        existing = db.scalar(select(func.count()).select_from(Device))
+        now = datetime.utcnow()
+        for start in range(existing, count, 10_000):
+            db.execute(insert(Device), [
+                {
+                    "device_id": f"startup-{i:07d}", "name": f"Startup Sensor {i}", "status": "online",
+                    "last_seen": now - timedelta(seconds=i % 600), "battery_level": float(i % 100),
+                    "signal_strength": -50.0 - i % 40, "location": f"Site {i % 50}",
+                }
+                for i in range(start, min(start + 10_000, count))
+            ])
+            db.commit()
+        return max(existing, count)
+    finally:
+        db.close()
+
+def wait_for(url, deadline, process):
+    """Seconds until ``url`` returns 200, or None if the deadline passes or the server exits"""
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.monotonic()
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(0.01)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time from process start to live and ready")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--devices", type=int, default=0, help="Fill the devices table to at least this many rows first")
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts to time")
+    parser.add_argument("--budget", type=float, default=10.0, help="Fail if any start takes longer to be ready (seconds)")
+    args = parser.parse_args()
+
+    if args.devices:
+        print(f"🗄️  Filling the devices table to {args.devices:,} rows...")
+        print(f"   {fill_devices(args.devices):,} devices stored")
+
+    base = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, UDP_ENABLED="false")
+    worst = 0.0
+    for run in range(1, args.runs + 1):
+        started = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL
+        )
+        try:
+            deadline = started + args.budget * 3
+            live = wait_for(f"{base}/livez", deadline, process)
+            ready = wait_for(f"{base}/readyz", deadline, process) if live else None
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        if ready is None:
+            print(f"❌ Run {run}: not ready within {args.budget * 3:.0f}s")
+            return 1
+        worst = max(worst, ready - started)
+        print(f"⏱️  Run {run}: live after {live - started:.2f}s, ready after {ready - started:.2f}s")
+
+    if worst > args.budget:
+        print(f"❌ Slowest start {worst:.2f}s exceeds the {args.budget}s budget")
+        return 1
+    print(f"✅ Every start ready within the {args.budget}s budget (slowest {worst:.2f}s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Storage Backend Conformance and Benchmark
+Starts the app once per storage backend (PostgreSQL, an embedded SQLite file
+and in-memory SQLite), checks that each one gives the same answers to the
+same API calls, then runs identical ingestion and query workloads against it
+and prints throughput and latency side by side. Exits non-zero if any backend
+fails a conformance check.
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+
+from test_devices import percentile
+
+class ConformanceError(Exception):
+    """A backend answered differently from what the API promises"""
+
+def expect(condition, message):
+    if not condition:
+        raise ConformanceError(message)
+
+async def eventually(check, timeout=15.0):
+    """Retry ``check()`` until it stops raising ConformanceError (write-behind and snapshots lag a little)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await check()
+        except ConformanceError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.25)
+
+async def get_json(session, url, **params):
+    async with session.get(url, params=params) as response:
+        return response.status, (await response.json() if response.status < 300 else None)
+
+async def list_all(session, base, **params):
+    """Every device of a paginated listing"""
+    devices, cursor = [], None
+    while True:
+        page_params = dict(params, limit=20, **({"cursor": cursor} if cursor else {}))
+        status, page = await get_json(session, f"{base}/devices", **page_params)
+        expect(status == 200, f"GET /devices returned {status}")
+        devices += page["devices"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return devices
+
+async def conformance(session, base, prefix):
+    """Run the shared API checks against one backend; returns the number of checks passed"""
+    location = f"{prefix}-site"
+    passed = 0
+
+    # Single heartbeat: 200 (direct write) or 202 (write-behind), then readable
+    single = f"{prefix}-single"
+    async with session.post(f"{base}/heartbeat", json={
+        "device_id": single, "battery_level": 50.0, "signal_strength": -60.0, "location": location
+    }) as response:
+        expect(response.status in (200, 202), f"POST /heartbeat returned {response.status}")
+
+    async def single_stored():
+        status, device = await get_json(session, f"{base}/devices/{single}")
+        expect(status == 200, f"GET /devices/{single} returned {status}")
+        expect(device["battery_level"] == 50.0 and device["status"] == "online", f"unexpected device {device}")
+        expect(device["location"] == location, f"location not stored: {device}")
+    await eventually(single_stored)
+    passed += 1
+
+    # Batch: later values win within a batch, low battery is at-risk
+    batch = [
+        {"device_id": f"{prefix}-b{i:03d}", "battery_level": float(i * 2), "signal_strength": -70.0,
+         "location": location}
+        for i in range(50)
+    ]
+    batch.append({"device_id": f"{prefix}-b000", "battery_level": 95.0})
+    async with session.post(f"{base}/heartbeats", json=batch) as response:
+        expect(response.status in (200, 202), f"POST /heartbeats returned {response.status}")
+        body = await response.json()
+        expect(body["received"] == 51, f"batch received {body['received']}, expected 51")
+        if response.status == 200:
+            expect(body["accepted"] == 50, f"batch accepted {body['accepted']}, expected 50 devices")
+            expect(all(result["created"] for result in body["results"]), "new devices not reported as created")
+    passed += 1
+
+    async with session.post(f"{base}/heartbeats", json=batch[1:11]) as response:
+        body = await response.json()
+        if response.status == 200:
+            expect(not any(result["created"] for result in body["results"]), "existing devices reported as created")
+    passed += 1
+
+    async def listing_complete():
+        devices = await list_all(session, base, location=location)
+        ids = [device["device_id"] for device in devices]
+        expect(len(ids) == 51 and len(set(ids)) == 51, f"listing has {len(ids)} devices, expected 51")
+        expect(ids == sorted(ids), "listing is not ordered by device_id")
+        first = next(device for device in devices if device["device_id"] == f"{prefix}-b000")
+        expect(first["battery_level"] == 95.0, f"later batch value did not win: {first}")
+        at_risk = [device for device in devices if device["status"] == "at-risk"]
+        expect(len(at_risk) == 9, f"{len(at_risk)} at-risk devices, expected 9")
+    await eventually(listing_complete)
+    passed += 1
+
+    status, page = await get_json(session, f"{base}/devices", location=location, battery_below=10, order="last_seen")
+    expect(status == 200 and page["count"] == 4, f"battery_below listing returned {page and page['count']}, expected 4")
+    passed += 1
+
+    # Import: CSV upload creates new devices and updates existing ones
+    upload = io.StringIO()
+    writer = csv.writer(upload)
+    writer.writerow(["device_id", "name", "location", "expected_interval"])
+    writer.writerows([f"{prefix}-imp{i:03d}", f"Imported {i}", location, 60] for i in range(20))
+    writer.writerow([f"{prefix}-b001", "Renamed", "", ""])
+    writer.writerow(["", "no id", "", ""])
+    async with session.post(f"{base}/devices/import", data=upload.getvalue().encode(),
+                            headers={"Content-Type": "text/csv"}) as response:
+        expect(response.status == 200, f"POST /devices/import returned {response.status}")
+        final = json.loads((await response.text()).strip().splitlines()[-1])
+    expect(final["stage"] == "done", f"import did not finish: {final}")
+    expect((final["created"], final["updated"], final["rejected"]) == (20, 1, 1), f"import totals {final}")
+    status, device = await get_json(session, f"{base}/devices/{prefix}-b001")
+    expect(device["name"] == "Renamed" and device["battery_level"] == 2.0, f"import overwrote heartbeat state: {device}")
+    passed += 1
+
+    # Export: every device at the location, once
+    async with session.get(f"{base}/devices/export", params={"format": "ndjson", "location": location}) as response:
+        expect(response.status == 200, f"GET /devices/export returned {response.status}")
+        exported = [json.loads(line) for line in (await response.text()).splitlines() if line]
+    expect(len(exported) == 71, f"export returned {len(exported)} devices, expected 71")
+    passed += 1
+
+    async def history_recorded():
+        status, history = await get_json(session, f"{base}/devices/{single}/history", bucket_seconds=3600)
+        expect(status == 200, f"history returned {status}")
+        expect(sum(bucket["count"] for bucket in history["buckets"]) >= 1, "heartbeat missing from history")
+    await eventually(history_recorded)
+    passed += 1
+
+    status, counts = await get_json(session, f"{base}/devices/counts")
+    expect(status == 200 and counts["at_risk_count"] >= 9, f"counts {counts}")
+    async with session.get(f"{base}/devices/counts") as response:
+        etag = response.headers.get("ETag")
+    async with session.get(f"{base}/devices/counts", headers={"If-None-Match": etag or ""}) as response:
+        expect(response.status in (200, 304), f"conditional GET returned {response.status}")
+    passed += 1
+
+    status, summary = await get_json(session, f"{base}/fleet/summary")
+    expect(status == 200 and "status_counts" in summary, f"fleet summary returned {status}")
+    passed += 1
+
+    async with session.delete(f"{base}/devices/{single}") as response:
+        expect(response.status == 200, f"DELETE returned {response.status}")
+    status, _ = await get_json(session, f"{base}/devices/{single}")
+    expect(status == 404, f"deleted device returned {status}")
+    passed += 1
+    return passed
+
+async def timed(session, requests, concurrency):
+    """Issue (method, url, kwargs) requests; returns (seconds, latencies in ms, errors)"""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(method, url, kwargs):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.request(method, url, **kwargs) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*request) for request in requests))
+    return time.perf_counter() - started, latencies, errors
+
+def workloads(base, prefix, devices, rounds, batch_size):
+    """Named request lists, the same for every backend"""
+    ids = [f"{prefix}-w{i:05d}" for i in range(devices)]
+    location = f"{prefix}-load"
+    beats = [
+        {"device_id": device_id, "battery_level": float(50 + (n + i) % 50), "signal_strength": -65.0,
+         "location": location}
+        for n in range(rounds) for i, device_id in enumerate(ids)
+    ]
+    return [
+        ("ingest batch", [
+            ("POST", f"{base}/heartbeats", {"json": beats[start:start + batch_size]})
+            for start in range(0, len(beats), batch_size)
+        ], len(beats)),
+        ("ingest single", [
+            ("POST", f"{base}/heartbeat", {"json": beat}) for beat in beats[:devices]
+        ], devices),
+        ("get device", [("GET", f"{base}/devices/{device_id}", {}) for device_id in ids], devices),
+        ("list page", [
+            ("GET", f"{base}/devices", {"params": {"location": location, "limit": 100, "battery_below": 50 + n % 50}})
+            for n in range(devices // 4)
+        ], devices // 4),
+        ("history", [
+            ("GET", f"{base}/devices/{device_id}/history", {"params": {"bucket_seconds": 60}})
+            for device_id in ids[:devices // 4]
+        ], devices // 4),
+    ]
+
+async def device_readable(session, url):
+    status, _ = await get_json(session, url)
+    expect(status == 200, f"{url} returned {status}")
+
+def start_server(database_url, port):
+    env = dict(
+        os.environ, DATABASE_URL=database_url, UDP_ENABLED="false",
+        # Measure storage, not the per-device rate limit in front of it
+        ADMISSION_ENABLED="false",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL
+    )
+
+async def wait_ready(session, base, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            async with session.get(f"{base}/readyz") as response:
+                if response.status == 200:
+                    return True
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    return False
+
+async def run_backend(name, database_url, args):
+    """Conformance checks and workloads for one backend; returns (passed, error, results)"""
+    if database_url.startswith("sqlite:///") and not database_url.endswith(":memory:"):
+        subprocess.run(
+            [sys.executable, "-m", "alembic", "upgrade", "head"],
+            env=dict(os.environ, DATABASE_URL=database_url), check=True, capture_output=True
+        )
+    base = f"http://127.0.0.1:{args.port}"
+    prefix = f"conf-{uuid.uuid4().hex[:8]}"
+    process = start_server(database_url, args.port)
+    results = []
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=120)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            if not await wait_ready(session, base, process, args.startup_timeout):
+                return 0, "not ready", results
+            try:
+                passed = await conformance(session, base, prefix)
+            except ConformanceError as e:
+                return 0, str(e), results
+            for workload, requests, heartbeats in workloads(base, prefix, args.devices, args.rounds, args.batch_size):
+                if workload == "get device":
+                    # Write-behind backends acknowledge before the rows are readable
+                    await eventually(lambda: device_readable(session, f"{base}/devices/{prefix}-w{args.devices - 1:05d}"))
+                seconds, latencies, errors = await timed(session, requests, args.concurrency)
+                latencies.sort()
+                results.append({
+                    "backend": name, "workload": workload, "requests": len(requests), "items": heartbeats,
+                    "seconds": round(seconds, 3), "items_per_second": round(heartbeats / seconds, 1),
+                    "p50_ms": round(percentile(latencies, 50), 2),
+                    "p99_ms": round(percentile(latencies, 99), 2), "errors": errors,
+                })
+            return passed, None, results
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Check and compare the storage backends on the same workloads")
+    parser.add_argument("--backends", default="postgresql,sqlite,memory", help="Backends to run, in order")
+    parser.add_argument("--postgres-url", default=os.getenv("DATABASE_URL", ""),
+                        help="Migrated PostgreSQL database (default: $DATABASE_URL); skipped when empty")
+    parser.add_argument("--sqlite-path", default=None, help="SQLite file to use (default: a new temporary file)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--devices", type=int, default=2000, help="Devices in the workloads")
+    parser.add_argument("--rounds", type=int, default=5, help="Heartbeats per device in the batch workload")
+    parser.add_argument("--batch-size", type=int, default=500, help="Heartbeats per POST /heartbeats")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--report", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    tempdir = tempfile.TemporaryDirectory()
+    urls = {
+        "postgresql": args.postgres_url if args.postgres_url.startswith("postgresql") else None,
+        "sqlite": f"sqlite:///{args.sqlite_path or os.path.join(tempdir.name, 'iot.db')}",
+        "memory": "sqlite://",
+    }
+    failures, results = 0, []
+    for name in filter(None, args.backends.split(",")):
+        if urls.get(name) is None:
+            print(f"⏭️  {name}: no database URL, skipped")
+            continue
+        print(f"🧪 {name}: conformance checks and workloads...")
+        passed, error, backend_results = await run_backend(name, urls[name], args)
+        if error:
+            failures += 1
+            print(f"❌ {name}: {error}")
+        else:
+            print(f"✅ {name}: {passed} conformance checks passed")
+        results += backend_results
+
+    if results:
+        print(f"\n{'backend':<11} {'workload':<14} {'items/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for result in results:
+            print(f"{result['backend']:<11} {result['workload']:<14} {result['items_per_second']:>10,.0f} "
+                  f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>7}")
+    if args.report:
+        with open(args.report, "w") as report:
+            json.dump(results, report, indent=2)
+    tempdir.cleanup()
+    return 1 if failures or any(result["errors"] for result in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
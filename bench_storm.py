@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Heartbeat Storm Benchmark
+Replays a burst of --burst heartbeats from each of --devices devices as fast
+as --concurrency allows (a firmware retry loop or a reconnect storm), then
+reports the response mix and, on PostgreSQL, the row updates and dead tuples
+the burst left on the devices table. Exits non-zero on 5xx responses or when
+more than --max-update-ratio row updates were made per heartbeat sent.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+from sqlalchemy import create_engine, text
+
+TABLE_STATS = text(
+    "SELECT n_tup_upd, n_tup_hot_upd, n_dead_tup FROM pg_stat_user_tables WHERE relname = 'devices'"
+)
+
+def table_stats(engine):
+    """(updates, HOT updates, dead tuples) on devices, or None off PostgreSQL"""
+    if engine is None:
+        return None
+    with engine.connect() as conn:
+        return tuple(conn.execute(TABLE_STATS).one())
+
+async def storm(url, device_ids, burst, concurrency):
+    """Send every heartbeat; returns (status code counts, coalesced acks, retry hints, seconds)"""
+    beats = [device_id for _ in range(burst) for device_id in device_ids]
+    codes, retry_hints = Counter(), []
+    coalesced = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(session, device_id):
+        nonlocal coalesced
+        payload = {"device_id": device_id, "battery_level": round(random.uniform(20, 100), 1)}
+        async with semaphore:
+            try:
+                async with session.post(f"{url}/heartbeat", json=payload) as response:
+                    codes[response.status] += 1
+                    if response.status == 202 and (await response.json()).get("coalesced"):
+                        coalesced += 1
+                    elif response.status == 429:
+                        retry_hints.append(float((await response.json())["retry_after"]))
+            except aiohttp.ClientError:
+                codes["error"] += 1
+
+    started = time.perf_counter()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(send(session, device_id) for device_id in beats))
+    return codes, coalesced, retry_hints, time.perf_counter() - started
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure what a heartbeat burst costs the devices table")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the service")
+    parser.add_argument("--devices", type=int, default=200, help="Devices taking part in the storm")
+    parser.add_argument("--burst", type=int, default=100, help="Heartbeats sent by each device")
+    parser.add_argument("--concurrency", type=int, default=200, help="Requests in flight")
+    parser.add_argument("--prefix", default="storm", help="device_id prefix of the storming devices")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="PostgreSQL URL for devices table statistics (default: $DATABASE_URL)")
+    parser.add_argument("--settle", type=float, default=3.0,
+                        help="Seconds to wait for last_seen bumps and statistics after the burst")
+    parser.add_argument("--max-update-ratio", type=float, default=0.2,
+                        help="Fail above this many devices row updates per heartbeat sent")
+    args = parser.parse_args()
+
+    engine = None
+    if args.database_url and args.database_url.startswith("postgresql"):
+        engine = create_engine(args.database_url)
+    device_ids = [f"{args.prefix}-{i:05d}" for i in range(args.devices)]
+    before = table_stats(engine)
+
+    sent = args.devices * args.burst
+    print(f"🌩️  {args.devices} devices x {args.burst} heartbeats = {sent:,} requests ({args.concurrency} in flight)...")
+    codes, coalesced, retry_hints, seconds = await storm(args.url, device_ids, args.burst, args.concurrency)
+    print(f"⏱️  {seconds:.2f}s ({sent / seconds:,.0f} req/s)")
+    for code, count in sorted(codes.items(), key=str):
+        print(f"   {code}: {count:,}")
+    print(f"   coalesced acks: {coalesced:,}")
+    if retry_hints:
+        print(f"   429 retry hints: {min(retry_hints):.2f}s - {max(retry_hints):.2f}s")
+
+    failed = sum(count for code, count in codes.items() if code == "error" or code >= 500)
+    if failed:
+        print(f"❌ {failed} requests failed")
+    if before is None:
+        print("ℹ️  No PostgreSQL --database-url; skipping devices table statistics")
+        return 1 if failed else 0
+
+    await asyncio.sleep(args.settle)
+    after = table_stats(engine)
+    updates, hot_updates, dead = (a - b for a, b in zip(after, before))
+    ratio = updates / sent
+    print(f"🗄️  devices: {updates:,} row updates ({hot_updates:,} HOT), dead tuples {after[2]:,} ({dead:+,}), "
+          f"{ratio:.3f} updates per heartbeat")
+    if ratio > args.max_update_ratio:
+        print(f"❌ Over the {args.max_update_ratio} updates per heartbeat budget")
+        return 1
+    print(f"✅ Within the {args.max_update_ratio} updates per heartbeat budget")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check
+EXPLAINs the API's hot queries against DATABASE_URL (after `alembic upgrade head`)
+and fails if any of them has to read a whole table or a whole index instead of
+looking rows up through an index.
+
+The check first adds a synthetic fleet of --devices devices (and their recent
+history) and ANALYZEs it, all in one transaction that is rolled back, so the
+planner runs with its default settings on realistic table sizes. A plan fails
+on a sequential scan, or on an index scan with no index condition (PostgreSQL)
+or an index SCAN rather than SEARCH (SQLite): both walk the entire index and
+filter rows as they go. The one exception is an ordered walk under LIMIT in a
+query with no WHERE clause, which reads only the rows it returns.
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, text, update
+from sqlalchemy.sql import Select
+
+from app.database import engine
+from app.models import Device, HeartbeatEvent
+from app.crud import device_page_query, recent_activity_query, encode_cursor
+from app.fleet import top_devices_query, TOP_DEVICE_LISTS
+from app.history import history_query, create_partitions
+from app.cluster import changed_devices_query
+
+# Tables that must never be read in full by a hot query
+CHECKED_TABLES = ("devices", "heartbeat_events", "status_transitions")
+
+SEED_LOCATIONS = 200
+SEED_HISTORY_DEVICES = 1000
+SEED_HISTORY_EVENTS = 100
+
+def seed(conn, devices: int, now: datetime):
+    """Add a synthetic fleet and its recent history, then refresh planner statistics (not committed)"""
+    rng = random.Random(42)
+    rows = []
+    for i in range(devices):
+        roll = rng.random()
+        if roll < 0.02:
+            last_seen = None                                                # provisioned, never seen
+        elif roll < 0.10:
+            last_seen = now - timedelta(hours=rng.uniform(1, 72))           # offline
+        else:
+            last_seen = now - timedelta(seconds=rng.uniform(0, 120))
+        rows.append({
+            "device_id": f"plan-{i:07d}",
+            "name": f"Plan device {i}",
+            "status": "offline",
+            "last_seen": last_seen,
+            "battery_level": None if rng.random() < 0.05 else round(rng.uniform(0, 100), 1),
+            "signal_strength": round(rng.uniform(-100, -30), 1),
+            "location": f"Site {rng.randrange(SEED_LOCATIONS)}",
+            "created_at": now,
+            "updated_at": now,
+        })
+    conn.execute(insert(Device), rows)
+
+    # History lands in today's partition, so it starts no earlier than midnight
+    create_partitions(conn, now, days_ahead=0)
+    since = max(now - timedelta(hours=24), datetime.combine(now.date(), datetime.min.time()))
+    span = (now - since).total_seconds()
+    conn.execute(insert(HeartbeatEvent), [
+        {
+            "device_id": f"plan-{i:07d}",
+            "recorded_at": since + timedelta(seconds=span * k / SEED_HISTORY_EVENTS),
+            "battery_level": 100 - k * 0.1,
+            "signal_strength": -60.0,
+        }
+        for i in range(min(devices, SEED_HISTORY_DEVICES)) for k in range(SEED_HISTORY_EVENTS)
+    ])
+    conn.execute(text("ANALYZE"))
+
+def unfiltered_limit(statement):
+    """Whether ``statement`` is a LIMIT query without WHERE (an ordered index walk reads only what it returns)"""
+    return isinstance(statement, Select) and statement.whereclause is None and statement._limit_clause is not None
+
+def hot_queries(now: datetime):
+    """(name, statement) for every query on a request or sync path"""
+    queries = [
+        ("device by device_id", select(Device).where(Device.device_id == "sensor-001")),
+        ("heartbeat update", update(Device).where(Device.device_id == "sensor-001").values(last_seen=now)),
+        ("recent activity count", recent_activity_query(now)),
+        ("device page", device_page_query(now=now)),
+        ("device page after cursor", device_page_query(cursor=encode_cursor("sensor-500", 500), now=now)),
+        ("device page by -last_seen", device_page_query(order="-last_seen", now=now)),
+        ("devices in location", device_page_query(location="Warehouse", now=now)),
+        ("devices below battery", device_page_query(battery_below=10, now=now)),
+        ("worker sync poll", changed_devices_query(now - timedelta(seconds=3))),
+        ("device history", history_query("sensor-001", now - timedelta(hours=24), now, 3600)),
+    ]
+    for status in ("online", "at-risk", "offline"):
+        queries.append((f"{status} devices", device_page_query(status=status, order="-last_seen", now=now)))
+    for name, (order_by, where) in TOP_DEVICE_LISTS.items():
+        queries.append((f"fleet {name}", top_devices_query(order_by, 10, where)))
+    return queries
+
+def explain(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = "EXPLAIN (FORMAT JSON) " if conn.dialect.name == "postgresql" else "EXPLAIN QUERY PLAN "
+    return conn.exec_driver_sql(prefix + str(compiled), params).all()
+
+def postgresql_scans(rows):
+    """(relation, scan, index) for every scan in a PostgreSQL JSON plan
+
+    Index scans without an Index Cond (an unbounded walk of the whole index)
+    are reported as "Full Index Scan".
+    """
+    plan = rows[0][0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans, nodes = [], [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Relation Name" in node:
+            scan = node["Node Type"]
+            if scan in ("Index Scan", "Index Only Scan") and "Index Cond" not in node:
+                scan = "Full Index Scan"
+            index = node.get("Index Name")
+            if scan == "Bitmap Heap Scan":
+                index = bitmap_indexes(node)
+            scans.append((node["Relation Name"], scan, index))
+        nodes.extend(node.get("Plans", []))
+    return scans
+
+def bitmap_indexes(node):
+    """Indexes feeding a Bitmap Heap Scan, through any BitmapAnd/BitmapOr nodes"""
+    names, nodes = [], list(node.get("Plans", []))
+    while nodes:
+        child = nodes.pop()
+        if "Index Name" in child:
+            names.append(child["Index Name"])
+        nodes.extend(child.get("Plans", []))
+    return "+".join(sorted(names)) or None
+
+SQLITE_SCAN = re.compile(r"^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: USING (?:COVERING )?(?:INDEX (\w+)|INTEGER PRIMARY KEY))?")
+
+def sqlite_scans(rows):
+    scans = []
+    for row in rows:
+        match = SQLITE_SCAN.match(row[-1])
+        if match:
+            verb, table, index = match.groups()
+            if verb == "SEARCH":
+                scan = "Index Search"
+            else:
+                scan = "Full Index Scan" if "USING" in row[-1] else "Seq Scan"
+            scans.append((table, scan, index))
+    return scans
+
+def plan_scans(conn, statement):
+    """(relation, scan, index) for every table access in the plan of ``statement``"""
+    rows = explain(conn, statement)
+    return postgresql_scans(rows) if conn.dialect.name == "postgresql" else sqlite_scans(rows)
+
+def full_scans(scans, statement):
+    allowed = ("Full Index Scan",) if unfiltered_limit(statement) else ()
+    return [
+        (relation, node) for relation, node, _ in scans
+        if node in ("Seq Scan", "Full Index Scan") and node not in allowed and relation.startswith(CHECKED_TABLES)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the hot queries use index scans")
+    parser.add_argument("--verbose", action="store_true", help="Print every scan in each plan")
+    parser.add_argument("--devices", type=int, default=100_000,
+                        help="Synthetic devices added (and rolled back) so plans reflect a real fleet")
+    args = parser.parse_args()
+
+    failures = checked = 0
+    now = datetime.utcnow()
+    with engine.connect() as conn:
+        print(f"🌱 Adding {args.devices:,} synthetic devices for realistic statistics (rolled back afterwards)...")
+        seed(conn, args.devices, now)
+        for name, statement in hot_queries(now):
+            checked += 1
+            scans = plan_scans(conn, statement)
+            bad = full_scans(scans, statement)
+            indexes = sorted({index for _, _, index in scans if index})
+            if bad:
+                failures += 1
+                print(f"❌ {name}: {', '.join(f'{node} on {relation}' for relation, node in bad)}")
+            else:
+                print(f"✅ {name}: {', '.join(indexes) or 'no table access'}")
+            if args.verbose:
+                for relation, node, index in scans:
+                    print(f"     {node} on {relation}" + (f" using {index}" if index else ""))
+        conn.rollback()
+
+    if failures:
+        print(f"\n❌ {failures} of {checked} hot queries scan a whole table")
+    else:
+        print(f"\n✅ All {checked} hot queries look rows up through an index")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""
+Gunicorn settings for running several Uvicorn workers behind one port.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The master prepares the database once before forking, so workers do not
+race on wait_for_db or partition maintenance, and Prometheus metrics are collected in
+multiprocess mode so /metrics reports the same totals from any worker.
+"""
+
+import multiprocessing
+import os
+import shutil
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Workers inherit these before importing the app
+os.environ["WEB_CONCURRENCY"] = str(workers)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/iot-prometheus")
+
+def on_starting(server):
+    """Runs once in the master before any worker starts"""
+    # Samples left over from a previous run would be merged into this one
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+    from app import cluster
+    from app.database import engine, async_engine
+
+    if cluster.prepare_database():
+        # Workers are forked from this process, so they inherit the already-imported module
+        cluster.DB_PREPARED = True
+    # Never hand pooled connections to forked workers
+    engine.dispose()
+    async_engine.sync_engine.dispose()
+    server.log.info(f"Starting {workers} workers")
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges from the merged metrics"""
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
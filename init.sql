@@ -7,11 +7,8 @@
 -- Create extensions if needed
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
--- The actual tables will be created by SQLAlchemy when the app starts
--- This file can be used for any additional database setup if needed
-
--- Create some indexes for better performance
--- (These will be created by SQLAlchemy, but we can add custom ones here if needed)
+-- Tables and indexes are created by the Alembic migrations in migrations/
+-- (`alembic upgrade head`, run by the app container before it starts)
 
 -- Grant permissions
 GRANT ALL PRIVILEGES ON DATABASE iot_heartbeat TO iot_user;
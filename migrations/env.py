@@ -0,0 +1,42 @@
+"""Alembic environment: migrates the database the app is configured for (DATABASE_URL)"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from app.database import engine, DATABASE_URL, Base
+from app.cluster import advisory_lock, SCHEMA_LOCK_KEY
+from app import models  # noqa: F401  (registers the tables on Base.metadata)
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    """Emit the SQL to stdout (alembic upgrade head --sql)"""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    # One migrator at a time, whichever replica or worker got there first
+    with advisory_lock(SCHEMA_LOCK_KEY), engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            transaction_per_migration=True,
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
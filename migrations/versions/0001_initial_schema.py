@@ -0,0 +1,94 @@
+"""Initial schema: devices, heartbeat history, status transitions and the fleet summary
+
+Databases created by the app's old startup create_all() already have some
+or all of these tables, so each one (and each index) is only created when
+missing and such databases can be upgraded in place.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def missing(table):
+    return not sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if missing("devices"):
+        op.create_table(
+            "devices",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("device_id", sa.String, nullable=False),
+            sa.Column("name", sa.String, nullable=True),
+            sa.Column("status", sa.String, nullable=True),
+            sa.Column("last_seen", sa.DateTime, nullable=True),
+            sa.Column("battery_level", sa.Float, nullable=True),
+            sa.Column("signal_strength", sa.Float, nullable=True),
+            sa.Column("location", sa.String, nullable=True),
+            sa.Column("created_at", sa.DateTime, nullable=True),
+            sa.Column("updated_at", sa.DateTime, nullable=True),
+        )
+    op.create_index("ix_devices_device_id", "devices", ["device_id"], unique=True, if_not_exists=True)
+    op.create_index("ix_devices_battery_level", "devices", ["battery_level"], if_not_exists=True)
+    op.create_index("ix_devices_signal_strength", "devices", ["signal_strength"], if_not_exists=True)
+    op.create_index("ix_devices_last_seen_id", "devices", ["last_seen", "id"], if_not_exists=True)
+
+    if missing("heartbeat_events"):
+        op.create_table(
+            "heartbeat_events",
+            sa.Column("device_id", sa.String, primary_key=True),
+            sa.Column("recorded_at", sa.DateTime, primary_key=True),
+            sa.Column("battery_level", sa.Float, nullable=True),
+            sa.Column("signal_strength", sa.Float, nullable=True),
+            # Daily partitions are created and dropped at runtime (app/history.py)
+            postgresql_partition_by="RANGE (recorded_at)",
+        )
+
+    if missing("status_transitions"):
+        op.create_table(
+            "status_transitions",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("device_id", sa.String, nullable=False),
+            sa.Column("from_status", sa.String, nullable=False),
+            sa.Column("to_status", sa.String, nullable=False),
+            sa.Column("occurred_at", sa.DateTime, nullable=False),
+        )
+    op.create_index(
+        "ix_status_transitions_device_occurred", "status_transitions", ["device_id", "occurred_at"],
+        if_not_exists=True
+    )
+
+    if missing("fleet_location_summary"):
+        op.create_table(
+            "fleet_location_summary",
+            sa.Column("location", sa.String, primary_key=True),
+            sa.Column("total", sa.Integer, nullable=False),
+            sa.Column("online", sa.Integer, nullable=False),
+            sa.Column("at_risk", sa.Integer, nullable=False),
+            sa.Column("offline", sa.Integer, nullable=False),
+            sa.Column("battery_lt_20", sa.Integer, nullable=False),
+            sa.Column("battery_20_50", sa.Integer, nullable=False),
+            sa.Column("battery_50_80", sa.Integer, nullable=False),
+            sa.Column("battery_ge_80", sa.Integer, nullable=False),
+            sa.Column("battery_unknown", sa.Integer, nullable=False),
+            sa.Column("battery_avg", sa.Float, nullable=True),
+            sa.Column("battery_min", sa.Float, nullable=True),
+            sa.Column("signal_avg", sa.Float, nullable=True),
+            sa.Column("signal_min", sa.Float, nullable=True),
+            sa.Column("refreshed_at", sa.DateTime, nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table("fleet_location_summary")
+    op.drop_table("status_transitions")
+    op.drop_table("heartbeat_events")
+    op.drop_table("devices")
@@ -0,0 +1,63 @@
+"""Indexes fitted to the hot queries
+
+- ix_devices_location_device_id: location-filtered listings in device_id order
+- ix_devices_low_battery_last_seen: partial index over devices below the
+  low-battery threshold, for the battery branch of the at-risk filter (the
+  time branch already uses ix_devices_last_seen_id; a partial index cannot
+  encode a now()-relative cutoff)
+- BRIN on heartbeat_events.recorded_at and status_transitions.occurred_at:
+  both tables are append-only in time order, so a few pages cover them
+- drops ix_devices_id, which duplicated the primary key index and cost
+  every heartbeat UPDATE an extra index write
+
+No index on devices.status: every query filters on last_seen/battery_level
+ranges instead (Device.status_filter), and the column is rewritten by every
+heartbeat. The devices indexes are built CONCURRENTLY on PostgreSQL so the
+upgrade does not block ingestion.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+LOW_BATTERY = "battery_level < 20"
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_devices_id", table_name="devices", if_exists=True, postgresql_concurrently=postgresql)
+        op.create_index(
+            "ix_devices_location_device_id", "devices", ["location", "device_id"],
+            if_not_exists=True, postgresql_concurrently=postgresql
+        )
+        op.create_index(
+            "ix_devices_low_battery_last_seen", "devices", ["last_seen"],
+            postgresql_where=sa.text(LOW_BATTERY), sqlite_where=sa.text(LOW_BATTERY),
+            if_not_exists=True, postgresql_concurrently=postgresql
+        )
+    # heartbeat_events is partitioned, which rules out CONCURRENTLY; its partitions inherit the index
+    op.create_index(
+        "ix_heartbeat_events_recorded_at_brin", "heartbeat_events", ["recorded_at"],
+        postgresql_using="brin", if_not_exists=True
+    )
+    op.create_index(
+        "ix_status_transitions_occurred_at_brin", "status_transitions", ["occurred_at"],
+        postgresql_using="brin", if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_index("ix_status_transitions_occurred_at_brin", table_name="status_transitions")
+    op.drop_index("ix_heartbeat_events_recorded_at_brin", table_name="heartbeat_events")
+    op.drop_index("ix_devices_low_battery_last_seen", table_name="devices")
+    op.drop_index("ix_devices_location_device_id", table_name="devices")
+    op.create_index("ix_devices_id", "devices", ["id"])
@@ -0,0 +1,26 @@
+"""Provisioned heartbeat interval on devices
+
+devices.expected_interval holds the seconds between heartbeats a device was
+provisioned with (POST /devices/import). It is nullable, so adding it is a
+catalog-only change on PostgreSQL and does not rewrite the table.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("devices", sa.Column("expected_interval", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("devices") as batch_op:
+        batch_op.drop_column("expected_interval")
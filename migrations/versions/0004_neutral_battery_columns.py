@@ -0,0 +1,39 @@
+"""Neutral names for the fleet summary's battery histogram columns
+
+The columns were named after the bucket edges (battery_lt_20,
+battery_20_50, ...), which stop matching as soon as the edges move: the
+lowest edge is LOW_BATTERY_THRESHOLD. They become battery_low, battery_mid,
+battery_high and battery_full; app/fleet.py defines the edges.
+
+fleet_location_summary is a rollup rebuilt every FLEET_SUMMARY_INTERVAL,
+so renaming it in place is cheap on either backend.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+RENAMED = {
+    "battery_lt_20": "battery_low",
+    "battery_20_50": "battery_mid",
+    "battery_50_80": "battery_high",
+    "battery_ge_80": "battery_full",
+}
+
+
+def upgrade():
+    with op.batch_alter_table("fleet_location_summary") as batch_op:
+        for old, new in RENAMED.items():
+            batch_op.alter_column(old, new_column_name=new)
+
+
+def downgrade():
+    with op.batch_alter_table("fleet_location_summary") as batch_op:
+        for old, new in RENAMED.items():
+            batch_op.alter_column(new, new_column_name=old)
@@ -2,15 +2,18 @@
 """
 IoT Device Simulator
 Simulates multiple IoT devices sending heartbeats to the monitoring system.
+With --benchmark, runs an open-loop load test and writes a JSON latency report.
 """
 
 import asyncio
 import aiohttp
+import math
 import random
+import sys
 import time
 import json
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 class IoTDeviceSimulator:
     def __init__(self, base_url: str = "http://localhost:8000"):
@@ -126,6 +129,216 @@ class IoTDeviceSimulator:
             
             print("🏁 Simulation finished!")
 
+# Latency histogram bucket upper bounds (milliseconds) for benchmark reports
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list of samples"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, math.ceil(pct / 100 * len(samples)) - 1))
+    return samples[index]
+
+class EndpointStats:
+    """Latency samples and error counts for one benchmarked endpoint"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.status_codes: Dict[str, int] = {}
+
+    def record(self, latency: float, status: Optional[int]) -> None:
+        key = str(status) if status is not None else "error"
+        self.status_codes[key] = self.status_codes.get(key, 0) + 1
+        if status is None or status >= 400:
+            self.errors += 1
+        else:
+            self.latencies.append(latency)
+
+    def summary(self, duration: float, items_per_request: int = 1) -> Dict:
+        samples = sorted(self.latencies)
+        total = len(samples) + self.errors
+        histogram = {f"le_{bound}": 0 for bound in LATENCY_BUCKETS_MS}
+        histogram["le_inf"] = 0
+        for latency in samples:
+            ms = latency * 1000
+            for bound in LATENCY_BUCKETS_MS:
+                if ms <= bound:
+                    histogram[f"le_{bound}"] += 1
+                    break
+            else:
+                histogram["le_inf"] += 1
+        return {
+            "requests": total,
+            "errors": self.errors,
+            "error_rate": self.errors / total if total else 0.0,
+            "throughput_rps": len(samples) / duration,
+            "items_per_second": len(samples) * items_per_request / duration,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p90_ms": percentile(samples, 90) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "p999_ms": percentile(samples, 99.9) * 1000,
+            "max_ms": samples[-1] * 1000 if samples else 0.0,
+            "status_codes": self.status_codes,
+            "histogram_ms": histogram,
+        }
+
+class LoadGenerator:
+    """Open-loop load generator for capacity planning and release gating
+
+    Heartbeats for ``devices`` synthetic devices are sent at a fixed arrival
+    ``rate`` (constant or Poisson inter-arrival times) regardless of how fast
+    the server answers, and latency is measured from each request's scheduled
+    start so a slow server cannot hide queueing delay. ``skew`` > 1 makes a
+    minority of devices beat far more often than the rest. Reads of
+    /devices and /metrics run as separate open-loop streams at ``read_rate``.
+    """
+
+    def __init__(self, base_url: str = "http://localhost:8000", devices: int = 10000, rate: float = 500.0,
+                 arrival: str = "poisson", skew: float = 1.0, batch_size: int = 0, read_rate: float = 2.0,
+                 max_in_flight: int = 1000, seed: Optional[int] = None):
+        self.base_url = base_url
+        self.devices = devices
+        self.rate = rate
+        self.arrival = arrival
+        self.skew = skew
+        self.batch_size = batch_size
+        self.read_rate = read_rate
+        self.max_in_flight = max_in_flight
+        self.random = random.Random(seed)
+        self.stats: Dict[str, EndpointStats] = {}
+        self.in_flight = 0
+        self.client_dropped = 0
+
+    def pick_device(self) -> str:
+        # random() ** skew concentrates picks on low device numbers when skew > 1
+        return f"bench-{int(self.devices * self.random.random() ** self.skew):07d}"
+
+    def heartbeat(self) -> Dict:
+        return {
+            "device_id": self.pick_device(),
+            "battery_level": round(self.random.uniform(5.0, 100.0), 1),
+            "signal_strength": round(self.random.uniform(-95.0, -40.0), 1),
+        }
+
+    def next_interval(self, rate: float) -> float:
+        if self.arrival == "constant":
+            return 1.0 / rate
+        return self.random.expovariate(rate)
+
+    async def send(self, session: aiohttp.ClientSession, name: str, method: str, path: str,
+                   scheduled: float, body=None) -> None:
+        stats = self.stats.setdefault(name, EndpointStats())
+        self.in_flight += 1
+        status = None
+        try:
+            async with session.request(method, f"{self.base_url}{path}", json=body) as response:
+                await response.read()
+                status = response.status
+        except Exception:
+            pass
+        finally:
+            self.in_flight -= 1
+        stats.record(time.perf_counter() - scheduled, status)
+
+    async def stream(self, session: aiohttp.ClientSession, name: str, method: str, path: str,
+                     rate: float, deadline: float, make_body=None) -> None:
+        """Issue requests at ``rate`` per second until ``deadline``, never waiting for responses"""
+        tasks = set()
+        scheduled = time.perf_counter()
+        while True:
+            scheduled += self.next_interval(rate)
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.in_flight >= self.max_in_flight:
+                # The client itself is saturated; count it rather than silently slowing down
+                self.client_dropped += 1
+                continue
+            body = make_body() if make_body else None
+            task = asyncio.create_task(self.send(session, name, method, path, scheduled, body))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+    async def run(self, duration_seconds: int = 30) -> Dict:
+        mode = f"/heartbeats x{self.batch_size}" if self.batch_size else "/heartbeat"
+        print(f"🏎️  Load test against {self.base_url}: {self.devices} devices, {self.rate:g} req/s "
+              f"({self.arrival}) to {mode} for {duration_seconds}s")
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            start = time.perf_counter()
+            deadline = start + duration_seconds
+            if self.batch_size:
+                write = self.stream(
+                    session, "heartbeats", "POST", "/heartbeats", self.rate, deadline,
+                    lambda: [self.heartbeat() for _ in range(self.batch_size)]
+                )
+            else:
+                write = self.stream(session, "heartbeat", "POST", "/heartbeat", self.rate, deadline, self.heartbeat)
+            streams = [write]
+            if self.read_rate > 0:
+                streams.append(self.stream(session, "devices", "GET", "/devices?limit=100", self.read_rate, deadline))
+                streams.append(self.stream(session, "metrics", "GET", "/metrics", self.read_rate, deadline))
+            await asyncio.gather(*streams)
+            elapsed = time.perf_counter() - start
+
+        report = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "config": {
+                "base_url": self.base_url,
+                "devices": self.devices,
+                "rate": self.rate,
+                "arrival": self.arrival,
+                "skew": self.skew,
+                "batch_size": self.batch_size,
+                "read_rate": self.read_rate,
+                "duration_seconds": duration_seconds,
+            },
+            "client_dropped": self.client_dropped,
+            "endpoints": {
+                name: stats.summary(elapsed, self.batch_size if name == "heartbeats" else 1)
+                for name, stats in self.stats.items()
+            },
+        }
+        print_report(report)
+        return report
+
+def print_report(report: Dict) -> None:
+    print("-" * 96)
+    print(f"{'endpoint':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'items/s':>10}"
+          f"{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'max ms':>10}")
+    for name, summary in report["endpoints"].items():
+        print(
+            f"{name:<12}{summary['requests']:>10}{summary['errors']:>8}{summary['throughput_rps']:>10.1f}"
+            f"{summary['items_per_second']:>10.1f}{summary['p50_ms']:>10.1f}{summary['p99_ms']:>10.1f}"
+            f"{summary['p999_ms']:>10.1f}{summary['max_ms']:>10.1f}"
+        )
+    if report["client_dropped"]:
+        print(f"⚠️  {report['client_dropped']} requests not sent: client hit its in-flight limit")
+
+def find_regressions(report: Dict, baseline: Dict, tolerance: float = 0.2) -> List[str]:
+    """Endpoints whose p99 latency, error rate or throughput regressed beyond ``tolerance``"""
+    regressions = []
+    for name, base in baseline["endpoints"].items():
+        current = report["endpoints"].get(name)
+        if current is None:
+            regressions.append(f"{name}: missing from this run")
+            continue
+        if current["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {current['p99_ms']:.1f}ms vs baseline {base['p99_ms']:.1f}ms")
+        if current["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {current['error_rate']:.2%} vs baseline {base['error_rate']:.2%}")
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {current['throughput_rps']:.1f}/s vs baseline {base['throughput_rps']:.1f}/s"
+            )
+    return regressions
+
 async def main():
     """Main function to run the simulation"""
     import argparse
@@ -142,11 +355,59 @@ async def main():
         default=10,
         help="Simulation duration in minutes"
     )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Run the open-loop load generator instead of simulating devices"
+    )
+    parser.add_argument("--devices", type=int, default=10000, help="Synthetic devices in benchmark mode")
+    parser.add_argument("--rate", type=float, default=500.0, help="Write requests per second")
+    parser.add_argument(
+        "--arrival", choices=("poisson", "constant"), default="poisson",
+        help="Inter-arrival time distribution"
+    )
+    parser.add_argument(
+        "--skew", type=float, default=1.0,
+        help="Device popularity skew (1.0 = every device beats equally often)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=0,
+        help="Send this many heartbeats per POST /heartbeats instead of single POST /heartbeat"
+    )
+    parser.add_argument("--read-rate", type=float, default=2.0, help="GET /devices and GET /metrics per second each")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Client-side cap on outstanding requests")
+    parser.add_argument("--seconds", type=int, default=30, help="Benchmark duration in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible runs")
+    parser.add_argument("--report", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Fail if this run regresses against a previous JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression vs the baseline")
     
     args = parser.parse_args()
     
+    if args.benchmark:
+        generator = LoadGenerator(
+            args.url, devices=args.devices, rate=args.rate, arrival=args.arrival, skew=args.skew,
+            batch_size=args.batch_size, read_rate=args.read_rate, max_in_flight=args.max_in_flight,
+            seed=args.seed
+        )
+        report = await generator.run(args.seconds)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"📝 Report written to {args.report}")
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = find_regressions(report, json.load(f), args.tolerance)
+            for regression in regressions:
+                print(f"❌ Regression: {regression}")
+            if regressions:
+                return 1
+            print("✅ No regressions against baseline")
+        return 0
+    
     simulator = IoTDeviceSimulator(args.url)
     await simulator.run_simulation(args.duration)
+    return 0
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    sys.exit(asyncio.run(main())) 
\ No newline at end of file
@@ -0,0 +1,26 @@
+import os
+import time
+
+import pytest
+
+# Every test runs against the in-memory SQLite backend, migrated when the app starts
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["UDP_ENABLED"] = "false"
+# Reads see each write at once instead of the next snapshot generation
+os.environ["SNAPSHOT_INTERVAL"] = "0"
+
+READY_TIMEOUT = 30  # seconds for the app to prepare the database and seed its state
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The app on in-memory storage, started once and ready for requests"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    with TestClient(app) as client:
+        deadline = time.monotonic() + READY_TIMEOUT
+        while client.get("/readyz").status_code != 200:
+            assert time.monotonic() < deadline, "app not ready"
+            time.sleep(0.05)
+        yield client
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+
+from app.admission import admission_controller
+
+
+@pytest.fixture
+def admission(client):
+    """The app's admission controller, running with two beats per device and then one a minute"""
+    controller = admission_controller
+    saved = controller.burst, controller.min_interval, controller.max_concurrent
+
+    async def start():
+        controller.start()
+
+    controller.burst, controller.min_interval = 2, 60.0
+    client.portal.call(start)
+    yield controller
+    client.portal.call(controller.stop)
+    controller.burst, controller.min_interval, controller.max_concurrent = saved
+    controller.buckets.clear()
+
+
+def test_beats_beyond_the_burst_are_coalesced(client, admission):
+    for _ in range(admission.burst):
+        assert client.post("/heartbeat", json={"device_id": "admit-1", "battery_level": 80}).status_code == 200
+    stored = client.get("/devices/admit-1").json()
+
+    response = client.post("/heartbeat", json={"device_id": "admit-1", "battery_level": 10})
+    assert response.status_code == 202
+    body = response.json()
+    assert (body["status"], body["coalesced"]) == ("online", True)
+
+    # The flush moves last_seen only; the coalesced battery reading is dropped
+    assert client.portal.call(admission.flush) == 1
+    device = client.get("/devices/admit-1").json()
+    assert datetime.fromisoformat(device["last_seen"]) > datetime.fromisoformat(stored["last_seen"])
+    assert device["battery_level"] == 80
+
+
+def test_batch_coalesces_devices_out_of_tokens(client, admission):
+    batch = [{"device_id": "admit-batch-1"}, {"device_id": "admit-batch-2"}]
+    for _ in range(admission.burst):
+        assert client.post("/heartbeats", json=batch[:1]).status_code == 200
+    body = client.post("/heartbeats", json=batch).json()
+    assert (body["received"], body["accepted"], body["coalesced"]) == (2, 1, 1)
+    assert [row["device_id"] for row in body["results"]] == ["admit-batch-2"]
+
+
+def test_bumps_for_deleted_devices_are_dropped(client, admission):
+    admission.coalesce("admit-never-stored", datetime.utcnow())
+    assert client.portal.call(admission.flush) == 0
+    assert client.get("/devices/admit-never-stored").status_code == 404
+
+
+def test_writes_beyond_the_limit_get_429(client, admission):
+    admission.max_concurrent = 1
+    with admission.slot():
+        response = client.post("/heartbeat", json={"device_id": "admit-busy"})
+        batch_response = client.post("/heartbeats", json=[{"device_id": "admit-busy"}])
+    assert response.status_code == batch_response.status_code == 429
+    retry_after = response.json()["retry_after"]
+    assert admission.retry_base <= retry_after <= admission.retry_base * (1 + admission.retry_jitter)
+    assert int(response.headers["Retry-After"]) >= retry_after
+    assert client.post("/heartbeat", json={"device_id": "admit-free"}).status_code == 200
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.anomaly import AnomalyEngine, anomaly_engine, timestamp
+
+START = datetime(2024, 1, 1, 12, 0)
+
+
+def beats(engine, slot, times, batteries=None):
+    count = len(times)
+    batteries = np.full(count, np.nan, np.float32) if batteries is None else np.asarray(batteries, np.float32)
+    engine.observe_many(np.full(count, slot), np.asarray(times, np.float64), batteries)
+
+
+def test_silence_scored_against_usual_interval():
+    """A device beating every 60s has a 6s scale floor, so 84s of silence scores (84 - 60) / 6"""
+    engine = AnomalyEngine(capacity=4, min_samples=5)
+    slot = engine._assign("dev-1")
+    start = timestamp(START)
+    beats(engine, slot, [start + 60 * i for i in range(10)])
+
+    assert engine.gap_mean[slot] == pytest.approx(60)
+    assert engine.gap_var[slot] == pytest.approx(0)
+    last = start + 60 * 9
+    engine.score_all(last + 84)
+    assert engine.score_of("dev-1") == pytest.approx(4.0)
+    engine.score_all(last + 30)
+    assert engine.score_of("dev-1") == 0
+
+
+def test_out_of_order_heartbeats_applied_in_time_order():
+    """Several heartbeats per device in one batch fold in time order, older duplicates ignored"""
+    engine = AnomalyEngine(capacity=4)
+    slot = engine._assign("dev-1")
+    start = timestamp(START)
+    beats(engine, slot, [start + 20, start, start + 10, start + 10])
+
+    assert engine.last_seen[slot] == start + 20
+    assert engine.gap_count[slot] == 2
+    assert engine.gap_mean[slot] == pytest.approx(10)
+
+
+def test_battery_drain_rate_scored():
+    """Drain is sampled over windows of drain_window seconds and scored against its own history"""
+    engine = AnomalyEngine(capacity=4, min_samples=3, drain_window=300)
+    slot = engine._assign("dev-1")
+    start = timestamp(START)
+    # 1% per 5 minutes is 12%/h, then 10% in the next 5 minutes is 120%/h
+    levels = [100, 99, 98, 97, 96, 86]
+    beats(engine, slot, [start + 300 * i for i in range(len(levels))], levels)
+
+    assert engine.drain_count[slot] == 5
+    # Four steady samples: mean 12, no variance, so the scale is the 1%/h floor
+    assert engine.drain_score[slot] == pytest.approx(120 - 12)
+
+
+def test_new_slots_scored_once_arrays_grow():
+    """Slots assigned past capacity read as unscored until a pass grows the arrays"""
+    engine = AnomalyEngine(capacity=2, min_samples=1)
+    start = timestamp(START)
+    for device_id in ("dev-0", "dev-1"):
+        beats(engine, engine._assign(device_id), [start, start + 60])
+    late = engine._assign("dev-2")
+
+    assert engine.score_of("dev-2") is None
+    engine.score(datetime(2024, 1, 1, 12, 2))
+    assert engine.capacity == 4
+    assert engine.gap_mean[:2] == pytest.approx([60, 60])
+    assert np.isnan(engine.last_seen[late])
+    assert engine.score_of("dev-0") == pytest.approx(0)
+
+
+def test_device_responses_carry_the_engine_score(client, monkeypatch):
+    client.post("/heartbeat", json={"device_id": "scored-1"})
+    monkeypatch.setattr(anomaly_engine, "score_of", lambda device_id: 2.5 if device_id == "scored-1" else None)
+
+    assert client.get("/devices/scored-1").json()["anomaly_score"] == 2.5
+    assert client.post("/heartbeat", json={"device_id": "scored-1"}).json()["anomaly_score"] == 2.5
+    page = client.get("/devices", params={"fields": "device_id,anomaly_score", "limit": 1000}).json()
+    assert {"device_id": "scored-1", "anomaly_score": 2.5} in page["devices"]
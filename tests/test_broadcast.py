@@ -0,0 +1,21 @@
+import asyncio
+import json
+import threading
+
+from app.broadcast import Broadcaster
+
+
+def test_publish_from_worker_thread_reaches_subscriber():
+    """Events published off the loop are delivered through the loop, not straight into the queue"""
+    broadcaster = Broadcaster()
+
+    async def main():
+        with broadcaster.subscribe() as queue:
+            thread = threading.Thread(target=broadcaster.publish, args=("transition", {"device_id": "dev-1"}))
+            thread.start()
+            thread.join()
+            return await asyncio.wait_for(queue.get(), 1)
+
+    event_id, event, payload = asyncio.run(main())
+    assert (event_id, event) == (1, "transition")
+    assert json.loads(payload) == {"device_id": "dev-1"}
@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+
+import pytest
+
+from app.bulk import IMPORT_COLUMNS
+
+LOCATION = "bulk-site"
+
+
+def import_devices(client, body, content_type):
+    """Final progress line of an import"""
+    response = client.post("/devices/import", content=body, headers={"Content-Type": content_type})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    assert lines[-1]["stage"] == "done", lines[-1]
+    return lines[-1]
+
+
+def export_devices(client, format, fields=",".join(IMPORT_COLUMNS)):
+    response = client.get("/devices/export", params={"format": format, "location": LOCATION, "fields": fields})
+    assert response.status_code == 200
+    return response.content
+
+
+def test_csv_export_imports_back_unchanged(client):
+    rows = [(f"bulk-{i:03d}", f"Bulk {i}", LOCATION, 30 + i) for i in range(40)]
+    upload = io.StringIO()
+    writer = csv.writer(upload)
+    writer.writerow(IMPORT_COLUMNS)
+    writer.writerows(rows)
+    writer.writerow(["bulk-bad", "Bad interval", LOCATION, 0])
+    writer.writerow(["", "No id", LOCATION, 60])
+
+    summary = import_devices(client, upload.getvalue().encode(), "text/csv")
+    assert (summary["created"], summary["updated"], summary["rejected"]) == (40, 0, 2)
+    assert len(summary["errors"]) == 2
+
+    exported = export_devices(client, "csv")
+    parsed = list(csv.reader(io.StringIO(exported.decode())))
+    assert tuple(parsed[0]) == IMPORT_COLUMNS
+    assert sorted(tuple(row) for row in parsed[1:]) == [tuple(map(str, row)) for row in rows]
+
+    # Importing the export again updates every device and changes nothing
+    summary = import_devices(client, exported, "text/csv")
+    assert (summary["created"], summary["updated"], summary["rejected"]) == (0, 40, 0)
+    assert sorted(export_devices(client, "csv").splitlines()) == sorted(exported.splitlines())
+
+
+def test_ndjson_round_trip_keeps_heartbeat_state(client):
+    client.post("/heartbeats", json=[{"device_id": "bulk-beating", "battery_level": 42, "location": LOCATION}])
+    body = json.dumps({"device_id": "bulk-beating", "name": "Renamed", "expected_interval": 120}) + "\n"
+    summary = import_devices(client, body.encode(), "application/x-ndjson")
+    assert (summary["created"], summary["updated"]) == (0, 1)
+
+    exported = [json.loads(line) for line in export_devices(client, "ndjson", "device_id,name,battery_level").splitlines()]
+    device = next(device for device in exported if device["device_id"] == "bulk-beating")
+    assert device == {"device_id": "bulk-beating", "name": "Renamed", "battery_level": 42.0}
+
+
+def test_parquet_export(client):
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pq.read_table(io.BytesIO(export_devices(client, "parquet", "device_id,expected_interval")))
+    assert table.column_names == ["device_id", "expected_interval"]
+    assert table.num_rows == len(set(table.column("device_id").to_pylist()))
+
+
+def test_bad_import_and_export_requests(client):
+    assert client.post("/devices/import", content=b"{}", headers={"Content-Type": "application/xml"}).status_code == 415
+    assert client.get("/devices/export", params={"format": "xml"}).status_code == 400
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from prometheus_client import REGISTRY
+
+from app.detector import StatusDetector
+from app.models import AT_RISK_TIMEOUT_MINUTES
+
+
+def transitions_counted(from_status, to_status):
+    labels = {"from_status": from_status, "to_status": to_status}
+    return REGISTRY.get_sample_value("iot_status_transitions_total", labels) or 0
+
+
+def test_transition_counted_once_across_workers():
+    """Every worker detects a shared device's transitions, but only the leader counts them"""
+    leader, follower = StatusDetector(), StatusDetector()
+    follower.writes_enabled = False
+    seen = datetime(2024, 1, 1, 12, 0)
+    before = transitions_counted("online", "at-risk")
+
+    for detector in (leader, follower):
+        detector.observe("dev-1", seen, battery_level=90, now=seen)
+        detector.expire(now=seen + timedelta(minutes=AT_RISK_TIMEOUT_MINUTES, seconds=1))
+        assert detector.devices["dev-1"].status == "at-risk"
+
+    assert transitions_counted("online", "at-risk") - before == 1
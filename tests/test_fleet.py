@@ -0,0 +1,21 @@
+from app.database import SessionLocal
+from app.fleet import BATTERY_HISTOGRAM, refresh_fleet_summary
+from app.models import FleetLocationSummary
+
+
+def test_battery_histogram_bands(client):
+    levels = [5, 19.9, 20, 49, 50, 80, 100, None]
+    client.post("/heartbeats", json=[
+        {"device_id": f"fleet-{i}", "battery_level": level, "location": "fleet-site"} for i, level in enumerate(levels)
+    ])
+    with SessionLocal() as db:
+        refresh_fleet_summary(db)
+        row = db.get(FleetLocationSummary, "fleet-site")
+        bands = [getattr(row, column) for column in BATTERY_HISTOGRAM.values()]
+    assert bands == [2, 2, 1, 2, 1]
+
+    summary = client.get("/fleet/summary").json()
+    assert list(summary["battery_histogram"]) == list(BATTERY_HISTOGRAM) == ["<20", "20..50", "50..80", ">=80", "unknown"]
+    location = next(row for row in summary["locations"] if row["location"] == "fleet-site")
+    assert location["total"] == len(levels)
+    assert location["battery_min"] == 5
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.history import HistoryWriter, missing_partition
+from app.models import HeartbeatEvent
+
+
+def integrity_error(message):
+    return IntegrityError("INSERT INTO heartbeat_events ...", {}, Exception(message))
+
+
+def test_only_missing_partitions_are_retried():
+    assert missing_partition(integrity_error('no partition of relation "heartbeat_events" found for row'))
+    assert not missing_partition(integrity_error('duplicate key value violates unique constraint'))
+    assert not missing_partition(ValueError('no partition of relation "heartbeat_events" found for row'))
+
+
+def test_events_already_recorded_are_skipped(client):
+    recorded_at = datetime(2024, 1, 1, 12, 0)
+    event = {"device_id": "history-dup", "recorded_at": recorded_at, "battery_level": 50.0, "signal_strength": None}
+
+    HistoryWriter._write([event, dict(event)])
+    HistoryWriter._write([event])
+
+    with SessionLocal() as db:
+        count = db.scalar(
+            select(func.count()).select_from(HeartbeatEvent).where(HeartbeatEvent.device_id == "history-dup")
+        )
+    assert count == 1
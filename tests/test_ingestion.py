@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta
+
+from app.ingestion import coalesce_heartbeats, parse_heartbeat_batch
+from app.main import HEARTBEAT_BATCH_MAX
+
+
+def test_coalesce_later_non_null_values_win():
+    heartbeats = parse_heartbeat_batch(json.dumps([
+        {"device_id": "dev-1", "battery_level": 80, "location": "Lab"},
+        {"device_id": "dev-2", "battery_level": 50},
+        {"device_id": "dev-1", "battery_level": 70, "name": ""},
+    ]).encode(), "application/json")
+    seen_at = datetime(2024, 1, 1, 12, 0)
+
+    records = coalesce_heartbeats(heartbeats, seen_at)
+
+    assert list(records) == ["dev-1", "dev-2"]
+    assert records["dev-1"]["battery_level"] == 70
+    assert records["dev-1"]["location"] == "Lab"
+    assert records["dev-1"]["name"] is None
+    assert records["dev-1"]["last_seen"] == seen_at
+
+
+def test_batch_upsert_creates_then_updates(client):
+    response = client.post("/heartbeats", json=[
+        {"device_id": "upsert-1", "name": "Pump", "battery_level": 90, "location": "Hall"},
+        {"device_id": "upsert-2", "battery_level": 10},
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["received"], body["accepted"]) == (2, 2)
+    assert {row["device_id"]: (row["status"], row["created"]) for row in body["results"]} == {
+        "upsert-1": ("online", True), "upsert-2": ("at-risk", True)
+    }
+
+    # Fields left out, or sent empty, keep their stored values
+    response = client.post("/heartbeats", json=[
+        {"device_id": "upsert-1", "name": "", "battery_level": 15},
+        {"device_id": "upsert-2", "battery_level": 60},
+    ])
+    assert not any(row["created"] for row in response.json()["results"])
+    first, second = client.get("/devices/upsert-1").json(), client.get("/devices/upsert-2").json()
+    assert (first["name"], first["location"], first["battery_level"], first["status"]) == ("Pump", "Hall", 15, "at-risk")
+    assert (second["battery_level"], second["status"]) == (60, "online")
+
+
+def test_batch_accepts_ndjson(client):
+    body = "\n".join(json.dumps({"device_id": f"ndjson-{i}", "battery_level": 50}) for i in range(3))
+    response = client.post("/heartbeats", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 3
+
+
+def test_batch_rejects_invalid_and_oversized_batches(client):
+    assert client.post("/heartbeats", json=[{"battery_level": 50}]).status_code == 422
+    oversized = [{"device_id": f"big-{i}"} for i in range(HEARTBEAT_BATCH_MAX + 1)]
+    assert client.post("/heartbeats", json=oversized).status_code == 413
+
+
+def test_upsert_stamps_rows_with_the_application_clock(client):
+    before = datetime.utcnow()
+    client.post("/heartbeats", json=[{"device_id": "clock-1"}])
+    created = client.get("/devices/clock-1").json()
+    client.post("/heartbeats", json=[{"device_id": "clock-1"}])
+    updated = client.get("/devices/clock-1").json()
+
+    assert before <= datetime.fromisoformat(created["updated_at"]) <= datetime.utcnow()
+    assert updated["created_at"] == created["created_at"]
+    assert updated["updated_at"] > created["updated_at"]
+    last_seen, updated_at = datetime.fromisoformat(updated["last_seen"]), datetime.fromisoformat(updated["updated_at"])
+    assert abs(updated_at - last_seen) < timedelta(seconds=1)
@@ -0,0 +1,28 @@
+from prometheus_client import CollectorRegistry, Gauge
+
+from app import metrics
+from app.metrics import remove_series
+
+
+def sample(registry, device_id):
+    return registry.get_sample_value("test_device_reading", {"device_id": device_id})
+
+
+def test_removed_series_is_not_recreated(monkeypatch):
+    monkeypatch.setattr(metrics, "MULTIPROCESS", True)
+    registry = CollectorRegistry()
+    gauge = Gauge("test_device_reading", "Reading", ["device_id"], registry=registry)
+    gauge.labels(device_id="dev-1").set(42)
+
+    remove_series(gauge, "dev-1")
+    remove_series(gauge, "never-set")
+
+    assert sample(registry, "dev-1") is None
+    assert sample(registry, "never-set") is None
+
+
+def test_metrics_endpoints_render(client):
+    client.post("/heartbeat", json={"device_id": "metrics-1", "battery_level": 70})
+    assert "iot_heartbeat_total" in client.get("/metrics").text
+    body = client.get("/metrics/devices", params={"device_id": "metrics-1"}).text
+    assert 'iot_device_battery_level{device_id="metrics-1"} 70.0' in body
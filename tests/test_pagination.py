@@ -0,0 +1,83 @@
+import pytest
+
+from app.crud import decode_cursor, encode_cursor
+
+LOCATION = "pagination-site"
+DEVICE_IDS = [f"page-{i:03d}" for i in range(25)]
+
+
+@pytest.fixture(scope="module")
+def fleet(client):
+    # Two batches: devices within a batch share last_seen, so pages must break ties on id
+    for half in (DEVICE_IDS[:12], DEVICE_IDS[12:]):
+        response = client.post("/heartbeats", json=[{"device_id": device_id, "location": LOCATION} for device_id in half])
+        assert response.status_code == 200
+    return DEVICE_IDS
+
+
+def walk(client, **params):
+    """Device ids of every page of a listing, and the number of pages"""
+    ids, pages, cursor = [], 0, None
+    while True:
+        page = client.get("/devices", params=dict(params, location=LOCATION, **({"cursor": cursor} if cursor else {})))
+        assert page.status_code == 200
+        body = page.json()
+        assert body["count"] == len(body["devices"])
+        ids += [device["device_id"] for device in body["devices"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize("order", ["device_id", "last_seen", "-last_seen"])
+def test_pages_cover_every_device_once(client, fleet, order):
+    ids, pages = walk(client, order=order, limit=10)
+    assert sorted(ids) == fleet
+    assert pages == 3
+    if order == "device_id":
+        assert ids == fleet
+
+
+def test_last_seen_orders_are_reverses(client, fleet):
+    ascending, _ = walk(client, order="last_seen", limit=7)
+    descending, _ = walk(client, order="-last_seen", limit=7)
+    assert descending == ascending[::-1]
+
+
+def test_last_page_has_no_cursor(client, fleet):
+    body = client.get("/devices", params={"location": LOCATION, "limit": len(fleet)}).json()
+    assert body["count"] == len(fleet)
+    assert body["next_cursor"] is None
+
+
+def test_field_projection(client, fleet):
+    body = client.get("/devices", params={"location": LOCATION, "limit": 2, "fields": "device_id,status"}).json()
+    assert [set(device) for device in body["devices"]] == [{"device_id", "status"}] * 2
+    assert client.get("/devices", params={"fields": "device_id,secret"}).status_code == 400
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("page-007", 7), "device_id") == ("page-007", 7)
+
+
+@pytest.mark.parametrize("value, row_id, sort_key", [
+    ([1, 2], 7, "device_id"),
+    (5, 7, "device_id"),
+    ("page-007", "7", "device_id"),
+    ("page-007", 7, "last_seen"),
+])
+def test_cursor_of_the_wrong_type_rejected(value, row_id, sort_key):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(value, row_id), sort_key)
+
+
+@pytest.mark.parametrize("params", [
+    {"cursor": "not a cursor"},
+    {"cursor": encode_cursor([1, 2], 7)},
+    {"cursor": encode_cursor("page-007", 7), "order": "-last_seen"},
+    {"order": "name"},
+    {"limit": 0},
+])
+def test_bad_listing_parameters_rejected(client, params):
+    assert client.get("/devices", params=params).status_code in (400, 422)
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+import pytest
+
+from app.database import engine
+from check_query_plans import full_scans, hot_queries, plan_scans, seed
+
+# Enough rows for ANALYZE to make the planner prefer the indexes it would use on a real fleet
+SEED_DEVICES = 20_000
+
+NOW = datetime.utcnow()
+
+
+@pytest.fixture(scope="module")
+def seeded(client):
+    """A connection holding a synthetic fleet, rolled back after the module"""
+    with engine.connect() as conn:
+        seed(conn, SEED_DEVICES, NOW)
+        yield conn
+        conn.rollback()
+
+
+@pytest.mark.parametrize("name, statement", hot_queries(NOW), ids=[name for name, _ in hot_queries(NOW)])
+def test_hot_query_uses_an_index(seeded, name, statement):
+    scans = plan_scans(seeded, statement)
+    assert not full_scans(scans, statement), scans
@@ -0,0 +1,50 @@
+from app.snapshot import etag_matches, negotiate_encoding
+
+
+def test_etag_matching():
+    assert etag_matches('"abc"', "abc")
+    assert etag_matches('W/"abc-gzip"', "abc")
+    assert etag_matches('"xyz", "abc-br"', "abc")
+    assert etag_matches("*", "abc")
+    assert not etag_matches('"abcd"', "abc")
+
+
+def test_encoding_negotiation():
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("identity") is None
+
+
+def test_unchanged_counts_answer_304(client):
+    client.post("/heartbeat", json={"device_id": "etag-1"})
+    first = client.get("/devices/counts")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    repeat = client.get("/devices/counts", headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.content == b""
+    assert repeat.headers["ETag"] == etag
+
+    # A heartbeat from a new device changes the counts, and with them the tag
+    client.post("/heartbeat", json={"device_id": "etag-2"})
+    changed = client.get("/devices/counts", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["total_count"] == first.json()["total_count"] + 1
+
+
+def test_compressed_listing_tagged_per_coding(client):
+    client.post("/heartbeats", json=[{"device_id": f"etag-gzip-{i:02d}", "location": "etag-site"} for i in range(30)])
+    params = {"location": "etag-site"}
+    compressed = client.get("/devices", params=params, headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"].endswith('-gzip"')
+    assert compressed.json()["count"] == 30
+
+    identity = client.get("/devices", params=params, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["ETag"] == compressed.headers["ETag"].replace("-gzip", "")
+    # Either representation's tag revalidates the other
+    revalidated = client.get("/devices", params=params, headers={"If-None-Match": compressed.headers["ETag"]})
+    assert revalidated.status_code == 304
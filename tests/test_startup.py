@@ -0,0 +1,54 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from sqlalchemy import create_engine
+
+from bench_startup import fill_devices, wait_for
+
+DEVICES = 20_000
+BUDGET = 10.0  # seconds from process start until /readyz answers 200
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_cold_start_live_at_once_and_ready_within_budget(tmp_path):
+    """A fresh process on a stored SQLite fleet answers /livez before seeding and /readyz within the budget"""
+    database_url = f"sqlite:///{tmp_path / 'iot.db'}"
+    env = dict(os.environ, DATABASE_URL=database_url, UDP_ENABLED="false")
+    subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], env=env, check=True, capture_output=True)
+    bind = create_engine(database_url)
+    try:
+        assert fill_devices(DEVICES, bind) == DEVICES
+    finally:
+        bind.dispose()
+
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL
+    )
+    try:
+        deadline = started + BUDGET * 3
+        live = wait_for(f"{base}/livez", deadline, process)
+        ready = wait_for(f"{base}/readyz", deadline, process) if live else None
+        assert live is not None and ready is not None, "not ready"
+        with urllib.request.urlopen(f"{base}/health", timeout=5) as response:
+            health = json.load(response)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    assert live <= ready
+    assert ready - started < BUDGET
+    assert health["total_devices"] == DEVICES
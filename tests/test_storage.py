@@ -0,0 +1,129 @@
+"""The storage conformance checks of bench_storage.py, run in-process on in-memory SQLite"""
+import csv
+import io
+import json
+import time
+
+import pytest
+
+LOCATION = "conformance-site"
+
+
+def eventually(check, timeout=10.0):
+    """Retry ``check()`` until its assertions pass (history is written behind)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return check()
+        except AssertionError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def list_all(client, **params):
+    """Every device of a paginated listing"""
+    devices, cursor = [], None
+    while True:
+        response = client.get("/devices", params=dict(params, limit=20, **({"cursor": cursor} if cursor else {})))
+        assert response.status_code == 200
+        page = response.json()
+        devices += page["devices"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return devices
+
+
+@pytest.fixture(scope="module")
+def fleet(client):
+    """A single device, a batch of 50 and 20 imported devices at one location"""
+    response = client.post("/heartbeat", json={
+        "device_id": "conf-single", "battery_level": 50.0, "signal_strength": -60.0, "location": LOCATION
+    })
+    assert response.status_code in (200, 202)
+
+    batch = [
+        {"device_id": f"conf-b{i:03d}", "battery_level": float(i * 2), "signal_strength": -70.0, "location": LOCATION}
+        for i in range(50)
+    ]
+    batch.append({"device_id": "conf-b000", "battery_level": 95.0})
+    response = client.post("/heartbeats", json=batch)
+    assert response.status_code in (200, 202)
+    body = response.json()
+    assert body["received"] == 51
+    if response.status_code == 200:
+        assert body["accepted"] == 50
+        assert all(result["created"] for result in body["results"])
+
+    upload = io.StringIO()
+    writer = csv.writer(upload)
+    writer.writerow(["device_id", "name", "location", "expected_interval"])
+    writer.writerows([f"conf-imp{i:03d}", f"Imported {i}", LOCATION, 60] for i in range(20))
+    writer.writerow(["conf-b001", "Renamed", "", ""])
+    writer.writerow(["", "no id", "", ""])
+    response = client.post("/devices/import", content=upload.getvalue().encode(), headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    return json.loads(response.text.strip().splitlines()[-1])
+
+
+def test_single_heartbeat_readable(client, fleet):
+    device = client.get("/devices/conf-single").json()
+    assert device["battery_level"] == 50.0
+    assert device["status"] == "online"
+    assert device["location"] == LOCATION
+
+
+def test_repeated_batch_reports_existing_devices(client, fleet):
+    response = client.post("/heartbeats", json=[{"device_id": f"conf-b{i:03d}"} for i in range(1, 11)])
+    if response.status_code == 200:
+        assert not any(result["created"] for result in response.json()["results"])
+
+
+def test_listing_complete_and_ordered(client, fleet):
+    devices = [device for device in list_all(client, location=LOCATION) if device["device_id"].startswith("conf-b")]
+    ids = [device["device_id"] for device in devices]
+    assert len(ids) == 50 and len(set(ids)) == 50
+    assert ids == sorted(ids)
+    # The later value in a batch wins, and low battery is at-risk
+    assert devices[0]["battery_level"] == 95.0
+    assert sum(device["status"] == "at-risk" for device in devices) == 9
+
+
+def test_battery_filter(client, fleet):
+    page = client.get("/devices", params={"location": LOCATION, "battery_below": 10, "order": "last_seen"}).json()
+    assert page["count"] == 4
+
+
+def test_import_creates_and_updates(client, fleet):
+    assert fleet["stage"] == "done"
+    assert (fleet["created"], fleet["updated"], fleet["rejected"]) == (20, 1, 1)
+    device = client.get("/devices/conf-b001").json()
+    # Provisioning does not overwrite heartbeat state
+    assert device["name"] == "Renamed"
+    assert device["battery_level"] == 2.0
+
+
+def test_export_every_device_once(client, fleet):
+    response = client.get("/devices/export", params={"format": "ndjson", "location": LOCATION})
+    assert response.status_code == 200
+    exported = [json.loads(line) for line in response.text.splitlines() if line]
+    assert len(exported) == len({device["device_id"] for device in exported}) == 71
+
+
+def test_history_recorded(client, fleet):
+    def recorded():
+        response = client.get("/devices/conf-single/history", params={"bucket_seconds": 3600})
+        assert response.status_code == 200
+        assert sum(bucket["count"] for bucket in response.json()["buckets"]) >= 1
+    eventually(recorded)
+
+
+def test_counts_and_fleet_summary(client, fleet):
+    assert client.get("/devices/counts").json()["at_risk_count"] >= 9
+    assert "status_counts" in client.get("/fleet/summary").json()
+
+
+def test_deleted_device_gone(client, fleet):
+    client.post("/heartbeat", json={"device_id": "conf-deleted"})
+    assert client.delete("/devices/conf-deleted").status_code == 200
+    assert client.get("/devices/conf-deleted").status_code == 404
@@ -0,0 +1,66 @@
+import pytest
+
+from app.udp import UdpHeartbeatListener, encode_heartbeat, sign
+
+KEY = b"test-secret"
+
+
+def accepted(listener):
+    return [heartbeat.device_id for _, heartbeat in listener.pending]
+
+
+def test_signed_replay_of_older_datagram_is_dropped():
+    listener = UdpHeartbeatListener(key=KEY.decode())
+    captured = encode_heartbeat("dev-1", 1, battery_level=80.0, key=KEY)
+
+    listener.receive(captured)
+    listener.receive(encode_heartbeat("dev-1", 2, battery_level=79.0, key=KEY))
+    # Replayed after a newer sequence number has arrived
+    listener.receive(captured)
+
+    assert len(accepted(listener)) == 2
+
+
+def test_signed_sequence_wraps_around():
+    listener = UdpHeartbeatListener(key=KEY.decode())
+
+    for seq in (2**32 - 1, 0, 1):
+        listener.receive(encode_heartbeat("dev-1", seq, key=KEY))
+
+    assert len(accepted(listener)) == 3
+
+
+def test_unsigned_device_may_restart_its_sequence():
+    listener = UdpHeartbeatListener(key="")
+
+    for seq in (5, 5, 0):
+        listener.receive(encode_heartbeat("dev-1", seq))
+
+    assert len(accepted(listener)) == 2
+
+
+def test_signed_device_restarts_its_sequence_after_a_reboot():
+    listener = UdpHeartbeatListener(key=KEY.decode())
+    before_reboot = encode_heartbeat("dev-1", 1000, key=KEY, boot=7)
+
+    listener.receive(before_reboot)
+    # Without a new boot counter a restart from 0 looks like a replay
+    listener.receive(encode_heartbeat("dev-1", 0, key=KEY, boot=7))
+    listener.receive(encode_heartbeat("dev-1", 0, key=KEY, boot=8))
+    listener.receive(encode_heartbeat("dev-1", 1, key=KEY, boot=8))
+    # Datagrams from an earlier boot, or without a boot counter, are replays
+    listener.receive(before_reboot)
+    listener.receive(encode_heartbeat("dev-1", 2, key=KEY))
+
+    assert len(accepted(listener)) == 3
+
+
+def test_signed_msgpack_boot_counter():
+    msgpack = pytest.importorskip("msgpack")
+    listener = UdpHeartbeatListener(key=KEY.decode())
+
+    for boot, seq in ((1, 50), (2, 0), (1, 51)):
+        payload = msgpack.packb({"device_id": "dev-1", "boot": boot, "seq": seq})
+        listener.receive(payload + sign(payload, KEY))
+
+    assert len(accepted(listener)) == 2